@@ -0,0 +1,37 @@
+"""mailing and user indexes
+
+Revision ID: 3f1c2a7d9b04
+Revises: 8952d7fab0b8
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1c2a7d9b04"
+down_revision: Union[str, Sequence[str], None] = "8952d7fab0b8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_mailing_pending_send_at",
+        "mailing",
+        ["send_at"],
+        unique=False,
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+    op.create_index("ix_user_role", "user", ["role"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_user_role", table_name="user")
+    op.drop_index("ix_mailing_pending_send_at", table_name="mailing")
@@ -0,0 +1,62 @@
+"""table version counters for etags
+
+Revision ID: 7c4e9d2b1a60
+Revises: 3f1c2a7d9b04
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7c4e9d2b1a60"
+down_revision: Union[str, Sequence[str], None] = "3f1c2a7d9b04"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+VERSIONED_TABLES = ("mailing", "user")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "table_version",
+        sa.Column("table_name", sa.String(length=64), nullable=False),
+        sa.Column("version", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("table_name"),
+    )
+    op.execute(
+        """
+        CREATE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO table_version (table_name, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name)
+            DO UPDATE SET version = table_version.version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    for table in VERSIONED_TABLES:
+        op.execute(
+            f"INSERT INTO table_version (table_name, version) VALUES ('{table}', 0)"
+        )
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_bump_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{table}"
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()
+            """
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in VERSIONED_TABLES:
+        op.execute(f'DROP TRIGGER IF EXISTS {table}_bump_version ON "{table}"')
+    op.execute("DROP FUNCTION IF EXISTS bump_table_version()")
+    op.drop_table("table_version")
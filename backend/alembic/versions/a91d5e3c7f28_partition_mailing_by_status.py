@@ -0,0 +1,123 @@
+"""partition mailing by status and add mailing archive
+
+Revision ID: a91d5e3c7f28
+Revises: 7c4e9d2b1a60
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a91d5e3c7f28"
+down_revision: Union[str, Sequence[str], None] = "7c4e9d2b1a60"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MAILING_COLUMNS = "name, send_at, extra, message, status, creator_id, id, created_at"
+
+
+def _create_mailing(primary_key: str, options: str = "") -> None:
+    op.execute(
+        f"""
+        CREATE TABLE mailing (
+            name VARCHAR(128) NOT NULL,
+            send_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            extra JSONB NOT NULL,
+            message TEXT NOT NULL,
+            status mailingstatus NOT NULL,
+            creator_id INTEGER NOT NULL REFERENCES "user" (id) ON DELETE CASCADE,
+            id INTEGER NOT NULL DEFAULT nextval('mailing_id_seq'),
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            CONSTRAINT mailing_pkey PRIMARY KEY ({primary_key})
+        ) {options}
+        """
+    )
+
+
+def _detach_old_mailing() -> None:
+    """Переименовывает текущую mailing, освобождая имена для новой таблицы"""
+    op.execute("DROP TRIGGER IF EXISTS mailing_bump_version ON mailing")
+    op.execute("DROP INDEX IF EXISTS ix_mailing_pending_send_at")
+    op.execute("ALTER TABLE mailing RENAME TO mailing_old")
+    op.execute(
+        "ALTER TABLE mailing_old RENAME CONSTRAINT mailing_pkey TO mailing_old_pkey"
+    )
+
+
+def _finish_new_mailing() -> None:
+    """Переносит данные и последовательность в новую mailing, удаляет старую"""
+    op.execute(
+        f"INSERT INTO mailing ({MAILING_COLUMNS}) "
+        f"SELECT {MAILING_COLUMNS} FROM mailing_old"
+    )
+    # Последовательность должна принадлежать новой колонке до удаления старой таблицы
+    op.execute("ALTER SEQUENCE mailing_id_seq OWNED BY mailing.id")
+    op.execute("DROP TABLE mailing_old")
+    op.create_index(
+        "ix_mailing_pending_send_at",
+        "mailing",
+        ["send_at"],
+        unique=False,
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+    op.execute(
+        """
+        CREATE TRIGGER mailing_bump_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON mailing
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()
+        """
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _detach_old_mailing()
+    _create_mailing("id, status", "PARTITION BY LIST (status)")
+    for status in ("pending", "done"):
+        op.execute(
+            f"CREATE TABLE mailing_{status} PARTITION OF mailing "
+            f"FOR VALUES IN ('{status}')"
+        )
+    # Для статусов, которые появятся позже
+    op.execute("CREATE TABLE mailing_other PARTITION OF mailing DEFAULT")
+    _finish_new_mailing()
+
+    op.create_table(
+        "mailing_archive",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("name", sa.String(length=128), nullable=False),
+        sa.Column("send_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("extra", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("message", sa.Text(), nullable=False),
+        sa.Column(
+            "status",
+            postgresql.ENUM(name="mailingstatus", create_type=False),
+            nullable=False,
+        ),
+        sa.Column("creator_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_mailing_archive_archived_at",
+        "mailing_archive",
+        ["archived_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_mailing_archive_archived_at", table_name="mailing_archive")
+    op.drop_table("mailing_archive")
+
+    _detach_old_mailing()
+    _create_mailing("id")
+    _finish_new_mailing()
@@ -0,0 +1,42 @@
+"""mailing pending page index
+
+Revision ID: b6d0e2f48a13
+Revises: f3a7c1e9d256
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b6d0e2f48a13"
+down_revision: Union[str, Sequence[str], None] = "f3a7c1e9d256"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _recreate_pending_index(*columns: str) -> None:
+    op.drop_index("ix_mailing_pending_send_at", table_name="mailing")
+    op.create_index(
+        "ix_mailing_pending_send_at",
+        "mailing",
+        list(columns),
+        unique=False,
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Ключ страницы (send_at, id) целиком в индексе: сравнение строк по нему
+    # сразу находит начало страницы
+    _recreate_pending_index("send_at", "id")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _recreate_pending_index("send_at")
@@ -0,0 +1,35 @@
+"""mailing failed status and error
+
+Revision ID: c4f8a2e6b019
+Revises: b6d0e2f48a13
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4f8a2e6b019"
+down_revision: Union[str, Sequence[str], None] = "b6d0e2f48a13"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Как и sending, строки со статусом failed попадают в секцию mailing_other
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE mailingstatus ADD VALUE IF NOT EXISTS 'failed'")
+    op.add_column("mailing", sa.Column("error", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("mailing", "error")
+    # Значение из enum остается в типе. Остановленные рассылки считаются
+    # завершенными, чтобы не уйти повторно всей аудитории
+    op.execute("UPDATE mailing SET status = 'done' WHERE status = 'failed'")
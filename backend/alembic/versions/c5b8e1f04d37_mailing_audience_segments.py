@@ -0,0 +1,39 @@
+"""mailing audience segments
+
+Revision ID: c5b8e1f04d37
+Revises: a91d5e3c7f28
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c5b8e1f04d37"
+down_revision: Union[str, Sequence[str], None] = "a91d5e3c7f28"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name in ("mailing", "mailing_archive"):
+        op.add_column(
+            table_name,
+            sa.Column(
+                "audience", postgresql.JSONB(astext_type=sa.Text()), nullable=True
+            ),
+        )
+    op.create_index("ix_user_created_at", "user", ["created_at"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_user_created_at", table_name="user")
+    for table_name in ("mailing_archive", "mailing"):
+        op.drop_column(table_name, "audience")
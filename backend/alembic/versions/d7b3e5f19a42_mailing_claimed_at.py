@@ -0,0 +1,42 @@
+"""mailing claimed_at
+
+Revision ID: d7b3e5f19a42
+Revises: c4f8a2e6b019
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d7b3e5f19a42"
+down_revision: Union[str, Sequence[str], None] = "c4f8a2e6b019"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Рассылки, уже висящие в sending, остаются с NULL: планировщик считает
+    # их брошенными и остановит на первой же проверке
+    op.add_column(
+        "mailing",
+        sa.Column("claimed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index(
+        "ix_mailing_sending_claimed_at",
+        "mailing",
+        ["claimed_at"],
+        unique=False,
+        postgresql_where=sa.text("status = 'sending'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_mailing_sending_claimed_at", table_name="mailing")
+    op.drop_column("mailing", "claimed_at")
@@ -0,0 +1,30 @@
+"""mailing_archive error
+
+Revision ID: e2a9c6d4f871
+Revises: d7b3e5f19a42
+Create Date: 2026-10-19 23:30:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e2a9c6d4f871"
+down_revision: Union[str, Sequence[str], None] = "d7b3e5f19a42"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # В архив теперь попадают и остановленные рассылки, вместе с причиной
+    op.add_column("mailing_archive", sa.Column("error", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("mailing_archive", "error")
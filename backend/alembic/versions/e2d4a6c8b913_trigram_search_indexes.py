@@ -0,0 +1,45 @@
+"""trigram search indexes
+
+Revision ID: e2d4a6c8b913
+Revises: c5b8e1f04d37
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e2d4a6c8b913"
+down_revision: Union[str, Sequence[str], None] = "c5b8e1f04d37"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TRGM_INDEXES = (
+    ("ix_user_name_trgm", "user", "name"),
+    ("ix_mailing_name_trgm", "mailing", "name"),
+    ("ix_mailing_message_trgm", "mailing", "message"),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for index_name, table_name, column_name in TRGM_INDEXES:
+        op.create_index(
+            index_name,
+            table_name,
+            [column_name],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={column_name: "gin_trgm_ops"},
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for index_name, table_name, _ in reversed(TRGM_INDEXES):
+        op.drop_index(index_name, table_name=table_name)
+    # Расширение не удаляется: им могут пользоваться другие объекты базы
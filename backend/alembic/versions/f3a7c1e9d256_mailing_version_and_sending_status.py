@@ -0,0 +1,39 @@
+"""mailing version and sending status
+
+Revision ID: f3a7c1e9d256
+Revises: e2d4a6c8b913
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f3a7c1e9d256"
+down_revision: Union[str, Sequence[str], None] = "e2d4a6c8b913"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ADD VALUE нельзя выполнять в одной транзакции с использованием значения.
+    # Строки со статусом sending попадают в секцию по умолчанию mailing_other
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE mailingstatus ADD VALUE IF NOT EXISTS 'sending'")
+    op.add_column(
+        "mailing",
+        sa.Column("version", sa.Integer(), server_default=sa.text("1"), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("mailing", "version")
+    # Значение из enum Postgres удалить не умеет, поэтому оно остается в типе.
+    # Прерванные отправки возвращаются в очередь
+    op.execute("UPDATE mailing SET status = 'pending' WHERE status = 'sending'")
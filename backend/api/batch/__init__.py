@@ -0,0 +1 @@
+from .routs import batch_router
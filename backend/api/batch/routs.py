@@ -0,0 +1,98 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi import Depends, HTTPException
+from fastapi.routing import APIRouter
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import get_session
+from api.batch.schemas import BatchRequest, BatchResponse, BatchResult
+from api.mailing.services import read_pending_mailings
+from api.users.routs import get_roles, update_user_by_tg_id
+from api.users.services import read_user
+from api.users.schemas import UserUpdate
+
+
+batch_router = APIRouter(prefix="/batch", tags=["Пакетные запросы"])
+
+
+async def _get_user(session: AsyncSession, params: Dict[str, Any]):
+    return await read_user(session, int(params["tg_id"]))
+
+
+async def _get_roles(session: AsyncSession, params: Dict[str, Any]):
+    return await get_roles(session=session)
+
+
+async def _update_user(session: AsyncSession, params: Dict[str, Any]):
+    data = {k: v for k, v in params.items() if k != "tg_id"}
+    return await update_user_by_tg_id(
+        tg_id=int(params["tg_id"]),
+        update=UserUpdate.model_validate(data),
+        session=session,
+    )
+
+
+async def _get_mailings(session: AsyncSession, params: Dict[str, Any]):
+    return await read_pending_mailings(session)
+
+
+OPERATIONS: Dict[str, Callable[[AsyncSession, Dict[str, Any]], Awaitable[Any]]] = {
+    "get_user": _get_user,
+    "get_roles": _get_roles,
+    "update_user": _update_user,
+    "get_mailings": _get_mailings,
+}
+
+
+def _to_body(result: Any) -> Any:
+    if isinstance(result, BaseModel):
+        return result.model_dump(mode="json")
+    if isinstance(result, list):
+        return [_to_body(item) for item in result]
+    return result
+
+
+@batch_router.post(
+    "/",
+    response_model=BatchResponse,
+    summary="Выполнить несколько операций одним запросом",
+    description="""
+Выполняет операции по порядку в одной сессии БД и возвращает результат каждой.
+Ошибка одной операции не прерывает остальные.
+
+**Операции (op и params):**
+- get_user: {"tg_id": int}
+- get_roles: {}
+- update_user: {"tg_id": int, "name": str, "role": str}
+- get_mailings: {}
+
+**Ответ:**
+- 200: results — список {status_code, body} в порядке операций
+""",
+)
+async def run_batch(
+    batch: BatchRequest,
+    session: AsyncSession = Depends(get_session),
+):
+    results = []
+    for operation in batch.operations:
+        try:
+            result = await OPERATIONS[operation.op](session, operation.params)
+            results.append(BatchResult(status_code=200, body=_to_body(result)))
+        except HTTPException as e:
+            results.append(
+                BatchResult(status_code=e.status_code, body={"detail": e.detail})
+            )
+        except ValidationError as e:
+            results.append(
+                BatchResult(
+                    status_code=422,
+                    body={"detail": e.errors(include_url=False, include_context=False)},
+                )
+            )
+        except (KeyError, TypeError, ValueError):
+            results.append(
+                BatchResult(status_code=422, body={"detail": "Неверные параметры"})
+            )
+    return BatchResponse(results=results)
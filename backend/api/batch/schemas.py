@@ -0,0 +1,25 @@
+from typing import Any, Dict, List, Literal
+
+from pydantic import BaseModel, Field
+
+from config import BATCH_MAX_OPERATIONS
+
+
+class BatchOperation(BaseModel):
+    op: Literal["get_user", "get_roles", "update_user", "get_mailings"]
+    params: Dict[str, Any] = {}
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(
+        min_length=1, max_length=BATCH_MAX_OPERATIONS
+    )
+
+
+class BatchResult(BaseModel):
+    status_code: int
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
@@ -0,0 +1 @@
+from .routs import debug_router
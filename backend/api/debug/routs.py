@@ -0,0 +1,62 @@
+from fastapi import HTTPException, Query
+from fastapi.routing import APIRouter
+
+from db import db_manager, scheduler_db_manager
+from api.debug.schemas import PoolStatsResponse, ProfileResponse
+from api.profiling import profile_store
+from config import PROFILING_ENABLED
+
+
+debug_router = APIRouter(prefix="/debug", tags=["Отладка"])
+
+
+@debug_router.get(
+    "/pools",
+    response_model=PoolStatsResponse,
+    summary="Состояние пулов соединений с БД",
+    description="""
+Возвращает текущее состояние пулов соединений API и планировщика (primary и реплика).
+
+**Поля пула:**
+- checked_out / checked_in: выданные и свободные соединения
+- overflow: соединения сверх pool_size
+- wait_avg_ms / wait_p95_ms / wait_max_ms: время ожидания соединения
+- timeouts: сколько раз соединение не удалось получить за pool_timeout
+
+**Ответ:**
+- 200: Статистика по пулам
+""",
+)
+async def get_pool_stats():
+    return PoolStatsResponse(
+        pools={
+            manager.name: manager.pool_stats()
+            for manager in (db_manager, scheduler_db_manager)
+        }
+    )
+
+
+@debug_router.get(
+    "/profile",
+    response_model=ProfileResponse,
+    summary="Профиль последних запросов",
+    description="""
+Последние замеры запросов и агрегаты по роутам. Работает только при PROFILING_ENABLED=true.
+
+**Поля замера:**
+- db_count / db_ms: количество и суммарное время SQL-запросов
+- slowest_statement / slowest_ms: самый медленный SQL-запрос
+- serialization_ms: время от возврата из эндпоинта до начала ответа
+- loop_lag_ms: максимальная задержка event loop за время запроса
+
+**Ответ:**
+- 200: Замеры и агрегаты
+- 404: Профилирование выключено
+""",
+)
+async def get_profile(limit: int = Query(50, ge=1, le=1000)):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Профилирование выключено")
+    return ProfileResponse(
+        samples=profile_store.recent(limit), routes=profile_store.aggregates()
+    )
@@ -0,0 +1,51 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class PoolSnapshot(BaseModel):
+    size: int
+    max_overflow: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    timeouts: int
+    wait_avg_ms: float
+    wait_p95_ms: float
+    wait_max_ms: float
+    wait_ewma_ms: float
+    available: Optional[bool] = None
+
+
+class PoolStatsResponse(BaseModel):
+    pools: Dict[str, Dict[str, PoolSnapshot]]
+
+
+class RequestSample(BaseModel):
+    method: str
+    path: str
+    route: Optional[str]
+    status_code: Optional[int]
+    started_at: float
+    total_ms: float
+    db_count: int
+    db_ms: float
+    slowest_statement: Optional[str]
+    slowest_ms: float
+    serialization_ms: float
+    loop_lag_ms: float
+
+
+class RouteAggregate(BaseModel):
+    count: int
+    avg_ms: float
+    max_ms: float
+    avg_db_count: float
+    avg_db_ms: float
+    avg_serialization_ms: float
+
+
+class ProfileResponse(BaseModel):
+    samples: List[RequestSample]
+    routes: Dict[str, RouteAggregate]
@@ -0,0 +1 @@
+from .routs import health_router
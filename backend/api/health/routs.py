@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from fastapi.responses import Response
+from fastapi.routing import APIRouter
+
+from db import db_manager, queries
+from scheduler import scheduler, scheduler_heartbeat
+from api.health.schemas import (
+    LivenessResponse,
+    ReadinessResponse,
+    PoolCheck,
+    SchedulerCheck,
+    OverdueCheck,
+)
+from config import (
+    HEALTH_DB_TIMEOUT,
+    HEALTH_MAX_OVERDUE,
+    HEALTH_SCHEDULER_MAX_SILENCE,
+    LOAD_SHEDDING_POOL_WAIT,
+    MAILING_CLAIM_TIMEOUT,
+)
+
+
+health_router = APIRouter(prefix="/health", tags=["Здоровье"])
+
+
+def check_pool() -> PoolCheck:
+    stats = db_manager.pool_stats().get("primary", {})
+    return PoolCheck(
+        ok=bool(stats) and not db_manager.overloaded(LOAD_SHEDDING_POOL_WAIT),
+        checked_out=stats.get("checked_out", 0),
+        capacity=stats.get("size", 0) + max(stats.get("max_overflow", 0), 0),
+        wait_ewma_ms=stats.get("wait_ewma_ms", 0.0),
+    )
+
+
+def check_scheduler() -> SchedulerCheck:
+    silence = scheduler_heartbeat.seconds_since_beat()
+    return SchedulerCheck(
+        ok=(
+            scheduler.running
+            and silence is not None
+            and silence <= HEALTH_SCHEDULER_MAX_SILENCE
+        ),
+        running=scheduler.running,
+        seconds_since_beat=round(silence, 3) if silence is not None else None,
+        active_mailings=len(scheduler_heartbeat.active_mailings),
+        last_error=scheduler_heartbeat.last_tick_error,
+    )
+
+
+async def check_overdue() -> OverdueCheck:
+    now = datetime.now(timezone.utc)
+    stale_cutoff = now - timedelta(seconds=MAILING_CLAIM_TIMEOUT)
+
+    async def read_mailings():
+        async with db_manager.session() as session:
+            result = await session.execute(
+                queries.oldest_overdue_send_at(
+                    now, exclude_ids=scheduler_heartbeat.active_mailings
+                )
+            )
+            send_at = result.scalar_one_or_none()
+            result = await session.execute(queries.stale_sending_mailings(stale_cutoff))
+            stale, oldest_claim = result.one()
+            return send_at, stale, oldest_claim
+
+    try:
+        send_at, stale, oldest_claim = await asyncio.wait_for(
+            read_mailings(), HEALTH_DB_TIMEOUT
+        )
+    except Exception as e:
+        return OverdueCheck(ok=False, detail=f"База недоступна: {type(e).__name__}")
+    overdue = (now - send_at).total_seconds() if send_at is not None else None
+    return OverdueCheck(
+        # Зависшие в sending рассылки планировщик сам вернет в pending на
+        # следующей проверке; если они копятся, проверки не идут
+        ok=(overdue is None or overdue <= HEALTH_MAX_OVERDUE) and not stale,
+        oldest_overdue_seconds=round(overdue, 3) if overdue is not None else None,
+        stale_sending=stale,
+        oldest_stale_claim_seconds=(
+            round((now - oldest_claim).total_seconds(), 3)
+            if oldest_claim is not None
+            else None
+        ),
+    )
+
+
+@health_router.get(
+    "/live",
+    response_model=LivenessResponse,
+    summary="Liveness-проверка",
+    description="""
+Процесс жив и event loop отвечает. Без токена, в базу не ходит.
+
+**Ответ:**
+- 200: {"status": "ok"}
+""",
+)
+async def liveness():
+    return LivenessResponse(status="ok")
+
+
+@health_router.get(
+    "/ready",
+    response_model=ReadinessResponse,
+    responses={503: {"model": ReadinessResponse}},
+    summary="Readiness-проверка",
+    description="""
+Готово ли апи принимать трафик. Без токена.
+
+**Проверки:**
+- pool: пул соединений api не перегружен (все соединения заняты и ожидание выше порога)
+- scheduler: планировщик запущен и подавал признаки жизни не дольше
+HEALTH_SCHEDULER_MAX_SILENCE секунд назад
+- mailings: самая просроченная ожидающая рассылка, которую планировщик еще не взял
+в работу, опаздывает не больше HEALTH_MAX_OVERDUE секунд, и нет рассылок, зависших
+в sending дольше MAILING_CLAIM_TIMEOUT секунд (stale_sending)
+
+**Ответ:**
+- 200: Все проверки пройдены
+- 503: Хотя бы одна проверка не пройдена, подробности в теле
+""",
+)
+async def readiness(response: Response):
+    pool = check_pool()
+    scheduler_check = check_scheduler()
+    if pool.ok:
+        mailings = await check_overdue()
+    else:
+        # Перегруженному пулу не добавляем еще один запрос
+        mailings = OverdueCheck(
+            ok=False, detail="Не проверялось: пул недоступен или перегружен"
+        )
+    ready = pool.ok and scheduler_check.ok and mailings.ok
+    if not ready:
+        response.status_code = 503
+    return ReadinessResponse(
+        ready=ready, pool=pool, scheduler=scheduler_check, mailings=mailings
+    )
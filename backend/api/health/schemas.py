@@ -0,0 +1,39 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class LivenessResponse(BaseModel):
+    status: str
+
+
+class PoolCheck(BaseModel):
+    ok: bool
+    checked_out: int
+    # pool_size + max_overflow
+    capacity: int
+    wait_ewma_ms: float
+
+
+class SchedulerCheck(BaseModel):
+    ok: bool
+    running: bool
+    seconds_since_beat: Optional[float] = None
+    active_mailings: int
+    last_error: Optional[str] = None
+
+
+class OverdueCheck(BaseModel):
+    ok: bool
+    oldest_overdue_seconds: Optional[float] = None
+    # Рассылки в sending, захват которых не продлевался дольше MAILING_CLAIM_TIMEOUT
+    stale_sending: int = 0
+    oldest_stale_claim_seconds: Optional[float] = None
+    detail: Optional[str] = None
+
+
+class ReadinessResponse(BaseModel):
+    ready: bool
+    pool: PoolCheck
+    scheduler: SchedulerCheck
+    mailings: OverdueCheck
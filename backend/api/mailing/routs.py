@@ -1,14 +1,43 @@
-from typing import List
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
+from fastapi.requests import Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.routing import APIRouter
-from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import get_session
-from db.models import Mailing, User
-from api.mailing.schemas import MailingRead, MailingCreate, MailingUpdate
+from db import db_manager, get_session, get_read_session, queries
+from db.models import Mailing
+from db.models.models import MailingStatus
+from api.mailing.schemas import (
+    MailingRead,
+    MailingCreate,
+    MailingUpdate,
+    MailingProgress,
+    AudienceSegment,
+    AudienceEstimate,
+    MailingSearchResponse,
+    MailingPage,
+)
+from api.mailing.services import read_pending_mailings
+from api.utils import (
+    get_table_etag,
+    not_modified,
+    estimate_audience,
+    encode_cursor,
+    decode_cursor,
+)
+from scheduler import progress_broker
+from config import (
+    PROGRESS_SSE_HEARTBEAT,
+    SEARCH_MIN_QUERY_LENGTH,
+    SEARCH_DEFAULT_PAGE_SIZE,
+    SEARCH_MAX_PAGE_SIZE,
+    MAILING_PAGE_DEFAULT_SIZE,
+    MAILING_PAGE_MAX_SIZE,
+)
 
 
 mailing_router = APIRouter(prefix="/mailings", tags=["Рассылки"])
@@ -21,15 +50,146 @@ mailing_router = APIRouter(prefix="/mailings", tags=["Рассылки"])
     description="""
 Возвращает все рассылки со статусом "pending" (ожидающие отправки), отсортированные по времени отправки (`send_at`).
 
+Поддерживает ETag: при совпадении If-None-Match отвечает 304 без тела.
+
 **Ответ:**
 - 200: Список рассылок в формате MailingRead
+- 304: Список не изменился
+""",
+)
+async def get_mailings(
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_read_session),
+):
+    etag = await get_table_etag(session, "mailing", "pending")
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    return await read_pending_mailings(session)
+
+
+@mailing_router.get(
+    "/search",
+    response_model=MailingSearchResponse,
+    summary="Найти рассылки по названию и тексту",
+    description="""
+Нечеткий поиск рассылок по названию и тексту сообщения (pg_trgm): находит
+подстроку и слова с опечатками. Самые похожие идут первыми.
+
+**Параметры запроса:**
+- q (str): Строка поиска, от 3 символов
+- status (str, опционально): Только рассылки с этим статусом
+- page (int): Номер страницы с 0
+- page_size (int): Размер страницы
+
+**Ответ:**
+- 200: items, page, page_size и has_more - есть ли следующая страница
+""",
+)
+async def search_mailings(
+    q: str = Query(min_length=SEARCH_MIN_QUERY_LENGTH),
+    mailing_status: Optional[MailingStatus] = Query(None, alias="status"),
+    page: int = Query(0, ge=0),
+    page_size: int = Query(SEARCH_DEFAULT_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_read_session),
+):
+    # Лишняя строка показывает, есть ли следующая страница, без count(*)
+    result = await session.execute(
+        queries.search_mailings(
+            q,
+            limit=page_size + 1,
+            offset=page * page_size,
+            status=mailing_status,
+        )
+    )
+    mailings = result.scalars().all()
+    return MailingSearchResponse(
+        items=[MailingRead.model_validate(m) for m in mailings[:page_size]],
+        page=page,
+        page_size=page_size,
+        has_more=len(mailings) > page_size,
+    )
+
+
+def _page_key(cursor: str) -> Tuple[datetime, int]:
+    try:
+        send_at, mailing_id = decode_cursor(cursor)
+        return datetime.fromisoformat(send_at), int(mailing_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Неверный курсор")
+
+
+@mailing_router.get(
+    "/page",
+    response_model=MailingPage,
+    summary="Страница ожидающих рассылок",
+    description="""
+Ожидающие рассылки постранично в порядке отправки. Страницы выбираются по
+курсору (keyset), а не по смещению, поэтому любая страница читается одинаково
+быстро. Без курсоров отдается первая страница; она же, если по курсору
+рассылок уже не осталось (их отправили или удалили).
+
+Поддерживает ETag: при совпадении If-None-Match отвечает 304 без тела.
+
+**Параметры запроса:**
+- after (str, опционально): next_cursor предыдущей страницы
+- before (str, опционально): prev_cursor следующей страницы
+- limit (int): Размер страницы
+
+**Ответ:**
+- 200: items, next_cursor и prev_cursor (null - соседней страницы нет)
+- 304: Страница не изменилась
+- 400: Неверный курсор
 """,
 )
-async def get_mailings(session: AsyncSession = Depends(get_session)):
-    query = select(Mailing).where(Mailing.status == "pending").order_by(Mailing.send_at)
-    result = await session.execute(query)
+async def get_mailings_page(
+    request: Request,
+    response: Response,
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    limit: int = Query(MAILING_PAGE_DEFAULT_SIZE, ge=1, le=MAILING_PAGE_MAX_SIZE),
+    session: AsyncSession = Depends(get_read_session),
+):
+    if after is not None and before is not None:
+        raise HTTPException(status_code=400, detail="Нужен только один курсор")
+    etag = await get_table_etag(
+        session, "mailing", "page", after or "", before or "", limit
+    )
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+
+    # Лишняя строка показывает, есть ли страница дальше по направлению чтения
+    result = await session.execute(
+        queries.pending_mailings_page(
+            limit + 1,
+            after=_page_key(after) if after is not None else None,
+            before=_page_key(before) if before is not None else None,
+        )
+    )
     mailings = result.scalars().all()
-    return [MailingRead.model_validate(m) for m in mailings]
+    if not mailings and (after is not None or before is not None):
+        # Все рассылки по эту сторону курсора успели отправить или удалить,
+        # но остальные страницы живы: отдаем первую, а не пустую без курсоров
+        after = before = None
+        result = await session.execute(queries.pending_mailings_page(limit + 1))
+        mailings = result.scalars().all()
+    has_more = len(mailings) > limit
+    mailings = list(mailings[:limit])
+    if before is not None:
+        mailings.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+    if not mailings:
+        return MailingPage(items=[])
+    first, last = mailings[0], mailings[-1]
+    return MailingPage(
+        items=[MailingRead.model_validate(m) for m in mailings],
+        next_cursor=encode_cursor(last.send_at, last.id) if has_next else None,
+        prev_cursor=encode_cursor(first.send_at, first.id) if has_prev else None,
+    )
 
 
 @mailing_router.post(
@@ -46,6 +206,7 @@ async def get_mailings(session: AsyncSession = Depends(get_session)):
 - message (str): Текст сообщения
 - extra (dict, опционально): Дополнительные параметры (медиа, кнопки и т.д.)
 - creator_id (int): Telegram ID пользователя-автора
+- audience (AudienceSegment, опционально): Сегмент получателей, по умолчанию все
 
 **Ответ:**
 - 201: Данные созданной рассылки
@@ -57,7 +218,7 @@ async def create_mailing(
     session: AsyncSession = Depends(get_session),
 ):
     user_tg_id = data.creator_id
-    result = await session.execute(select(User).where(User.tg_id == user_tg_id))
+    result = await session.execute(queries.user_by_tg_id(user_tg_id))
     user = result.scalar_one_or_none()
     data.creator_id = user.id
     db_obj = Mailing(**data.model_dump(exclude_unset=True))
@@ -68,22 +229,123 @@ async def create_mailing(
     return MailingRead.model_validate(db_obj)
 
 
+@mailing_router.post(
+    "/audience/estimate",
+    response_model=AudienceEstimate,
+    summary="Оценить размер аудитории рассылки",
+    description="""
+Возвращает, скольким пользователям уйдет рассылка с таким сегментом.
+На небольшой базе и для явного списка tg_id считает точно, на большой берет
+оценку из статистики планировщика Postgres, поэтому отвечает сразу.
+
+**Тело запроса (все поля опциональны, условия объединяются через И):**
+- roles (list[str]): Роли получателей
+- registered_from (datetime): Зарегистрированы не раньше
+- registered_to (datetime): Зарегистрированы раньше
+- tg_ids (list[int]): Явный список Telegram ID
+
+**Ответ:**
+- 200: count и признак exact (false - оценка)
+""",
+)
+async def estimate_mailing_audience(
+    segment: Optional[AudienceSegment] = None,
+    session: AsyncSession = Depends(get_read_session),
+):
+    segment_data = segment.model_dump(exclude_none=True) if segment else None
+    count, exact = await estimate_audience(session, segment_data)
+    return AudienceEstimate(count=count, exact=exact)
+
+
+LOCKED_STATUS_DETAILS = {
+    MailingStatus.sending: "Рассылка уже отправляется",
+    MailingStatus.done: "Рассылка уже отправлена",
+    MailingStatus.failed: "Рассылка остановлена из-за ошибки, создайте новую",
+}
+
+
+@mailing_router.get(
+    "/{mailing_id}",
+    response_model=MailingRead,
+    summary="Получить рассылку по id",
+    description="""
+Возвращает одну рассылку по её id.
+
+Поддерживает ETag: при совпадении If-None-Match отвечает 304 без тела.
+
+**Параметры пути:**
+- mailing_id (int): ID рассылки
+
+**Ответ:**
+- 200: Рассылка в формате MailingRead
+- 304: Рассылка не изменилась
+- 404: Такой рассылки нет
+""",
+)
+async def get_mailing(
+    mailing_id: int,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_read_session),
+):
+    etag = await get_table_etag(session, "mailing", mailing_id)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    result = await session.execute(queries.mailing_by_id(mailing_id))
+    mailing = result.scalar_one_or_none()
+    if mailing is None:
+        raise HTTPException(status_code=404, detail="Такой рассылки нет")
+    return MailingRead.model_validate(mailing)
+
+
+async def _edit_rejected(
+    session: AsyncSession,
+    mailing_id: int,
+    version: Optional[int],
+    locked_statuses: Iterable[MailingStatus],
+) -> HTTPException:
+    """
+    Объясняет, почему условная правка или удаление не затронули рассылку
+    :param locked_statuses: статусы, в которых операция запрещена
+    """
+    result = await session.execute(queries.mailing_by_id(mailing_id))
+    mailing = result.scalar_one_or_none()
+    if mailing is None:
+        return HTTPException(status_code=404, detail="Такой рассылки нет")
+    if mailing.status in locked_statuses:
+        return HTTPException(
+            status_code=409, detail=LOCKED_STATUS_DETAILS[mailing.status]
+        )
+    return HTTPException(
+        status_code=409,
+        detail=(
+            f"Рассылку уже изменили: актуальная версия {mailing.version}, "
+            f"в запросе {version}"
+        ),
+    )
+
+
 @mailing_router.patch(
     "/{mailing_id}",
     response_model=MailingRead,
     summary="Обновить данные рассылки",
     description="""
-Частично обновляет рассылку по её id.
+Частично обновляет ожидающую рассылку по её id с оптимистичной блокировкой:
+правка применяется, только если version совпадает с текущей версией рассылки.
+Каждая успешная правка увеличивает version на 1.
 
 **Параметры пути:**
 - mailing_id (int): ID рассылки
 
 **Тело запроса:**
+- version (int): Версия рассылки, с которой начиналась правка
 - Любые изменяемые поля рассылки (см. MailingUpdate)
 
 **Ответ:**
 - 200: Обновлённая рассылка
 - 404: Такая рассылка не найдена
+- 409: Рассылку успели изменить, она уже отправляется или отправлена
 - 400: Ошибка обновления (например, конфликт данных)
 """,
 )
@@ -92,15 +354,21 @@ async def update_mailing(
     data: MailingUpdate,
     session: AsyncSession = Depends(get_session),
 ):
-    result = await session.execute(select(Mailing).where(Mailing.id == mailing_id))
-    db_obj = result.scalar_one_or_none()
-    if db_obj is None:
-        raise HTTPException(status_code=404, detail="Такой рассылки нет")
-    for k, v in data.model_dump(exclude_unset=True).items():
-        setattr(db_obj, k, v)
+    values = data.model_dump(exclude_unset=True, exclude={"version"})
+    # Один UPDATE с проверкой версии вместо блокировки строки на время правки
     try:
+        result = await session.execute(
+            queries.update_mailing_if_version(mailing_id, data.version, values)
+        )
+        db_obj = result.scalar_one_or_none()
+        if db_obj is None:
+            raise await _edit_rejected(
+                session,
+                mailing_id,
+                data.version,
+                (MailingStatus.sending, MailingStatus.done, MailingStatus.failed),
+            )
         await session.commit()
-        await session.refresh(db_obj)
     except IntegrityError:
         await session.rollback()
         raise HTTPException(status_code=400, detail="Ошибка обновления")
@@ -112,24 +380,95 @@ async def update_mailing(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="Удалить рассылку",
     description="""
-Удаляет рассылку по её id.
+Удаляет рассылку по её id. Рассылку, которая сейчас отправляется, удалить нельзя.
 
 **Параметры пути:**
 - mailing_id (int): ID рассылки
 
+**Параметры запроса:**
+- version (int, опционально): Удалить, только если версия рассылки совпадает
+
 **Ответ:**
 - 204: Успешно удалено (без тела)
 - 404: Такой рассылки нет
+- 409: Рассылка отправляется или её успели изменить
 """,
 )
 async def delete_mailing(
     mailing_id: int,
+    version: Optional[int] = Query(None),
     session: AsyncSession = Depends(get_session),
 ):
-    # Проверяем, есть ли такая рассылка
-    result = await session.execute(select(Mailing).where(Mailing.id == mailing_id))
-    mailing = result.scalar_one_or_none()
+    result = await session.execute(
+        queries.delete_mailing_if_version(mailing_id, version)
+    )
+    if result.scalar_one_or_none() is None:
+        raise await _edit_rejected(
+            session, mailing_id, version, (MailingStatus.sending,)
+        )
+    await session.commit()
+
+
+@mailing_router.get(
+    "/{mailing_id}/progress",
+    summary="Прогресс отправки рассылки (SSE)",
+    response_class=StreamingResponse,
+    description="""
+Поток server-sent events с прогрессом рассылки, пока её отправляет планировщик.
+Прогресс берется из памяти процесса; база читается один раз, чтобы проверить,
+что рассылка есть и еще не завершена.
+
+**Параметры пути:**
+- mailing_id (int): ID рассылки
+
+**События:**
+- progress: MailingProgress (sent, failed, remaining, total, throughput, eta_seconds, finished, error).
+Поток закрывается после события с finished=true. Пока рассылка не началась,
+приходят только keep-alive комментарии. Если рассылка уже завершена, а ее прогресс
+не сохранился, приходит одно событие с finished=true и нулевыми счетчиками.
+
+**Ответ:**
+- 200: Поток событий
+- 404: Такой рассылки нет
+""",
+)
+async def stream_mailing_progress(mailing_id: int):
+    # Соединение не держится весь поток: статус читается отдельной сессией.
+    # С primary - реплика может еще не знать о только что созданной рассылке
+    async with db_manager.session() as session:
+        result = await session.execute(queries.mailing_by_id(mailing_id))
+        mailing = result.scalar_one_or_none()
     if mailing is None:
         raise HTTPException(status_code=404, detail="Такой рассылки нет")
-    await session.delete(mailing)
-    await session.commit()
+    in_progress = mailing.status in (MailingStatus.pending, MailingStatus.sending)
+    known = progress_broker.latest(mailing_id) is not None
+
+    async def events() -> AsyncIterator[str]:
+        if not in_progress and not known:
+            # Без этого события клиент ждал бы завершения, которое уже было
+            progress = MailingProgress(
+                mailing_id=mailing_id,
+                sent=0,
+                failed=0,
+                remaining=0,
+                total=0,
+                throughput=0.0,
+                finished=True,
+                error=mailing.error,
+            )
+            yield f"event: progress\ndata: {progress.model_dump_json()}\n\n"
+            return
+        async for snapshot in progress_broker.subscribe(
+            mailing_id, heartbeat=PROGRESS_SSE_HEARTBEAT
+        ):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+                continue
+            progress = MailingProgress(mailing_id=mailing_id, **snapshot)
+            yield f"event: progress\ndata: {progress.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
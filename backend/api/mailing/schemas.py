@@ -1,10 +1,57 @@
 from zoneinfo import ZoneInfo
 
 from pydantic import BaseModel, field_serializer, ConfigDict, field_validator
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
-from config import TIMEZONE
+from config import TIMEZONE, AUDIENCE_MAX_TG_IDS
+from db.models.models import Role
+from api.utils import to_utc
+
+
+class AudienceSegment(BaseModel):
+    """
+    Сегмент получателей рассылки. Заполненные условия объединяются через И,
+    пустой сегмент - все пользователи
+    """
+
+    roles: Optional[List[str]] = None
+    registered_from: Optional[datetime] = None
+    registered_to: Optional[datetime] = None
+    tg_ids: Optional[List[int]] = None
+
+    @field_validator("roles")
+    @classmethod
+    def validate_roles(cls, value):
+        if value is None:
+            return value
+        allowed_roles = {role.value for role in Role}
+        if not set(value) <= allowed_roles:
+            raise ValueError(f"Role must be one of {allowed_roles}")
+        return value
+
+    @field_validator("registered_from", "registered_to")
+    @classmethod
+    def validate_dt(cls, value):
+        return to_utc(value) if value is not None else value
+
+    @field_validator("tg_ids")
+    @classmethod
+    def validate_tg_ids(cls, value):
+        if value is not None and len(value) > AUDIENCE_MAX_TG_IDS:
+            raise ValueError(f"Не больше {AUDIENCE_MAX_TG_IDS} tg_id в сегменте")
+        return value
+
+    # Сегмент хранится в JSONB, поэтому даты сразу отдаются строками
+    @field_serializer("registered_from", "registered_to")
+    def serialize_dt(self, value: Optional[datetime], _info):
+        return value.isoformat() if value is not None else None
+
+
+class AudienceEstimate(BaseModel):
+    count: int
+    # False - оценка по статистике планировщика
+    exact: bool
 
 
 class MailingCreate(BaseModel):
@@ -13,6 +60,7 @@ class MailingCreate(BaseModel):
     extra: Dict[str, Any] = {}
     message: str
     creator_id: int
+    audience: Optional[AudienceSegment] = None
 
     @field_validator("name")
     @classmethod
@@ -27,6 +75,9 @@ class MailingUpdate(BaseModel):
     send_at: Optional[datetime] = None
     extra: Optional[Dict[str, Any]] = None
     message: Optional[str] = None
+    audience: Optional[AudienceSegment] = None
+    # Версия, с которой клиент начинал правку (MailingRead.version)
+    version: int
 
 
 class MailingRead(BaseModel):
@@ -38,9 +89,39 @@ class MailingRead(BaseModel):
     status: str
     creator_id: int
     created_at: datetime
+    audience: Optional[AudienceSegment] = None
+    version: int
+    error: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
 
     @field_serializer("created_at", "send_at")
     def serialize_dt(self, value: datetime, _info):
         return value.astimezone(ZoneInfo(TIMEZONE)).isoformat()
+
+
+class MailingPage(BaseModel):
+    items: List[MailingRead]
+    # Курсоры соседних страниц, None - страницы нет
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+class MailingSearchResponse(BaseModel):
+    items: List[MailingRead]
+    page: int
+    page_size: int
+    has_more: bool
+
+
+class MailingProgress(BaseModel):
+    mailing_id: int
+    sent: int
+    failed: int
+    remaining: int
+    total: int
+    throughput: float
+    eta_seconds: Optional[float] = None
+    finished: bool
+    # Почему отправка остановлена после пробной партии
+    error: Optional[str] = None
@@ -0,0 +1,13 @@
+from typing import List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import queries
+from api.mailing.schemas import MailingRead
+
+
+async def read_pending_mailings(session: AsyncSession) -> List[MailingRead]:
+    """Ожидающие рассылки по времени отправки; общее для роута и пакетного запроса"""
+    result = await session.execute(queries.pending_mailings())
+    mailings = result.scalars().all()
+    return [MailingRead.model_validate(m) for m in mailings]
@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from api.utils import decode_jwt
+from config import AUTH_EXEMPT_PATHS, AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL
+
+
+class VerifiedTokenCache:
+    """LRU уже проверенных токенов с ограниченным временем жизни записи"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._tokens: OrderedDict[bytes, float] = OrderedDict()
+
+    def __contains__(self, token: bytes) -> bool:
+        expires_at = self._tokens.get(token)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._tokens[token]
+            return False
+        self._tokens.move_to_end(token)
+        return True
+
+    def add(self, token: bytes) -> None:
+        if self.max_size <= 0:
+            return
+        self._tokens[token] = time.monotonic() + self.ttl
+        self._tokens.move_to_end(token)
+        while len(self._tokens) > self.max_size:
+            self._tokens.popitem(last=False)
+
+    def clear(self) -> None:
+        self._tokens.clear()
+
+
+class JWTAuthMiddleware:
+    """
+    ASGI-мидлварь проверки токена из заголовка Authorization.
+    Полная проверка подписи выполняется только для токенов, которых нет в кэше.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        exempt_paths: Iterable[str] = AUTH_EXEMPT_PATHS,
+        cache_size: int = AUTH_TOKEN_CACHE_SIZE,
+        cache_ttl: float = AUTH_TOKEN_CACHE_TTL,
+    ):
+        self.app = app
+        self.exempt_paths = frozenset(exempt_paths)
+        self.cache = VerifiedTokenCache(max_size=cache_size, ttl=cache_ttl)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        token = self._get_authorization(scope)
+        if not token:
+            response = JSONResponse(
+                status_code=401,
+                content={"detail": "Missing or invalid Authorization header"},
+            )
+            await response(scope, receive, send)
+            return
+
+        if token not in self.cache:
+            if not decode_jwt(token.decode("latin-1")):
+                response = JSONResponse(
+                    status_code=401, content={"detail": "Invalid token"}
+                )
+                await response(scope, receive, send)
+                return
+            self.cache.add(token)
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _get_authorization(scope: Scope) -> Optional[bytes]:
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                return value
+        return None
@@ -0,0 +1,238 @@
+import asyncio
+import functools
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import PROFILING_SAMPLES, PROFILING_LOOP_LAG_INTERVAL
+
+
+class RequestProfile:
+    """Замеры одного запроса"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.endpoint_end: Optional[float] = None
+        self.response_start: Optional[float] = None
+        self.total: float = 0.0
+        self.db_count: int = 0
+        self.db_time: float = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.slowest_time: float = 0.0
+        self.loop_lag: float = 0.0
+
+    def add_query(self, statement: str, duration: float) -> None:
+        self.db_count += 1
+        self.db_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    @property
+    def serialization_time(self) -> float:
+        """От возврата из эндпоинта до начала ответа: сериализация и сборка ответа"""
+        if self.endpoint_end is None or self.response_start is None:
+            return 0.0
+        return max(self.response_start - self.endpoint_end, 0.0)
+
+    def server_timing(self) -> str:
+        app_time = (self.response_start or time.perf_counter()) - self.start
+        return (
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.db_count} queries", '
+            f"ser;dur={self.serialization_time * 1000:.2f}, "
+            f"app;dur={app_time * 1000:.2f}"
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "total_ms": round(self.total * 1000, 3),
+            "db_count": self.db_count,
+            "db_ms": round(self.db_time * 1000, 3),
+            "slowest_statement": self.slowest_statement,
+            "slowest_ms": round(self.slowest_time * 1000, 3),
+            "serialization_ms": round(self.serialization_time * 1000, 3),
+            "loop_lag_ms": round(self.loop_lag * 1000, 3),
+        }
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+class LoopLagMonitor:
+    """Замеряет задержку event loop: насколько позже положенного просыпается sleep"""
+
+    def __init__(self, interval: float = PROFILING_LOOP_LAG_INTERVAL, keep: int = 1200):
+        self.interval = interval
+        self._samples: deque[tuple[float, float]] = deque(maxlen=keep)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._samples.append((now, max(now - expected, 0.0)))
+
+    def max_since(self, since: float) -> float:
+        lag = 0.0
+        for at, value in reversed(self._samples):
+            if at < since:
+                break
+            lag = max(lag, value)
+        return lag
+
+
+class ProfileStore:
+    """Последние замеры запросов и агрегаты по роутам"""
+
+    def __init__(self, max_samples: int = PROFILING_SAMPLES):
+        self.samples: deque[Dict] = deque(maxlen=max_samples)
+        self._routes: Dict[str, Dict] = defaultdict(
+            lambda: {
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "db_count": 0,
+                "db_ms": 0.0,
+                "serialization_ms": 0.0,
+            }
+        )
+
+    def add(self, profile: RequestProfile) -> None:
+        sample = profile.to_dict()
+        self.samples.append(sample)
+        route = self._routes[f"{profile.method} {profile.route or profile.path}"]
+        route["count"] += 1
+        route["total_ms"] += sample["total_ms"]
+        route["max_ms"] = max(route["max_ms"], sample["total_ms"])
+        route["db_count"] += sample["db_count"]
+        route["db_ms"] += sample["db_ms"]
+        route["serialization_ms"] += sample["serialization_ms"]
+
+    def aggregates(self) -> Dict[str, Dict]:
+        result = {}
+        for key, route in self._routes.items():
+            count = route["count"]
+            result[key] = {
+                "count": count,
+                "avg_ms": round(route["total_ms"] / count, 3),
+                "max_ms": round(route["max_ms"], 3),
+                "avg_db_count": round(route["db_count"] / count, 2),
+                "avg_db_ms": round(route["db_ms"] / count, 3),
+                "avg_serialization_ms": round(route["serialization_ms"] / count, 3),
+            }
+        return result
+
+    def recent(self, limit: int) -> List[Dict]:
+        return list(self.samples)[-limit:]
+
+
+class ProfilingMiddleware:
+    """ASGI-мидлварь, собирающая RequestProfile и отдающая заголовок Server-Timing"""
+
+    def __init__(self, app: ASGIApp, store: "ProfileStore", monitor: LoopLagMonitor):
+        self.app = app
+        self.store = store
+        self.monitor = monitor
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = current_profile.set(profile)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                profile.response_start = time.perf_counter()
+                profile.status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", profile.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_profile.reset(token)
+            profile.total = time.perf_counter() - profile.start
+            route = scope.get("route")
+            profile.route = getattr(route, "path", None)
+            profile.loop_lag = self.monitor.max_since(profile.start)
+            self.store.add(profile)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("profiling_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    starts = conn.info.get("profiling_query_start")
+    if profile is None or not starts:
+        return
+    profile.add_query(statement, time.perf_counter() - starts.pop())
+
+
+def _wrap_endpoint(call):
+    @functools.wraps(call)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await call(*args, **kwargs)
+        finally:
+            profile = current_profile.get()
+            if profile is not None:
+                profile.endpoint_end = time.perf_counter()
+
+    return wrapper
+
+
+profile_store = ProfileStore()
+loop_lag_monitor = LoopLagMonitor()
+
+
+def enable_profiling(app: FastAPI) -> None:
+    """
+    Подключает профилирование: мидлварь, хуки SQLAlchemy на все движки и отметку
+    конца эндпоинта у уже добавленных роутов. Вызывать после include_router.
+    """
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    for route in app.routes:
+        if isinstance(route, APIRoute) and asyncio.iscoroutinefunction(
+            route.dependant.call
+        ):
+            route.dependant.call = _wrap_endpoint(route.dependant.call)
+    app.add_middleware(
+        ProfilingMiddleware, store=profile_store, monitor=loop_lag_monitor
+    )
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import (
+    AUTH_EXEMPT_PATHS,
+    LOAD_SHEDDING_POOL_WAIT,
+    LOAD_SHEDDING_RETRY_AFTER,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_MEMORY_MAX_KEYS,
+    RATE_LIMIT_ROUTE_BURST,
+    RATE_LIMIT_ROUTE_RATE,
+    RATE_LIMIT_ROUTES,
+    RATE_LIMIT_TOKEN_BURST,
+    RATE_LIMIT_TOKEN_RATE,
+    REDIS_URL,
+)
+from db import db_manager
+
+
+logger = logging.getLogger("RateLimitLogger")
+
+# (ключ ведра, запросов в секунду, емкость)
+BucketLimit = Tuple[str, float, float]
+
+
+class MemoryRateLimitBackend:
+    """Token bucket в памяти процесса. Подходит, когда апи работает в одном воркере"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MEMORY_MAX_KEYS):
+        self.max_keys = max_keys
+        # ключ -> (токенов осталось, время последнего пополнения)
+        self._buckets: OrderedDict[str, Tuple[float, float]] = OrderedDict()
+
+    async def acquire(self, limits: Sequence[BucketLimit]) -> float:
+        """
+        Списывает по токену из всех ведер, если в каждом он есть
+        :return: 0, если запрос разрешен, иначе через сколько секунд повторить
+        """
+        now = time.monotonic()
+        refilled = []
+        wait = 0.0
+        for key, rate, burst in limits:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            refilled.append(tokens)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+        for (key, _, _), tokens in zip(limits, refilled):
+            self._buckets[key] = (tokens if wait else tokens - 1, now)
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def close(self) -> None:
+        self._buckets.clear()
+
+
+# Та же логика, что у MemoryRateLimitBackend, но атомарно на стороне Redis.
+# Ответ строкой: числа Lua Redis обрезает до целых
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local refilled = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    refilled[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local tokens = refilled[i]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return tostring(wait)
+"""
+
+
+class RedisRateLimitBackend:
+    """Token bucket в Redis: лимиты общие для всех воркеров и инстансов апи"""
+
+    def __init__(self, redis_url: str = REDIS_URL, prefix: str = "ratelimit:"):
+        self.prefix = prefix
+        self.redis = Redis.from_url(redis_url)
+        self._script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, limits: Sequence[BucketLimit]) -> float:
+        args: List[float] = [time.time()]
+        for _, rate, burst in limits:
+            args.extend((rate, burst))
+        try:
+            wait = await self._script(
+                keys=[self.prefix + key for key, _, _ in limits], args=args
+            )
+        except RedisError as e:
+            # Недоступный Redis не должен класть апи: пропускаем без лимита
+            logger.warning(f"Redis для лимитов недоступен, запрос пропущен: {e}")
+            return 0.0
+        return float(wait)
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def build_rate_limit_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "redis":
+        return RedisRateLimitBackend()
+    if name == "memory":
+        return MemoryRateLimitBackend()
+    raise ValueError(f"Неизвестный бэкенд лимитов: {name}")
+
+
+class RateLimitMiddleware:
+    """
+    ASGI-мидлварь защиты апи от перегрузки.
+    1. Сброс нагрузки: пока пул соединений api перегружен, новые запросы сразу
+       получают 503 с Retry-After и не встают в очередь за соединением.
+    2. Token bucket на токен и на пару токен + роут: превышение - 429 с Retry-After.
+    Должна стоять после JWTAuthMiddleware: ключом служит уже проверенный токен.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: Optional[object],
+        routes: Iterable[BaseRoute],
+        exempt_paths: Iterable[str] = AUTH_EXEMPT_PATHS,
+        token_limit: Tuple[float, float] = (
+            RATE_LIMIT_TOKEN_RATE,
+            RATE_LIMIT_TOKEN_BURST,
+        ),
+        route_limit: Tuple[float, float] = (
+            RATE_LIMIT_ROUTE_RATE,
+            RATE_LIMIT_ROUTE_BURST,
+        ),
+        route_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        shedding: bool = True,
+    ):
+        self.app = app
+        self.backend = backend
+        # Список роутов приложения; пополняется include_router и после создания
+        self.routes = routes
+        self.exempt_paths = frozenset(exempt_paths)
+        self.token_limit = token_limit
+        self.route_limit = route_limit
+        self.route_limits = RATE_LIMIT_ROUTES if route_limits is None else route_limits
+        self.shedding = shedding
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        if self.shedding and db_manager.overloaded(LOAD_SHEDDING_POOL_WAIT):
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Сервис перегружен, повторите позже"},
+                headers={"Retry-After": str(LOAD_SHEDDING_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+
+        if self.backend is None:
+            await self.app(scope, receive, send)
+            return
+        wait = await self.backend.acquire(self._limits(scope))
+        if wait > 0:
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Слишком много запросов"},
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    def _limits(self, scope: Scope) -> List[BucketLimit]:
+        token = self._get_token(scope)
+        # В хранилище лимитов попадает не сам токен, а его хэш
+        client = hashlib.blake2b(token, digest_size=8).hexdigest()
+        route = f"{scope['method']} {self._route_template(scope)}"
+        route_rate, route_burst = self.route_limits.get(route, self.route_limit)
+        return [
+            (client, *self.token_limit),
+            (f"{client}:{route}", route_rate, route_burst),
+        ]
+
+    def _route_template(self, scope: Scope) -> str:
+        """
+        Шаблон пути (/api/v1/users/{tg_id}), чтобы все tg_id делили одно ведро.
+        Неизвестные пути попадают в общее ведро
+        """
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "*")
+        return "*"
+
+    @staticmethod
+    def _get_token(scope: Scope) -> bytes:
+        for key, value in scope["headers"]:
+            if key == b"authorization":
+                return value
+        return b""
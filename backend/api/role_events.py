@@ -0,0 +1,41 @@
+import json
+import logging
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config import REDIS_URL, ROLE_EVENTS_CHANNEL, ROLE_EVENTS_ENABLED
+
+
+logger = logging.getLogger("RoleEventsLogger")
+
+
+class RoleEventPublisher:
+    """Публикует смену ролей пользователей в Redis pub/sub для кэша ролей бота"""
+
+    def __init__(
+        self,
+        redis_url: str = REDIS_URL,
+        channel: str = ROLE_EVENTS_CHANNEL,
+        timeout: float = 1.0,
+    ):
+        self.channel = channel
+        # Короткие таймауты: недоступный Redis не должен задерживать ответ апи
+        self.redis = Redis.from_url(
+            redis_url, socket_connect_timeout=timeout, socket_timeout=timeout
+        )
+
+    async def publish(self, tg_id: int, role: str) -> None:
+        try:
+            await self.redis.publish(
+                self.channel, json.dumps({"tg_id": tg_id, "role": role})
+            )
+        except RedisError as e:
+            # Кэш бота все равно истечет по TTL
+            logger.warning(f"Не удалось опубликовать смену роли {tg_id}: {e}")
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+role_event_publisher = RoleEventPublisher() if ROLE_EVENTS_ENABLED else None
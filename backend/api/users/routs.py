@@ -1,14 +1,28 @@
-from typing import Optional
-
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Query
+from fastapi.requests import Request
+from fastapi.responses import Response
 from fastapi.routing import APIRouter
-from sqlalchemy import select, text
+from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import get_session
+from db import get_session, get_read_session, queries
 from db.models import User
-from api.users.schemas import UserCreate, UserRead, RoleListResponse, UserUpdate
+from api.users.schemas import (
+    UserCreate,
+    UserRead,
+    RoleListResponse,
+    UserUpdate,
+    UserSearchResponse,
+)
+from api.users.services import read_user
+from api.utils import get_table_etag, not_modified
+from api.role_events import role_event_publisher
+from config import (
+    SEARCH_MIN_QUERY_LENGTH,
+    SEARCH_DEFAULT_PAGE_SIZE,
+    SEARCH_MAX_PAGE_SIZE,
+)
 
 user_router = APIRouter(prefix="/users", tags=["Пользователи"])
 
@@ -50,6 +64,43 @@ async def create_user(
     # return JSONResponse(status_code=201, content={"hello": "hello"})
 
 
+# Объявлен раньше /{tg_id}, иначе "search" попадет в tg_id и вернется 422
+@user_router.get(
+    "/search",
+    response_model=UserSearchResponse,
+    summary="Найти пользователей по имени",
+    description="""
+Нечеткий поиск пользователей по имени (pg_trgm): находит подстроку и слова
+с опечатками. Самые похожие идут первыми.
+
+**Параметры запроса:**
+- q (str): Строка поиска, от 3 символов
+- page (int): Номер страницы с 0
+- page_size (int): Размер страницы
+
+**Ответ:**
+- 200: items, page, page_size и has_more - есть ли следующая страница
+""",
+)
+async def search_users(
+    q: str = Query(min_length=SEARCH_MIN_QUERY_LENGTH),
+    page: int = Query(0, ge=0),
+    page_size: int = Query(SEARCH_DEFAULT_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_read_session),
+):
+    # Лишняя строка показывает, есть ли следующая страница, без count(*)
+    result = await session.execute(
+        queries.search_users(q, limit=page_size + 1, offset=page * page_size)
+    )
+    users = result.scalars().all()
+    return UserSearchResponse(
+        items=[UserRead.model_validate(user) for user in users[:page_size]],
+        page=page,
+        page_size=page_size,
+        has_more=len(users) > page_size,
+    )
+
+
 @user_router.get(
     "/{tg_id}",
     response_model=UserRead,
@@ -60,17 +111,25 @@ async def create_user(
 **Параметры:**
 - tg_id (int): Telegram ID пользователя
 
+Поддерживает ETag: при совпадении If-None-Match отвечает 304 без тела.
+
 **Ответ:**
 - 200: Информация о пользователе
+- 304: Пользователь не изменился
 - 404: Пользователь не найден
 """,
 )
-async def get_user_by_tg_id(tg_id: int, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(User).where(User.tg_id == tg_id))
-    db_user: Optional[User] = result.scalar_one_or_none()
-    if db_user is None:
-        raise HTTPException(status_code=404, detail="Такого пользователя нет в базе")
-    return UserRead.model_validate(db_user)
+async def get_user_by_tg_id(
+    tg_id: int,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_read_session),
+):
+    etag = await get_table_etag(session, "user", tg_id)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    return await read_user(session, tg_id)
 
 
 @user_router.get(
@@ -84,7 +143,7 @@ async def get_user_by_tg_id(tg_id: int, session: AsyncSession = Depends(get_sess
 - 200: Список ролей (например, ["user", "admin", "moderator"])
 """,
 )
-async def get_roles(session: AsyncSession = Depends(get_session)):
+async def get_roles(session: AsyncSession = Depends(get_read_session)):
     result = await session.execute(text("SELECT unnest(enum_range(NULL::userrole));"))
     roles = [row[0] for row in result.fetchall()]
     return RoleListResponse(roles=roles)
@@ -104,6 +163,9 @@ async def get_roles(session: AsyncSession = Depends(get_session)):
 - name (str, опционально): Имя пользователя
 - role (str, опционально): Роль (user/admin/moderator)
 
+Смена роли публикуется в Redis-канал ROLE_EVENTS_CHANNEL, бот по ней сбрасывает
+кэш ролей.
+
 **Ответ:**
 - 200: Обновлённые данные пользователя
 - 404: Пользователь не найден
@@ -115,7 +177,7 @@ async def update_user_by_tg_id(
     update: UserUpdate,
     session: AsyncSession = Depends(get_session),
 ):
-    result = await session.execute(select(User).where(User.tg_id == tg_id))
+    result = await session.execute(queries.user_by_tg_id(tg_id))
     db_user = result.scalar_one_or_none()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
@@ -133,4 +195,6 @@ async def update_user_by_tg_id(
             status_code=409,
             detail="User with this tg_id already exists",
         )
+    if "role" in data and role_event_publisher is not None:
+        await role_event_publisher.publish(db_user.tg_id, db_user.role.value)
     return UserRead.model_validate(db_user)
@@ -41,6 +41,13 @@ class RoleListResponse(BaseModel):
     roles: List[str]
 
 
+class UserSearchResponse(BaseModel):
+    items: List[UserRead]
+    page: int
+    page_size: int
+    has_more: bool
+
+
 class UserUpdate(BaseModel):
     name: Optional[str] = None
     role: Optional[str] = None
@@ -0,0 +1,20 @@
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import queries
+from db.models import User
+from api.users.schemas import UserRead
+
+
+async def read_user(session: AsyncSession, tg_id: int) -> UserRead:
+    """
+    Пользователь по tg_id; общее для роута и пакетного запроса
+    :raise HTTPException: 404, если такого пользователя нет
+    """
+    result = await session.execute(queries.user_by_tg_id(tg_id))
+    db_user: Optional[User] = result.scalar_one_or_none()
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="Такого пользователя нет в базе")
+    return UserRead.model_validate(db_user)
@@ -1,8 +1,16 @@
+import base64
+import json
 import jwt
 from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
-from config import TIMEZONE, SECRET_KEY
+from fastapi.requests import Request
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import TIMEZONE, SECRET_KEY, AUDIENCE_EXACT_COUNT_THRESHOLD
+from db import queries
 
 
 def to_utc(dt: datetime) -> datetime:
@@ -32,3 +40,76 @@ def decode_jwt(token: str) -> bool:
         return True
     except jwt.PyJWTError:
         return False
+
+
+async def get_table_etag(session: AsyncSession, table_name: str, *parts) -> str:
+    """
+    Слабый ETag по версии таблицы (версию увеличивает триггер на каждую запись)
+    :param session:
+    :param table_name: имя таблицы из table_version
+    :param parts: что еще отличает ресурс (например, id)
+    :return: ETag
+    """
+    result = await session.execute(queries.table_version(table_name))
+    version = result.scalar_one_or_none() or 0
+    tag = "-".join(str(part) for part in (table_name, *parts, version))
+    return f'W/"{tag}"'
+
+
+def encode_cursor(*values: Any) -> str:
+    """Непрозрачный курсор keyset-пагинации из значений ключа сортировки"""
+    raw = json.dumps(values, default=lambda value: value.isoformat())
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Значения ключа сортировки из курсора (даты - строками)
+    :raise ValueError: курсор поврежден
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    values = json.loads(base64.urlsafe_b64decode(padded))
+    if not isinstance(values, list):
+        raise ValueError("Курсор должен содержать список значений")
+    return values
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Возвращает 304, если клиент прислал актуальный ETag в If-None-Match"""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return None
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+async def estimate_audience(
+    session: AsyncSession, segment: Optional[Dict]
+) -> Tuple[int, bool]:
+    """
+    Размер аудитории сегмента без полного прохода по большой таблице
+    :param session:
+    :param segment: сегмент в виде словаря, None - все пользователи
+    :return: (количество, точное ли оно)
+    """
+    result = await session.execute(queries.table_row_estimate("user"))
+    # reltuples = -1 (или 0 на старых версиях), пока таблицу ни разу не анализировали
+    total = result.scalar_one_or_none() or -1
+    # Явный список tg_id считается по уникальному индексу, это всегда дешево
+    if total < AUDIENCE_EXACT_COUNT_THRESHOLD or (segment or {}).get("tg_ids"):
+        result = await session.execute(queries.audience_count(segment))
+        return result.scalar_one(), True
+    if not any((segment or {}).values()):
+        return int(total), False
+    # Оценка строк из плана: планировщик считает ее по статистике, не читая данные
+    connection = await session.connection()
+    sql = queries.audience(segment).compile(
+        dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+    )
+    result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"]), False
@@ -1,23 +1,159 @@
 import os
 
 from pathlib import Path
+from typing import Any, Dict, Optional
+from uuid import uuid4
 
 
 BASE_DIR = Path(__file__).resolve().parent
 MAX_NAME_SIZE = 128
 MAILING_SEARCH_INTERVAL = int(os.getenv("MAILING_SEARCH_INTERVAL", 60))
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", 20))
 CAN_SEE_MAILING_REPORTS = ("admin", "moderator")
+# Прогресс рассылок: как часто публиковать, сколько держать после завершения
+# и как часто слать keep-alive в SSE
+PROGRESS_PUBLISH_INTERVAL = float(os.getenv("PROGRESS_PUBLISH_INTERVAL", 0.5))
+PROGRESS_KEEP_FINISHED = float(os.getenv("PROGRESS_KEEP_FINISHED", 300))
+PROGRESS_SSE_HEARTBEAT = float(os.getenv("PROGRESS_SSE_HEARTBEAT", 15))
 DB_DRIVER = os.getenv("DB_DRIVER", "postgresql+asyncpg")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = int(os.getenv("DB_PORT", 5432))
 DB_USER = os.getenv("POSTGRES_USER", "serenity")
 DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "12345")
 DB_NAME = os.getenv("POSTGRES_DB", "test_db")
+# Реплика для чтения. Если хост не задан, все запросы идут на primary
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST", "")
+DB_REPLICA_PORT = int(os.getenv("DB_REPLICA_PORT", DB_PORT))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", 5))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", 5))
+DB_REPLICA_READ_YOUR_WRITES_WINDOW = float(
+    os.getenv("DB_REPLICA_READ_YOUR_WRITES_WINDOW", 5)
+)
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
 SECRET_KEY = os.getenv("SECRET_KEY", "d3cb099dfcbe5c1f2d0514417928df9a")
+# Настройки пулов соединений. Любое значение можно переопределить для именованного
+# пула (api, scheduler), например DB_SCHEDULER_POOL_SIZE
+DB_POOL_DEFAULTS = {
+    "api": {"POOL_SIZE": 5, "MAX_OVERFLOW": 10},
+    "scheduler": {"POOL_SIZE": 2, "MAX_OVERFLOW": 3},
+}
+# Профилирование запросов (SQL, сериализация, лаг event loop). Выключено по умолчанию
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SAMPLES = int(os.getenv("PROFILING_SAMPLES", 500))
+PROFILING_LOOP_LAG_INTERVAL = float(os.getenv("PROFILING_LOOP_LAG_INTERVAL", 0.05))
+AUTH_EXEMPT_PATHS = tuple(
+    path.strip()
+    for path in os.getenv(
+        "AUTH_EXEMPT_PATHS", "/docs,/openapi.json,/health/live,/health/ready"
+    ).split(",")
+    if path.strip()
+)
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 1024))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))
+# Архивация отправленных и остановленных рассылок.
+# ARCHIVE_RETENTION_DAYS=0 - архив хранится всегда
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", 0))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 3600))
+# Сегменты аудитории рассылок
+AUDIENCE_MAX_TG_IDS = int(os.getenv("AUDIENCE_MAX_TG_IDS", 10_000))
+AUDIENCE_EXACT_COUNT_THRESHOLD = int(
+    os.getenv("AUDIENCE_EXACT_COUNT_THRESHOLD", 100_000)
+)
+AUDIENCE_STREAM_BATCH = int(os.getenv("AUDIENCE_STREAM_BATCH", 1000))
+# Сколько сообщений рассылки отправляется одновременно
+MAILING_SEND_CONCURRENCY = int(os.getenv("MAILING_SEND_CONCURRENCY", 100))
+# Через сколько секунд без продления рассылка в sending считается брошенной
+# (процесс упал посреди отправки) и помечается failed. Пока рассылка
+# отправляется, захват продлевается каждую треть этого времени
+MAILING_CLAIM_TIMEOUT = float(os.getenv("MAILING_CLAIM_TIMEOUT", 600))
+# Пробная партия: рассылка сначала уходит CANARY_SIZE первым получателям
+# (CANARY_TARGET=audience) или модераторам (moderators). Если доля ошибок в ней
+# больше CANARY_MAX_ERROR_RATE, остальным рассылка не отправляется.
+# CANARY_SIZE=0 - без пробной партии
+CANARY_SIZE = int(os.getenv("CANARY_SIZE", 20))
+CANARY_TARGET = os.getenv("CANARY_TARGET", "audience")
+CANARY_MAX_ERROR_RATE = float(os.getenv("CANARY_MAX_ERROR_RATE", 0.5))
+# Нечеткий поиск по pg_trgm: короче трех символов триграммный индекс не работает
+SEARCH_MIN_QUERY_LENGTH = 3
+SEARCH_DEFAULT_PAGE_SIZE = 10
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", 50))
+MAILING_PAGE_DEFAULT_SIZE = 10
+MAILING_PAGE_MAX_SIZE = int(os.getenv("MAILING_PAGE_MAX_SIZE", 50))
+# Readiness: сколько секунд без признаков жизни планировщика и насколько
+# просроченная рассылка делают апи неготовым
+HEALTH_SCHEDULER_MAX_SILENCE = float(
+    os.getenv("HEALTH_SCHEDULER_MAX_SILENCE", MAILING_SEARCH_INTERVAL * 3)
+)
+HEALTH_MAX_OVERDUE = float(os.getenv("HEALTH_MAX_OVERDUE", MAILING_SEARCH_INTERVAL * 5))
+HEALTH_DB_TIMEOUT = float(os.getenv("HEALTH_DB_TIMEOUT", 2))
+REDIS_URL = os.getenv("REDIS_URL_FOR_BACKEND", "redis://localhost:6379/1")
+# Ограничение частоты запросов: token bucket на токен и на токен + роут.
+# RATE - запросов в секунду, BURST - емкость ведра. Бэкенд memory или redis
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_TOKEN_RATE = float(os.getenv("RATE_LIMIT_TOKEN_RATE", 100))
+RATE_LIMIT_TOKEN_BURST = float(os.getenv("RATE_LIMIT_TOKEN_BURST", 200))
+RATE_LIMIT_ROUTE_RATE = float(os.getenv("RATE_LIMIT_ROUTE_RATE", 50))
+RATE_LIMIT_ROUTE_BURST = float(os.getenv("RATE_LIMIT_ROUTE_BURST", 100))
+# Роуты со своими (rate, burst): "МЕТОД шаблон пути"
+RATE_LIMIT_ROUTES = {
+    "POST /api/v1/batch/": (10, 20),
+    "POST /api/v1/mailings/audience/estimate": (5, 10),
+}
+RATE_LIMIT_MEMORY_MAX_KEYS = int(os.getenv("RATE_LIMIT_MEMORY_MAX_KEYS", 10_000))
+# Сброс нагрузки: 503, если пул api занят целиком и ожидание соединения
+# в среднем дольше порога (секунды)
+LOAD_SHEDDING_ENABLED = os.getenv("LOAD_SHEDDING_ENABLED", "true").lower() == "true"
+LOAD_SHEDDING_POOL_WAIT = float(os.getenv("LOAD_SHEDDING_POOL_WAIT", 0.5))
+LOAD_SHEDDING_RETRY_AFTER = int(os.getenv("LOAD_SHEDDING_RETRY_AFTER", 2))
+# Смена роли публикуется в Redis pub/sub, бот по ней сбрасывает кэш ролей.
+# Каналы pub/sub общие для всех баз Redis, номер базы в REDIS_URL не важен
+ROLE_EVENTS_ENABLED = os.getenv("ROLE_EVENTS_ENABLED", "true").lower() == "true"
+ROLE_EVENTS_CHANNEL = os.getenv("ROLE_EVENTS_CHANNEL", "user_roles")
 
 
 def get_db_link() -> str:
     return f"{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+
+def get_replica_db_link() -> Optional[str]:
+    if not DB_REPLICA_HOST:
+        return None
+    return f"{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+
+
+def _pool_env(pool_name: str, key: str, default: Any) -> str:
+    default = DB_POOL_DEFAULTS.get(pool_name, {}).get(key, default)
+    return os.getenv(
+        f"DB_{pool_name.upper()}_{key}", os.getenv(f"DB_{key}", str(default))
+    )
+
+
+def get_engine_options(pool_name: str) -> Dict[str, Any]:
+    """Параметры create_async_engine для именованного пула"""
+    pgbouncer = _pool_env(pool_name, "PGBOUNCER_MODE", "false").lower() == "true"
+    statement_cache_size = int(_pool_env(pool_name, "STATEMENT_CACHE_SIZE", 100))
+    connect_args: Dict[str, Any] = {
+        "prepared_statement_cache_size": statement_cache_size
+    }
+    if pgbouncer:
+        # PgBouncer в режиме transaction pooling не держит prepared statements
+        # между транзакциями: отключаем кэши и делаем имена уникальными
+        connect_args = {
+            "prepared_statement_cache_size": 0,
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    return {
+        "pool_size": int(_pool_env(pool_name, "POOL_SIZE", 5)),
+        "max_overflow": int(_pool_env(pool_name, "MAX_OVERFLOW", 10)),
+        "pool_timeout": float(_pool_env(pool_name, "POOL_TIMEOUT", 30)),
+        "pool_recycle": int(_pool_env(pool_name, "POOL_RECYCLE", 1800)),
+        "pool_pre_ping": _pool_env(pool_name, "POOL_PRE_PING", "true").lower()
+        == "true",
+        "connect_args": connect_args,
+    }
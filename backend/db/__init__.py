@@ -1,3 +1,15 @@
-from .controller import db_manager, get_session
+from .controller import (
+    db_manager,
+    scheduler_db_manager,
+    get_session,
+    get_read_session,
+)
+from . import queries
 
-__all__ = ["db_manager", "get_session"]
+__all__ = [
+    "db_manager",
+    "scheduler_db_manager",
+    "get_session",
+    "get_read_session",
+    "queries",
+]
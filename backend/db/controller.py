@@ -1,6 +1,13 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, Optional
+from typing import AsyncIterator, Dict, Optional
 
+from fastapi.requests import Request
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import (
     AsyncConnection,
     AsyncEngine,
@@ -8,37 +15,206 @@ from sqlalchemy.ext.asyncio import (
     async_sessionmaker,
     create_async_engine,
 )
+from sqlalchemy.orm import Session
+
+from config import (
+    get_engine_options,
+    DB_REPLICA_CHECK_INTERVAL,
+    DB_REPLICA_MAX_LAG,
+    DB_REPLICA_READ_YOUR_WRITES_WINDOW,
+)
+from db.pool import InstrumentedAsyncPool
+
+
+logger = logging.getLogger("DatabaseLogger")
+
+# Заголовок, которым клиент может явно попросить читать с primary
+READ_PRIMARY_HEADER = "X-Read-Primary"
+# Ключ в Session.info: кто пишет через сессию (см. read-your-writes)
+CALLER_INFO_KEY = "caller"
+
+REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
 
 
 class DatabaseAccessor:
-    def __init__(self) -> None:
+    def __init__(self, name: str) -> None:
+        # Имя пула: по нему берутся настройки из config.get_engine_options
+        self.name = name
         self._engine: Optional[AsyncEngine] = None
         self._session_maker: Optional[async_sessionmaker[AsyncSession]] = None
+        self._replica_engine: Optional[AsyncEngine] = None
+        self._replica_session_maker: Optional[async_sessionmaker[AsyncSession]] = None
+        self._replica_available: bool = False
+        self._replica_monitor: Optional[asyncio.Task] = None
+        # Время последней записи по каждому клиенту: read-your-writes касается
+        # только того, кто писал, а не всех читающих
+        self._last_write_at: OrderedDict[str, float] = OrderedDict()
 
-    def init(self, db_url: str) -> None:
-        self._engine = create_async_engine(db_url)
+    def init(self, db_url: str, replica_url: Optional[str] = None) -> None:
+        engine_options = get_engine_options(self.name)
+        self._engine = create_async_engine(
+            db_url, poolclass=InstrumentedAsyncPool, **engine_options
+        )
         self._session_maker = async_sessionmaker(
-            bind=self._engine, expire_on_commit=False
+            bind=self._engine, expire_on_commit=False, info={"db_accessor": self}
         )
+        if replica_url:
+            self._replica_engine = create_async_engine(
+                replica_url, poolclass=InstrumentedAsyncPool, **engine_options
+            )
+            self._replica_session_maker = async_sessionmaker(
+                bind=self._replica_engine, expire_on_commit=False
+            )
+            self._replica_available = True
 
     async def close(self) -> None:
+        if self._replica_monitor is not None:
+            self._replica_monitor.cancel()
+            self._replica_monitor = None
+        if self._replica_engine is not None:
+            await self._replica_engine.dispose()
+            self._replica_engine = None
+            self._replica_session_maker = None
+            self._replica_available = False
         if self._engine is None:
             return
         await self._engine.dispose()
         self._engine = None
         self._session_maker = None
 
+    def start_replica_monitor(self) -> None:
+        """Запускает фоновую проверку отставания реплики (нужен запущенный event loop)"""
+        if self._replica_engine is None or self._replica_monitor is not None:
+            return
+        self._replica_monitor = asyncio.create_task(self._monitor_replica())
+
+    async def _monitor_replica(self) -> None:
+        while True:
+            try:
+                async with self._replica_engine.connect() as connection:
+                    lag = (await connection.execute(REPLICA_LAG_QUERY)).scalar()
+                available = lag <= DB_REPLICA_MAX_LAG
+                if not available:
+                    logger.warning(f"Реплика отстает на {lag:.1f}с, читаем с primary")
+            except Exception as e:
+                logger.error(f"Реплика недоступна, читаем с primary: {e}")
+                available = False
+            if available and not self._replica_available:
+                logger.info("Реплика снова доступна для чтения")
+            self._replica_available = available
+            await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+    def pool_stats(self) -> Dict[str, Dict]:
+        """Текущее состояние пулов соединений primary и реплики"""
+        stats = {}
+        if self._engine is not None:
+            stats["primary"] = self._engine.pool.snapshot()
+        if self._replica_engine is not None:
+            stats["replica"] = {
+                **self._replica_engine.pool.snapshot(),
+                "available": self._replica_available,
+            }
+        return stats
+
+    def overloaded(self, wait_threshold: float) -> bool:
+        """Перегружен ли пул primary (см. InstrumentedAsyncPool.overloaded)"""
+        if self._engine is None:
+            return False
+        return self._engine.pool.overloaded(wait_threshold)
+
+    def mark_write(self, caller: str) -> None:
+        now = time.monotonic()
+        self._last_write_at[caller] = now
+        self._last_write_at.move_to_end(caller)
+        # Записи старше окна больше ни на что не влияют
+        deadline = now - DB_REPLICA_READ_YOUR_WRITES_WINDOW
+        while next(iter(self._last_write_at.values())) < deadline:
+            self._last_write_at.popitem(last=False)
+
+    def _should_read_from_replica(self, caller: Optional[str]) -> bool:
+        if self._replica_session_maker is None or not self._replica_available:
+            return False
+        if caller is None:
+            return True
+        # read-your-writes: сразу после записи реплика может еще не догнать primary
+        written_at = self._last_write_at.get(caller)
+        return (
+            written_at is None
+            or time.monotonic() - written_at > DB_REPLICA_READ_YOUR_WRITES_WINDOW
+        )
+
     @asynccontextmanager
-    async def session(self) -> AsyncIterator[AsyncSession]:
+    async def session(
+        self, caller: Optional[str] = None
+    ) -> AsyncIterator[AsyncSession]:
+        """
+        :param caller: клиент, от имени которого пишет сессия. Его чтения после
+        коммита какое-то время идут на primary. Без caller (планировщик)
+        коммиты на чтение не влияют
+        """
         if self._session_maker is None:
             raise IOError("DatabaseAccessor is not initialized")
         async with self._session_maker() as session:
+            if caller is not None:
+                session.info[CALLER_INFO_KEY] = caller
             try:
                 yield session
             except Exception:
                 await session.rollback()
                 raise
 
+    @asynccontextmanager
+    async def read_session(
+        self, primary: bool = False, caller: Optional[str] = None
+    ) -> AsyncIterator[AsyncSession]:
+        """
+        Сессия только для чтения. Идет на реплику, если она настроена, доступна и
+        caller недавно ничего не записывал; иначе на primary.
+        :param primary: принудительно читать с primary
+        :param caller: клиент, которому нужны его собственные записи
+        """
+        if primary or not self._should_read_from_replica(caller):
+            async with self.session() as session:
+                yield session
+            return
+        async with self._replica_session_maker() as session:
+            if await self._replica_connected(session):
+                try:
+                    yield session
+                except Exception as e:
+                    if _connection_lost(e):
+                        self._replica_available = False
+                    else:
+                        await session.rollback()
+                    raise
+                return
+        # Реплика не ответила: чтение еще не началось, повторяем его на primary
+        async with self.session() as session:
+            yield session
+
+    async def _replica_connected(self, session: AsyncSession) -> bool:
+        """
+        Берет для сессии соединение с репликой до того, как сессию отдадут
+        вызывающему. Если реплика не отвечает, помечает ее недоступной
+        """
+        try:
+            await session.connection()
+        except Exception as e:
+            if not _connection_lost(e):
+                raise
+            logger.error(f"Реплика недоступна, читаем с primary: {e}")
+            self._replica_available = False
+            return False
+        return True
+
     @asynccontextmanager
     async def connect(self) -> AsyncIterator[AsyncConnection]:
         if self._engine is None:
@@ -51,9 +227,40 @@ class DatabaseAccessor:
                 raise
 
 
-db_manager = DatabaseAccessor()
+def _connection_lost(error: Exception) -> bool:
+    """Ошибка связи с базой, а не самого запроса"""
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated
+    return isinstance(error, OSError)
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_write_after_commit(session: Session) -> None:
+    accessor = session.info.get("db_accessor")
+    caller = session.info.get(CALLER_INFO_KEY)
+    if accessor is not None and caller is not None:
+        accessor.mark_write(caller)
+
+
+# API и планировщик ходят в базу через разные пулы, чтобы рассылка не забирала
+# соединения у запросов бота
+db_manager = DatabaseAccessor("api")
+scheduler_db_manager = DatabaseAccessor("scheduler")
+
+
+def _caller(request: Request) -> Optional[str]:
+    # Клиент апи - владелец токена
+    return request.headers.get("Authorization")
+
+
+async def get_session(request: Request) -> AsyncSession:
+    async with db_manager.session(caller=_caller(request)) as session:
+        yield session
 
 
-async def get_session() -> AsyncSession:
-    async with db_manager.session() as session:
+async def get_read_session(request: Request) -> AsyncSession:
+    primary = request.headers.get(READ_PRIMARY_HEADER, "").lower() in ("1", "true")
+    async with db_manager.read_session(
+        primary=primary, caller=_caller(request)
+    ) as session:
         yield session
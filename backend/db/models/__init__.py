@@ -1,2 +1,2 @@
 from .base import Base
-from .models import Mailing, User
+from .models import Mailing, MailingArchive, User, TableVersion
@@ -1,9 +1,21 @@
 from datetime import datetime, timezone
 from enum import Enum as py_enum
+from typing import Optional
 
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Text, DateTime, Enum, ForeignKey, String, Integer
+from sqlalchemy import (
+    Text,
+    DateTime,
+    Enum,
+    ForeignKey,
+    String,
+    Integer,
+    BigInteger,
+    Index,
+    PrimaryKeyConstraint,
+    text,
+)
 
 from config import MAX_NAME_SIZE
 from db.models.base import Base
@@ -17,6 +29,19 @@ class Role(py_enum):
 
 
 class User(Base, IDMixin, CreatedAtMixin):
+    __table_args__ = (
+        Index("ix_user_role", "role"),
+        # Сегменты аудитории по дате регистрации
+        Index("ix_user_created_at", "created_at"),
+        # Нечеткий поиск по имени (pg_trgm)
+        Index(
+            "ix_user_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+    )
+
     name: Mapped[str] = mapped_column(String(MAX_NAME_SIZE), nullable=True)
     tg_id: Mapped[int] = mapped_column(Integer, unique=True, nullable=False)
     # Внести удаление enum поля в downgrade миграции
@@ -31,9 +56,51 @@ class User(Base, IDMixin, CreatedAtMixin):
 class MailingStatus(py_enum):
     done = "done"
     pending = "pending"
+    # Взята планировщиком в отправку, редактировать уже нельзя
+    sending = "sending"
+    # Отправка остановлена после пробной (canary) партии или прервана ошибкой,
+    # причина - в error
+    failed = "failed"
 
 
 class Mailing(Base, IDMixin, CreatedAtMixin):
+    # Таблица секционирована по статусу: горячие запросы к ожидающим рассылкам читают
+    # только маленькую секцию mailing_pending. Ключ секционирования обязан входить
+    # в первичный ключ, уникальность id обеспечивает последовательность
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "status", name="mailing_pkey"),
+        # Планировщик и админка читают только ожидающие рассылки. id в индексе -
+        # для постраничного просмотра по ключу (send_at, id)
+        Index(
+            "ix_mailing_pending_send_at",
+            "send_at",
+            "id",
+            postgresql_where=text("status = 'pending'"),
+        ),
+        # Поиск зависших в отправке рассылок
+        Index(
+            "ix_mailing_sending_claimed_at",
+            "claimed_at",
+            postgresql_where=text("status = 'sending'"),
+        ),
+        # Нечеткий поиск по названию и тексту (pg_trgm)
+        Index(
+            "ix_mailing_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_mailing_message_trgm",
+            "message",
+            postgresql_using="gin",
+            postgresql_ops={"message": "gin_trgm_ops"},
+        ),
+        {"postgresql_partition_by": "LIST (status)"},
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+
     name: Mapped[str] = mapped_column(String(MAX_NAME_SIZE), nullable=False)
     send_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
@@ -52,11 +119,65 @@ class Mailing(Base, IDMixin, CreatedAtMixin):
     # Внести удаление enum поля в downgrade миграции
     status: Mapped[MailingStatus] = mapped_column(
         Enum(MailingStatus, name="mailingstatus", native_enum=True),
+        primary_key=True,
         default=MailingStatus.pending,
         nullable=False,
     )
+    # Сегмент получателей (см. api.mailing.schemas.AudienceSegment), None - все
+    audience: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True)
+    # Версия для оптимистичной блокировки: растет при каждом изменении рассылки
+    version: Mapped[int] = mapped_column(
+        Integer, default=1, server_default=text("1"), nullable=False
+    )
+    # Когда планировщик взял рассылку в sending или последний раз продлил захват
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    # Ошибка Telegram, из-за которой рассылка переведена в failed
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     creator_id: Mapped[int] = mapped_column(
         ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
     # отношение "многие-к-одному": у рассылки есть один создатель
     creator: Mapped["User"] = relationship(back_populates="mailings")
+
+
+class MailingArchive(Base):
+    """Отправленные и остановленные рассылки, перенесенные из mailing архивацией"""
+
+    __tablename__ = "mailing_archive"
+    __table_args__ = (Index("ix_mailing_archive_archived_at", "archived_at"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(String(MAX_NAME_SIZE), nullable=False)
+    send_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    extra: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    message: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[MailingStatus] = mapped_column(
+        Enum(MailingStatus, name="mailingstatus", native_enum=True, create_type=False),
+        nullable=False,
+    )
+    audience: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Без внешнего ключа: архив переживает удаление автора
+    creator_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False,
+    )
+
+
+class TableVersion(Base):
+    """
+    Счетчик изменений таблицы. Увеличивается триггером на каждую запись в таблицу,
+    используется для дешевых ETag.
+    """
+
+    __tablename__ = "table_version"
+
+    table_name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,83 @@
+import time
+from collections import deque
+from typing import Dict
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolStats:
+    """Статистика ожидания соединений из пула"""
+
+    # Вес последнего замера в скользящем среднем ожидания
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, window: int = 1000):
+        self.checkouts: int = 0
+        self.timeouts: int = 0
+        self.total_wait: float = 0.0
+        self.max_wait: float = 0.0
+        # Дешевая оценка текущего ожидания для проверки на каждый запрос
+        self.wait_ewma: float = 0.0
+        self._recent_waits: deque[float] = deque(maxlen=window)
+
+    def add_wait(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+        self.wait_ewma += self.EWMA_ALPHA * (seconds - self.wait_ewma)
+        self._recent_waits.append(seconds)
+
+    def recent_wait_percentile(self, percentile: float) -> float:
+        if not self._recent_waits:
+            return 0.0
+        waits = sorted(self._recent_waits)
+        index = min(len(waits) - 1, int(len(waits) * percentile))
+        return waits[index]
+
+    def to_dict(self) -> Dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(
+                self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0, 3
+            ),
+            "wait_p95_ms": round(self.recent_wait_percentile(0.95) * 1000, 3),
+            "wait_max_ms": round(self.max_wait * 1000, 3),
+            "wait_ewma_ms": round(self.wait_ewma * 1000, 3),
+        }
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """Пул, который замеряет время получения соединения (ожидание + pre-ping)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.add_wait(time.perf_counter() - start)
+
+    def overloaded(self, wait_threshold: float) -> bool:
+        """Все соединения заняты, и новые запросы уже ждут дольше порога"""
+        if self._max_overflow < 0:
+            return False
+        saturated = self.checkedout() >= self.size() + self._max_overflow
+        return saturated and self.stats.wait_ewma > wait_threshold
+
+    def snapshot(self) -> Dict:
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            **self.stats.to_dict(),
+        }
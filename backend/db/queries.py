@@ -0,0 +1,367 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import (
+    Delete,
+    Insert,
+    Select,
+    Update,
+    bindparam,
+    column,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    table,
+    tuple_,
+    update,
+)
+
+from config import CAN_SEE_MAILING_REPORTS
+from db.models import Mailing, MailingArchive, User, TableVersion
+from db.models.models import MailingStatus
+
+
+def _status_is(status: MailingStatus):
+    # Статус подставляется в SQL литералом, а не параметром: иначе на generic-плане
+    # prepared statement Postgres не сможет использовать частичный индекс по статусу.
+    # Имя параметра свое у каждого статуса, чтобы не совпасть с SET status в UPDATE
+    return Mailing.status == bindparam(
+        f"status_{status.value}",
+        status,
+        type_=Mailing.status.type,
+        literal_execute=True,
+    )
+
+
+def pending_mailings() -> Select:
+    """Все ожидающие рассылки по времени отправки"""
+    return (
+        select(Mailing)
+        .where(_status_is(MailingStatus.pending))
+        .order_by(Mailing.send_at)
+    )
+
+
+def pending_mailings_page(
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+) -> Select:
+    """
+    Страница ожидающих рассылок по ключу (send_at, id) без OFFSET: запрос читает
+    из индекса только саму страницу, сколько бы рассылок ни было до нее.
+    С before строки идут в обратном порядке, их нужно развернуть
+    """
+    key = tuple_(Mailing.send_at, Mailing.id)
+    statement = select(Mailing).where(_status_is(MailingStatus.pending))
+    if before is not None:
+        return (
+            statement.where(key < tuple_(*before))
+            .order_by(Mailing.send_at.desc(), Mailing.id.desc())
+            .limit(limit)
+        )
+    if after is not None:
+        statement = statement.where(key > tuple_(*after))
+    return statement.order_by(Mailing.send_at, Mailing.id).limit(limit)
+
+
+def claim_next_mailing(now: datetime, exclude_ids: Iterable[int] = ()) -> Update:
+    """
+    Забирает в отправку одну наступившую рассылку: pending -> sending.
+    После этого правки админов к ней отклоняются. SKIP LOCKED - чтобы две
+    проверки не взяли одну рассылку
+    :param exclude_ids: рассылки, которые не брать (уже пробовали в этой проверке)
+    """
+    due = (
+        select(Mailing.id)
+        .where((Mailing.send_at <= now) & _status_is(MailingStatus.pending))
+        .order_by(Mailing.send_at, Mailing.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    exclude_ids = list(exclude_ids)
+    if exclude_ids:
+        due = due.where(Mailing.id.not_in(exclude_ids))
+    return (
+        update(Mailing)
+        .where(
+            (Mailing.id == due.scalar_subquery()) & _status_is(MailingStatus.pending)
+        )
+        .values(
+            status=MailingStatus.sending,
+            claimed_at=now,
+            version=Mailing.version + 1,
+        )
+        .returning(Mailing)
+    )
+
+
+def renew_claim(mailing_id: int, now: datetime) -> Update:
+    """Продлевает захват отправляемой рассылки"""
+    return (
+        update(Mailing)
+        .where((Mailing.id == mailing_id) & _status_is(MailingStatus.sending))
+        .values(claimed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release_mailing(mailing_id: int) -> Update:
+    """Возвращает рассылку в pending: отправка не началась, повторится позже"""
+    return (
+        update(Mailing)
+        .where((Mailing.id == mailing_id) & _status_is(MailingStatus.sending))
+        .values(
+            status=MailingStatus.pending,
+            claimed_at=None,
+            version=Mailing.version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _claim_expired(cutoff: datetime):
+    # claimed_at нет у рассылок, взятых в sending до появления колонки
+    return _status_is(MailingStatus.sending) & (
+        Mailing.claimed_at.is_(None) | (Mailing.claimed_at < cutoff)
+    )
+
+
+def fail_stale_mailings(cutoff: datetime, error: str) -> Update:
+    """
+    Останавливает рассылки, чей захват не продлевался с cutoff. В pending их
+    не вернуть: сколько получателей уже получили рассылку, неизвестно
+    """
+    return (
+        update(Mailing)
+        .where(_claim_expired(cutoff))
+        .values(
+            status=MailingStatus.failed,
+            error=error,
+            claimed_at=None,
+            version=Mailing.version + 1,
+        )
+        .returning(Mailing.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def stale_sending_mailings(cutoff: datetime) -> Select:
+    """Сколько рассылок зависло в sending и самый старый захват среди них"""
+    return select(func.count(), func.min(Mailing.claimed_at)).where(
+        _claim_expired(cutoff)
+    )
+
+
+def finish_mailing(mailing_id: int) -> Update:
+    return (
+        update(Mailing)
+        .where((Mailing.id == mailing_id) & _status_is(MailingStatus.sending))
+        .values(status=MailingStatus.done, version=Mailing.version + 1)
+        # Статус входит в первичный ключ: объекты в сессии не трогаем
+        .execution_options(synchronize_session=False)
+    )
+
+
+def fail_mailing(mailing_id: int, error: str) -> Update:
+    """Останавливает отправку: пробная партия не прошла или отправку прервала ошибка"""
+    return (
+        update(Mailing)
+        .where((Mailing.id == mailing_id) & _status_is(MailingStatus.sending))
+        .values(status=MailingStatus.failed, error=error, version=Mailing.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def update_mailing_if_version(mailing_id: int, version: int, values: Dict) -> Update:
+    """
+    Compare-and-swap правка рассылки: применяется, только если версия не изменилась
+    с момента чтения и рассылка еще ждет отправки
+    """
+    return (
+        update(Mailing)
+        .where(
+            (Mailing.id == mailing_id)
+            & (Mailing.version == version)
+            & _status_is(MailingStatus.pending)
+        )
+        .values(**values, version=Mailing.version + 1)
+        .returning(Mailing)
+    )
+
+
+def delete_mailing_if_version(mailing_id: int, version: Optional[int]) -> Delete:
+    """Удаляет рассылку, если она не отправляется и (если задана) версия совпала"""
+    condition = (Mailing.id == mailing_id) & ~_status_is(MailingStatus.sending)
+    if version is not None:
+        condition &= Mailing.version == version
+    return delete(Mailing).where(condition).returning(Mailing.id)
+
+
+def oldest_overdue_send_at(now: datetime, exclude_ids: Iterable[int] = ()) -> Select:
+    """Самое раннее время отправки среди просроченных ожидающих рассылок"""
+    statement = select(func.min(Mailing.send_at)).where(
+        _status_is(MailingStatus.pending) & (Mailing.send_at <= now)
+    )
+    exclude_ids = list(exclude_ids)
+    if exclude_ids:
+        statement = statement.where(Mailing.id.not_in(exclude_ids))
+    return statement
+
+
+def mailing_by_id(mailing_id: int) -> Select:
+    return select(Mailing).where(Mailing.id == mailing_id)
+
+
+def user_by_tg_id(tg_id: int) -> Select:
+    return select(User).where(User.tg_id == tg_id)
+
+
+def _fuzzy_match(query: str, *columns):
+    """
+    Условие и ранг нечеткого поиска. Оба оператора ускоряются GIN-индексом
+    gin_trgm_ops: ILIKE находит подстроку, <% - похожее слово (опечатки)
+    """
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    condition = or_(
+        *(column.ilike(f"%{escaped}%", escape="\\") for column in columns),
+        *(literal(query).op("<%")(column) for column in columns),
+    )
+    rank = func.greatest(*(func.word_similarity(query, column) for column in columns))
+    return condition, rank
+
+
+def search_users(query: str, limit: int, offset: int) -> Select:
+    """Пользователи, чье имя похоже на query, от самых похожих"""
+    condition, rank = _fuzzy_match(query, User.name)
+    return (
+        select(User)
+        .where(condition)
+        .order_by(rank.desc(), User.id)
+        .limit(limit)
+        .offset(offset)
+    )
+
+
+def search_mailings(
+    query: str, limit: int, offset: int, status: Optional[MailingStatus] = None
+) -> Select:
+    """Рассылки, у которых название или текст похожи на query, от самых похожих"""
+    condition, rank = _fuzzy_match(query, Mailing.name, Mailing.message)
+    statement = select(Mailing).where(condition)
+    if status is not None:
+        statement = statement.where(_status_is(status))
+    return (
+        statement.order_by(rank.desc(), Mailing.id.desc()).limit(limit).offset(offset)
+    )
+
+
+def report_recipients() -> Select:
+    """tg_id пользователей, которым приходят отчеты по рассылкам"""
+    return select(User.tg_id).where(User.role.in_(CAN_SEE_MAILING_REPORTS))
+
+
+def _as_datetime(value) -> datetime:
+    # Из JSONB даты приходят строками
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _audience_filters(segment: Optional[Dict]) -> List:
+    """
+    Условия сегмента аудитории. Каждое условие покрыто индексом:
+    role - ix_user_role, created_at - ix_user_created_at, tg_id - уникальный индекс
+    """
+    if not segment:
+        return []
+    filters = []
+    if segment.get("roles"):
+        filters.append(User.role.in_(segment["roles"]))
+    if segment.get("registered_from"):
+        filters.append(User.created_at >= _as_datetime(segment["registered_from"]))
+    if segment.get("registered_to"):
+        filters.append(User.created_at < _as_datetime(segment["registered_to"]))
+    if segment.get("tg_ids"):
+        filters.append(User.tg_id.in_(segment["tg_ids"]))
+    return filters
+
+
+def audience(segment: Optional[Dict] = None) -> Select:
+    """
+    tg_id получателей рассылки
+    :param segment: сегмент из Mailing.audience, None - все пользователи
+    """
+    return select(User.tg_id).where(*_audience_filters(segment))
+
+
+def audience_count(segment: Optional[Dict] = None) -> Select:
+    """Точное количество получателей сегмента"""
+    return select(func.count()).select_from(User).where(*_audience_filters(segment))
+
+
+def table_row_estimate(table_name: str, schema: str = "public") -> Select:
+    """Оценка числа строк таблицы из статистики планировщика (pg_class.reltuples)"""
+    pg_class = table("pg_class", column("oid"), column("reltuples"))
+    # По oid, а не по relname: одноименные индексы и таблицы других схем
+    # дали бы несколько строк
+    return select(pg_class.c.reltuples).where(
+        pg_class.c.oid == func.to_regclass(f'{schema}."{table_name}"')
+    )
+
+
+def table_version(table_name: str) -> Select:
+    """Версия таблицы для ETag"""
+    return select(TableVersion.version).where(TableVersion.table_name == table_name)
+
+
+ARCHIVED_COLUMNS = (
+    "id",
+    "name",
+    "send_at",
+    "extra",
+    "message",
+    "status",
+    "audience",
+    "error",
+    "creator_id",
+    "created_at",
+)
+
+
+def archive_finished_mailings(cutoff: datetime, batch_size: int) -> Insert:
+    """
+    Переносит пачку отправленных (done) и остановленных (failed) рассылок со
+    временем отправки раньше cutoff в архив одним запросом:
+    DELETE ... RETURNING внутри INSERT ... SELECT
+    """
+    finished = (_status_is(MailingStatus.done) | _status_is(MailingStatus.failed)) & (
+        Mailing.send_at < cutoff
+    )
+    batch = (
+        select(Mailing.id)
+        .where(finished)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    moved = (
+        delete(Mailing)
+        .where(finished & Mailing.id.in_(batch))
+        .returning(*(getattr(Mailing, column) for column in ARCHIVED_COLUMNS))
+        .cte("moved")
+    )
+    return insert(MailingArchive).from_select(
+        [*ARCHIVED_COLUMNS, "archived_at"],
+        select(*(moved.c[column] for column in ARCHIVED_COLUMNS), func.now()),
+    )
+
+
+def purge_archive(cutoff: datetime, batch_size: int) -> Delete:
+    """Удаляет пачку архивных рассылок, заархивированных раньше cutoff"""
+    batch = (
+        select(MailingArchive.id)
+        .where(MailingArchive.archived_at < cutoff)
+        .limit(batch_size)
+    )
+    return delete(MailingArchive).where(MailingArchive.id.in_(batch))
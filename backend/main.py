@@ -4,53 +4,84 @@ from typing import AsyncIterator
 
 from uvicorn import run
 from fastapi import FastAPI
-from fastapi.requests import Request
-from fastapi.responses import JSONResponse
 
-from db import db_manager
+from db import db_manager, scheduler_db_manager
 from api.users import user_router
 from api.mailing import mailing_router
-from api.utils import decode_jwt
-from scheduler import scheduler, check_and_send_mailings
-from config import get_db_link, MAILING_SEARCH_INTERVAL
+from api.debug import debug_router
+from api.batch import batch_router
+from api.health import health_router
+from api.middleware import JWTAuthMiddleware
+from api.ratelimit import RateLimitMiddleware, build_rate_limit_backend
+from api.role_events import role_event_publisher
+from api.profiling import enable_profiling, loop_lag_monitor
+from scheduler import (
+    scheduler,
+    scheduler_heartbeat,
+    check_and_send_mailings,
+    archive_finished_mailings,
+)
+from config import (
+    get_db_link,
+    get_replica_db_link,
+    MAILING_SEARCH_INTERVAL,
+    ARCHIVE_INTERVAL,
+    AUTH_EXEMPT_PATHS,
+    PROFILING_ENABLED,
+    RATE_LIMIT_ENABLED,
+    LOAD_SHEDDING_ENABLED,
+)
+
+
+rate_limit_backend = build_rate_limit_backend() if RATE_LIMIT_ENABLED else None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
-    db_manager.init(db_url=get_db_link())
+    for manager in (db_manager, scheduler_db_manager):
+        manager.init(db_url=get_db_link(), replica_url=get_replica_db_link())
+        manager.start_replica_monitor()
     scheduler.add_job(
         check_and_send_mailings, "interval", seconds=MAILING_SEARCH_INTERVAL
     )
+    scheduler.add_job(archive_finished_mailings, "interval", seconds=ARCHIVE_INTERVAL)
     scheduler.start()
+    scheduler_heartbeat.start()
+    if PROFILING_ENABLED:
+        loop_lag_monitor.start()
     yield
+    loop_lag_monitor.stop()
     await db_manager.close()
+    await scheduler_db_manager.close()
+    if rate_limit_backend is not None:
+        await rate_limit_backend.close()
+    if role_event_publisher is not None:
+        await role_event_publisher.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-@app.middleware("http")
-async def jwt_auth_middleware(request: Request, call_next):
-    # Открытые эндпоинты документации
-    if request.url.path in ["/docs", "/openapi.json"]:
-        return await call_next(request)
-
-    authorization: str = request.headers.get("Authorization")
-    if not authorization:
-        return JSONResponse(
-            status_code=401,
-            content={"detail": "Missing or invalid Authorization header"},
-        )
-
-    token = authorization
-    access = decode_jwt(token)
-    if not access:
-        return JSONResponse(status_code=401, content={"detail": "Invalid token"})
-    return await call_next(request)
-
+# Мидлвари выполняются в порядке, обратном добавлению: лимиты стоят после
+# авторизации и считают запросы только с проверенным токеном
+if RATE_LIMIT_ENABLED or LOAD_SHEDDING_ENABLED:
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=rate_limit_backend,
+        routes=app.router.routes,
+        shedding=LOAD_SHEDDING_ENABLED,
+    )
+# Открытые эндпоинты (документация и т.п.) задаются через AUTH_EXEMPT_PATHS
+app.add_middleware(JWTAuthMiddleware, exempt_paths=AUTH_EXEMPT_PATHS)
 
 app.include_router(user_router, prefix="/api/v1")
 app.include_router(mailing_router, prefix="/api/v1")
+app.include_router(batch_router, prefix="/api/v1")
+app.include_router(debug_router, prefix="/api/v1")
+app.include_router(health_router)
+
+if PROFILING_ENABLED:
+    enable_profiling(app)
 
 logging.basicConfig(
     level=logging.INFO,
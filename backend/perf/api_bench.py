@@ -0,0 +1,377 @@
+"""
+Нагрузочный прогон роутов апи внутри процесса.
+
+Приложение вызывается через ASGI-транспорт httpx, без сети и uvicorn, поверх
+локальной Postgres с синтетическими данными. Для каждого роута пользователей и
+рассылок считаются пропускная способность и задержки p50/p99, результат пишется
+в JSON, который удобно сравнивать между коммитами.
+
+Запуск из каталога backend на мигрированной базе:
+    python -m perf.api_bench --seed --output bench.json
+    python -m perf.api_bench --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from typing import Callable, Dict, List, Optional
+
+import jwt
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config import get_db_link, get_replica_db_link, SECRET_KEY
+from api.ratelimit import RateLimitMiddleware
+from db import db_manager
+from main import app
+from perf.seed import SEED_TG_ID_OFFSET, seed_database
+from scheduler import progress_broker
+
+
+API_PREFIX = "/api/v1"
+# tg_id пользователей, которых создает сам бенчмарк, чтобы не задеть сидированных
+BENCH_TG_ID_OFFSET = 900_000_000
+# id рассылки для SSE-кейса: прогресс публикуется в памяти, в базе ее нет
+BENCH_PROGRESS_MAILING_ID = -1
+
+
+@dataclass
+class BenchCase:
+    name: str
+    method: str
+    # Путь и тело строятся по порядковому номеру запроса
+    path: Callable[[int], str]
+    json: Optional[Callable[[int], Dict]] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    expected_status: int = 200
+    # Для кейсов 304: ETag этого пути берется прямо перед прогоном кейса,
+    # чтобы его не сбили записи предыдущих кейсов
+    etag_path: Optional[str] = None
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * percent))
+    return ordered[index]
+
+
+def _seeded_tg_id(i: int, users: int) -> int:
+    return SEED_TG_ID_OFFSET + 1 + i % users
+
+
+def _mailing_payload(i: int) -> Dict:
+    send_at = datetime.now(timezone.utc) + timedelta(days=365)
+    return {
+        "name": f"bench {i}",
+        "send_at": send_at.isoformat(),
+        "message": "bench message",
+        "creator_id": SEED_TG_ID_OFFSET + 1,
+    }
+
+
+async def prepare_mailings(client: AsyncClient, amount: int) -> List[int]:
+    """Создает рассылки для кейсов обновления и удаления (время не замеряется)"""
+    ids = []
+    for i in range(amount):
+        response = await client.post(
+            f"{API_PREFIX}/mailings/", json=_mailing_payload(i)
+        )
+        response.raise_for_status()
+        ids.append(response.json()["id"])
+    return ids
+
+
+async def get_etag(client: AsyncClient, path: str) -> str:
+    response = await client.get(path)
+    response.raise_for_status()
+    return response.headers["ETag"]
+
+
+async def build_cases(
+    client: AsyncClient, users: int, requests: int, run_id: int
+) -> List[BenchCase]:
+    mailing_ids = await prepare_mailings(client, requests)
+    user_path = f"{API_PREFIX}/users/{_seeded_tg_id(0, users)}"
+    progress_broker.publish(
+        BENCH_PROGRESS_MAILING_ID,
+        {
+            "sent": 1,
+            "failed": 0,
+            "remaining": 0,
+            "total": 1,
+            "throughput": 1.0,
+            "eta_seconds": None,
+            "finished": True,
+        },
+    )
+    # Новые tg_id не должны совпадать между запусками на одной базе
+    new_tg_id = BENCH_TG_ID_OFFSET + run_id * requests
+    return [
+        BenchCase(
+            "create_user",
+            "POST",
+            lambda i: f"{API_PREFIX}/users/",
+            json=lambda i: {"name": "bench", "tg_id": new_tg_id + i, "role": "user"},
+        ),
+        BenchCase(
+            "get_user_by_tg_id",
+            "GET",
+            lambda i: f"{API_PREFIX}/users/{_seeded_tg_id(i, users)}",
+        ),
+        BenchCase(
+            "get_user_by_tg_id_not_modified",
+            "GET",
+            lambda i: user_path,
+            expected_status=304,
+            etag_path=user_path,
+        ),
+        BenchCase(
+            "search_users",
+            "GET",
+            lambda i: f"{API_PREFIX}/users/search?q=user%20{i % users + 1}",
+        ),
+        BenchCase(
+            "get_roles", "GET", lambda i: f"{API_PREFIX}/users/constraints/roles"
+        ),
+        BenchCase(
+            "update_user_by_tg_id",
+            "PATCH",
+            lambda i: f"{API_PREFIX}/users/{_seeded_tg_id(i, users)}",
+            json=lambda i: {"name": f"user {i}"},
+        ),
+        BenchCase("get_mailings", "GET", lambda i: f"{API_PREFIX}/mailings/"),
+        BenchCase(
+            "get_mailings_not_modified",
+            "GET",
+            lambda i: f"{API_PREFIX}/mailings/",
+            expected_status=304,
+            etag_path=f"{API_PREFIX}/mailings/",
+        ),
+        BenchCase(
+            "get_mailings_page",
+            "GET",
+            lambda i: f"{API_PREFIX}/mailings/page?limit=10",
+        ),
+        BenchCase(
+            "get_mailing",
+            "GET",
+            lambda i: f"{API_PREFIX}/mailings/{mailing_ids[i % len(mailing_ids)]}",
+        ),
+        BenchCase(
+            "create_mailing",
+            "POST",
+            lambda i: f"{API_PREFIX}/mailings/",
+            json=_mailing_payload,
+            expected_status=201,
+        ),
+        BenchCase(
+            "search_mailings",
+            "GET",
+            lambda i: f"{API_PREFIX}/mailings/search?q=mailing%20{i % 1000 + 1}",
+        ),
+        BenchCase(
+            "estimate_mailing_audience",
+            "POST",
+            lambda i: f"{API_PREFIX}/mailings/audience/estimate",
+            json=lambda i: {"roles": ["moderator"]},
+        ),
+        BenchCase(
+            "update_mailing",
+            "PATCH",
+            lambda i: f"{API_PREFIX}/mailings/{mailing_ids[i % len(mailing_ids)]}",
+            # Каждая рассылка обновляется один раз, поэтому версия еще начальная
+            json=lambda i: {"message": f"bench message {i}", "version": 1},
+        ),
+        BenchCase(
+            "stream_mailing_progress",
+            "GET",
+            lambda i: f"{API_PREFIX}/mailings/{BENCH_PROGRESS_MAILING_ID}/progress",
+        ),
+        # Последним: удаляет рассылки, которые обновлял update_mailing
+        BenchCase(
+            "delete_mailing",
+            "DELETE",
+            lambda i: f"{API_PREFIX}/mailings/{mailing_ids[i]}",
+            expected_status=204,
+        ),
+    ]
+
+
+async def run_case(
+    client: AsyncClient, case: BenchCase, requests: int, concurrency: int
+) -> Dict:
+    """Гоняет requests запросов кейса в concurrency параллельных воркерах"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = count()
+
+    async def worker() -> None:
+        while (i := next(counter)) < requests:
+            start = time.perf_counter()
+            try:
+                response = await client.request(
+                    case.method,
+                    case.path(i),
+                    json=case.json(i) if case.json else None,
+                    headers=case.headers,
+                )
+                status = str(response.status_code)
+                ok = response.status_code == case.expected_status
+            except Exception as e:
+                status = type(e).__name__
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors[status] = errors.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict, baseline: Optional[Dict]) -> None:
+    print(f"{'case':<32}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}  errors")
+    for name, result in results["cases"].items():
+        line = (
+            f"{name:<32}{result['rps']:>10}{result['p50_ms']:>10}"
+            f"{result['p99_ms']:>10}  {result['errors'] or ''}"
+        )
+        old = (baseline or {}).get("cases", {}).get(name)
+        if old and old["p50_ms"] and old["p99_ms"]:
+            p50 = (result["p50_ms"] / old["p50_ms"] - 1) * 100
+            p99 = (result["p99_ms"] / old["p99_ms"] - 1) * 100
+            line += f"  p50 {p50:+.1f}% p99 {p99:+.1f}%"
+        print(line)
+
+
+async def run_bench(args: argparse.Namespace) -> int:
+    # Лог httpx на каждый запрос искажает замеры
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if args.seed:
+        engine = create_async_engine(args.db_url)
+        try:
+            async with engine.begin() as conn:
+                await seed_database(
+                    conn,
+                    users=args.users,
+                    done_mailings=args.done_mailings,
+                    pending_mailings=args.pending_mailings,
+                )
+        finally:
+            await engine.dispose()
+
+    # Лимиты запросов исказили бы замеры: по умолчанию мидлварь убирается,
+    # пока стек еще не собран
+    if not args.rate_limit:
+        app.user_middleware = [
+            middleware
+            for middleware in app.user_middleware
+            if middleware.cls is not RateLimitMiddleware
+        ]
+    # ASGI-транспорт не запускает lifespan: базу поднимаем сами, а планировщик
+    # не стартуем, чтобы он не начал рассылать во время замеров
+    replica_url = get_replica_db_link() if args.replica else None
+    db_manager.init(db_url=args.db_url, replica_url=replica_url)
+    if args.replica:
+        db_manager.start_replica_monitor()
+    token = jwt.encode({}, SECRET_KEY, algorithm="HS256")
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "cases": {},
+    }
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(app=app),
+            base_url="http://bench",
+            headers={"Authorization": token},
+        ) as client:
+            cases = await build_cases(
+                client, args.users, args.requests, run_id=int(time.time()) % 100_000
+            )
+            for case in cases:
+                if args.only and case.name not in args.only:
+                    continue
+                if case.etag_path:
+                    etag = await get_etag(client, case.etag_path)
+                    case.headers["If-None-Match"] = etag
+                # Прогреваются только читающие роуты: повтор записи меняет данные
+                if args.warmup and case.method == "GET":
+                    await run_case(client, case, args.warmup, args.concurrency)
+                results["cases"][case.name] = await run_case(
+                    client, case, args.requests, args.concurrency
+                )
+    finally:
+        await db_manager.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+    return 1 if any(case["errors"] for case in results["cases"].values()) else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db-url", default=get_db_link())
+    parser.add_argument(
+        "--seed", action="store_true", help="досыпать синтетические данные"
+    )
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--done-mailings", type=int, default=10_000)
+    parser.add_argument("--pending-mailings", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на роут")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=50, help="прогрев GET-роутов")
+    parser.add_argument("--only", nargs="*", help="прогнать только эти кейсы")
+    parser.add_argument(
+        "--replica", action="store_true", help="читать с реплики из конфига"
+    )
+    parser.add_argument(
+        "--rate-limit", action="store_true", help="не отключать лимиты запросов"
+    )
+    parser.add_argument("--output", help="куда записать результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run_bench(parse_args())))
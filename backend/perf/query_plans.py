@@ -0,0 +1,150 @@
+"""
+Проверка планов запросов, которые выполняют роуты и планировщик.
+
+Прогоняет EXPLAIN по каждому запросу из db.queries на локальной базе и завершается
+с кодом 1, если какой-то из них ушел в последовательное сканирование.
+
+Запуск из каталога backend на мигрированной базе:
+    python -m perf.query_plans --seed
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from sqlalchemy import Executable
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from config import get_db_link
+from db import queries
+from db.models.models import MailingStatus
+from perf.seed import SEED_TG_ID_OFFSET, seed_database
+
+
+@dataclass
+class PlanCase:
+    name: str
+    statement: Executable
+    # Запросы, которые по смыслу читают всю таблицу
+    allow_seq_scan: bool = False
+
+
+def build_cases() -> List[PlanCase]:
+    seeded_tg_ids = range(SEED_TG_ID_OFFSET + 1, SEED_TG_ID_OFFSET + 11)
+    return [
+        PlanCase("pending_mailings", queries.pending_mailings()),
+        PlanCase(
+            "claim_next_mailing",
+            queries.claim_next_mailing(datetime.now(timezone.utc)),
+        ),
+        PlanCase(
+            "fail_stale_mailings",
+            queries.fail_stale_mailings(datetime.now(timezone.utc), "plan"),
+        ),
+        PlanCase(
+            "update_mailing_if_version",
+            queries.update_mailing_if_version(1, 1, {"name": "plan"}),
+        ),
+        PlanCase(
+            "pending_mailings_page",
+            queries.pending_mailings_page(
+                11, after=(datetime.now(timezone.utc) - timedelta(days=1), 1)
+            ),
+        ),
+        PlanCase("mailing_by_id", queries.mailing_by_id(1)),
+        PlanCase("user_by_tg_id", queries.user_by_tg_id(SEED_TG_ID_OFFSET + 1)),
+        PlanCase("report_recipients", queries.report_recipients()),
+        PlanCase("audience", queries.audience(), allow_seq_scan=True),
+        PlanCase("audience_by_role", queries.audience({"roles": ["moderator"]})),
+        PlanCase(
+            "audience_by_registration",
+            queries.audience(
+                {"registered_from": datetime.now(timezone.utc) - timedelta(days=1)}
+            ),
+        ),
+        PlanCase(
+            "audience_by_tg_ids",
+            queries.audience({"tg_ids": list(seeded_tg_ids)}),
+        ),
+        PlanCase("search_users", queries.search_users("user 4242", 11, 0)),
+        PlanCase(
+            "search_mailings",
+            queries.search_mailings("mailing 4242", 11, 0, MailingStatus.done),
+        ),
+        # Таблица из пары строк: планировщик законно читает ее целиком
+        PlanCase(
+            "table_version",
+            queries.table_version("mailing"),
+            allow_seq_scan=True,
+        ),
+    ]
+
+
+def find_seq_scans(plan: Dict) -> List[str]:
+    """Рекурсивно собирает таблицы, которые читаются через Seq Scan"""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found.extend(find_seq_scans(child))
+    return found
+
+
+async def explain(conn: AsyncConnection, statement: Executable) -> Dict:
+    sql = statement.compile(
+        dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+    )
+    result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")
+    raw = result.scalar()
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    return raw[0]["Plan"]
+
+
+async def check_plans(args: argparse.Namespace) -> int:
+    engine = create_async_engine(args.db_url)
+    failed = 0
+    try:
+        if args.seed:
+            async with engine.begin() as conn:
+                await seed_database(
+                    conn,
+                    users=args.users,
+                    done_mailings=args.done_mailings,
+                    pending_mailings=args.pending_mailings,
+                )
+        async with engine.connect() as conn:
+            for case in build_cases():
+                plan = await explain(conn, case.statement)
+                seq_scans = find_seq_scans(plan)
+                if seq_scans and not case.allow_seq_scan:
+                    failed += 1
+                    print(f"FAIL {case.name}: Seq Scan on {', '.join(seq_scans)}")
+                else:
+                    print(f"OK   {case.name}: {plan['Node Type']}")
+                if args.verbose:
+                    print(json.dumps(plan, indent=2))
+    finally:
+        await engine.dispose()
+    return 1 if failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db-url", default=get_db_link())
+    parser.add_argument(
+        "--seed", action="store_true", help="досыпать синтетические данные"
+    )
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--done-mailings", type=int, default=100_000)
+    parser.add_argument("--pending-mailings", type=int, default=50)
+    parser.add_argument("--verbose", action="store_true", help="печатать планы")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(check_plans(parse_args())))
@@ -0,0 +1,62 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+# tg_id сидированных пользователей начинаются отсюда, чтобы не пересекаться с реальными
+SEED_TG_ID_OFFSET = 100_000_000
+
+
+async def seed_database(
+    conn: AsyncConnection,
+    users: int,
+    done_mailings: int,
+    pending_mailings: int,
+) -> None:
+    """
+    Наполняет локальную базу синтетическими данными и обновляет статистику планировщика.
+    Повторный запуск досыпает только недостающее количество строк.
+    :param conn: соединение с уже мигрированной базой
+    :param users: сколько пользователей должно быть в базе
+    :param done_mailings: сколько завершенных рассылок
+    :param pending_mailings: сколько ожидающих рассылок
+    """
+    users_count = (await conn.execute(text('SELECT count(*) FROM "user"'))).scalar()
+    await conn.execute(
+        text(
+            """
+            INSERT INTO "user" (name, tg_id, role, created_at)
+            SELECT 'user ' || g,
+                   :offset + g,
+                   (CASE WHEN g % 1000 = 0 THEN 'moderator' ELSE 'user' END)::userrole,
+                   now() - (g % 365) * interval '1 day'
+            FROM generate_series(:start, :stop) AS g
+            """
+        ),
+        {"offset": SEED_TG_ID_OFFSET, "start": users_count + 1, "stop": users},
+    )
+    for status, count in (("done", done_mailings), ("pending", pending_mailings)):
+        mailings_count = (
+            await conn.execute(
+                text("SELECT count(*) FROM mailing WHERE status = :status"),
+                {"status": status},
+            )
+        ).scalar()
+        await conn.execute(
+            text(
+                """
+                INSERT INTO mailing (name, send_at, extra, message, status, creator_id, created_at)
+                SELECT 'mailing ' || g,
+                       now() + (CASE WHEN :status = 'done' THEN -1 ELSE 1 END)
+                             * (g % 10000) * interval '1 minute',
+                       '{}'::jsonb,
+                       repeat('message text ', 20),
+                       CAST(:status AS mailingstatus),
+                       (SELECT min(id) FROM "user"),
+                       now()
+                FROM generate_series(:start, :stop) AS g
+                """
+            ),
+            {"status": status, "start": mailings_count + 1, "stop": count},
+        )
+    await conn.execute(text('ANALYZE "user"'))
+    await conn.execute(text("ANALYZE mailing"))
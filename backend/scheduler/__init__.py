@@ -1,2 +1,4 @@
 from .scheduler import scheduler
-from .tasks import check_and_send_mailings
+from .tasks import check_and_send_mailings, archive_finished_mailings
+from .progress import progress_broker
+from .heartbeat import scheduler_heartbeat
@@ -0,0 +1,38 @@
+import time
+from typing import Optional, Set
+
+
+class SchedulerHeartbeat:
+    """
+    Признаки жизни планировщика для readiness-проверки.
+    beat() вызывается в конце каждой проверки рассылок и во время отправки,
+    поэтому долгая рассылка не выглядит зависшим планировщиком.
+    """
+
+    def __init__(self):
+        self.last_beat: Optional[float] = None
+        self.last_tick_error: Optional[str] = None
+        # Рассылки, взятые в работу в текущей проверке: они не считаются просроченными
+        self.active_mailings: Set[int] = set()
+
+    def start(self) -> None:
+        """Отсчет с момента запуска, чтобы до первой проверки апи не считался неготовым"""
+        self.last_beat = time.monotonic()
+
+    def beat(self) -> None:
+        self.last_beat = time.monotonic()
+
+    def tick_failed(self, error: BaseException) -> None:
+        self.last_tick_error = f"{type(error).__name__}: {error}"
+
+    def tick_succeeded(self) -> None:
+        self.last_tick_error = None
+        self.beat()
+
+    def seconds_since_beat(self) -> Optional[float]:
+        if self.last_beat is None:
+            return None
+        return time.monotonic() - self.last_beat
+
+
+scheduler_heartbeat = SchedulerHeartbeat()
@@ -29,7 +29,8 @@ class MailingSendConverter:
         if media := extra.get("media"):
             media_type = media.get("media_type")
             delivery_method = self.DELIVERY_METHODS.get(media_type)
-            parsed_extra[media_type] = media["url"]
+            # file_id загруженного ботом файла: Telegram не скачивает его заново
+            parsed_extra[media_type] = media.get("file_id") or media["url"]
             parsed_extra["caption"] = message
         else:
             delivery_method = self.DELIVERY_METHODS["default"]
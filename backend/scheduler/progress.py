@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Optional, Set
+
+from config import PROGRESS_KEEP_FINISHED
+
+
+class ProgressBroker:
+    """
+    In-process pub/sub прогресса рассылок.
+    Подписчик всегда получает только последнее состояние: очередь на одно значение,
+    при переполнении старое значение вытесняется, поэтому медленный клиент не копит память.
+    """
+
+    def __init__(self, keep_finished: float = PROGRESS_KEEP_FINISHED):
+        self.keep_finished = keep_finished
+        self._latest: Dict[int, Dict] = {}
+        self._finished_at: Dict[int, float] = {}
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+
+    def publish(self, mailing_id: int, snapshot: Dict) -> None:
+        self._latest[mailing_id] = snapshot
+        if snapshot.get("finished"):
+            self._finished_at[mailing_id] = time.monotonic()
+        for queue in self._subscribers.get(mailing_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+        self._prune()
+
+    def latest(self, mailing_id: int) -> Optional[Dict]:
+        return self._latest.get(mailing_id)
+
+    async def subscribe(
+        self, mailing_id: int, heartbeat: float
+    ) -> AsyncIterator[Optional[Dict]]:
+        """
+        Отдает состояния рассылки до ее завершения.
+        None отдается, если за heartbeat секунд ничего не изменилось.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers[mailing_id].add(queue)
+        try:
+            snapshot = self._latest.get(mailing_id)
+            if snapshot is not None:
+                yield snapshot
+                if snapshot.get("finished"):
+                    return
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield snapshot
+                if snapshot.get("finished"):
+                    return
+        finally:
+            self._subscribers[mailing_id].discard(queue)
+            if not self._subscribers[mailing_id]:
+                del self._subscribers[mailing_id]
+
+    def _prune(self) -> None:
+        deadline = time.monotonic() - self.keep_finished
+        for mailing_id, finished_at in list(self._finished_at.items()):
+            if finished_at < deadline:
+                del self._finished_at[mailing_id]
+                self._latest.pop(mailing_id, None)
+
+
+progress_broker = ProgressBroker()
@@ -1,3 +1,4 @@
+import html
 from datetime import datetime, timedelta
 from typing import Tuple, Dict, Optional
 
@@ -9,12 +10,15 @@ class MailingReport:
 
     DELIVERY_METHOD = "sendMessage"
 
-    def __init__(self, mailing_name: str):
+    def __init__(self, mailing_name: str, total: int = 0):
         self._start_time: Optional[datetime] = None
         self._stop_time: Optional[datetime] = None
         self.mailing_name = mailing_name
+        self.total = total
         self._sent: int = 0
         self._error: int = 0
+        # Ошибка, из-за которой отправка остановлена после пробной партии
+        self.failure: Optional[str] = None
 
     def add_sent(self) -> None:
         self._sent += 1
@@ -22,6 +26,11 @@ class MailingReport:
     def add_error(self) -> None:
         self._error += 1
 
+    @property
+    def processed(self) -> int:
+        """Сколько сообщений уже отправлено или не дошло"""
+        return self._sent + self._error
+
     def prepare_report_text(self) -> str:
         text = (
             f"Отчет по рассылке {self.mailing_name}\n"
@@ -29,6 +38,10 @@ class MailingReport:
             f"Не отправлено: {self._error}\n"
             f"Рассылка выполнена за: {self.executing_time()}"
         )
+        if self.failure:
+            # Отчет уходит с parse_mode=HTML, а ошибка часто как раз про теги
+            failure = html.escape(self.failure, quote=False)
+            text += f"\nОстановлена после пробной партии: {failure}"
         return text
 
     def prepare_data_to_send(self) -> Tuple[str, Dict]:
@@ -42,6 +55,23 @@ class MailingReport:
     def stop_timer(self):
         self._stop_time = datetime.now()
 
+    def progress_snapshot(self) -> Dict:
+        """Текущее состояние рассылки для стрима прогресса"""
+        processed = self.processed
+        remaining = max(self.total - processed, 0)
+        elapsed = self.executing_time().total_seconds() if self._start_time else 0.0
+        throughput = processed / elapsed if elapsed > 0 else 0.0
+        return {
+            "sent": self._sent,
+            "failed": self._error,
+            "remaining": remaining,
+            "total": self.total,
+            "throughput": round(throughput, 2),
+            "eta_seconds": round(remaining / throughput, 1) if throughput else None,
+            "finished": self._stop_time is not None,
+            "error": self.failure,
+        }
+
     def executing_time(self) -> timedelta:
         if self._stop_time:
             return self._stop_time - self._start_time
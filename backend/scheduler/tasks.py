@@ -1,86 +1,396 @@
 import asyncio
 import logging
+import time
 
-from datetime import datetime, timezone
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 
-from httpx import AsyncClient
-from sqlalchemy import select
+from typing import Iterable, List, Optional, Set, Union
 
-from db import db_manager
-from db.models import User, Mailing
+from httpx import AsyncClient, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import scheduler_db_manager, queries
+from db.models import Mailing
 from scheduler.report import MailingReport
 from scheduler.mailing_converter import MailingSendConverter
-from config import CAN_SEE_MAILING_REPORTS
+from scheduler.progress import progress_broker
+from scheduler.heartbeat import scheduler_heartbeat
+from config import (
+    PROGRESS_PUBLISH_INTERVAL,
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_RETENTION_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    AUDIENCE_STREAM_BATCH,
+    MAILING_SEND_CONCURRENCY,
+    MAILING_CLAIM_TIMEOUT,
+    CANARY_SIZE,
+    CANARY_TARGET,
+    CANARY_MAX_ERROR_RATE,
+)
 
 
 logger = logging.getLogger("TasksLogger")
+STALE_MAILING_ERROR = "Отправка прервана: планировщик остановился посреди отправки"
 
 
 async def send_tg_message(url, data, chat_id):
-    data.update({"chat_id": chat_id})
+    # data общий для всех получателей рассылки: chat_id только в копии, иначе
+    # параллельные задачи перетирают его друг другу
     async with AsyncClient() as client:
-        response = await client.post(url=url, json=data)
+        response = await client.post(url=url, json={**data, "chat_id": chat_id})
     return response
 
 
+# Итог отправки одного сообщения: ответ Telegram или сетевой сбой
+SendOutcome = Union[Response, BaseException]
+
+
+def _is_sent(outcome: SendOutcome) -> bool:
+    return isinstance(outcome, Response) and outcome.status_code in (200, 201)
+
+
+def _telegram_error(outcome: SendOutcome) -> str:
+    """Код и описание ошибки из ответа Telegram или тип сетевого сбоя"""
+    if isinstance(outcome, BaseException):
+        return f"{type(outcome).__name__}: {outcome}"
+    try:
+        body = outcome.json()
+    except ValueError:
+        return f"{outcome.status_code}: {outcome.text[:200]}"
+    return f"{body.get('error_code', outcome.status_code)}: {body.get('description')}"
+
+
+def _account(
+    outcome: SendOutcome, errors: Counter, mailing_report: Optional[MailingReport]
+) -> None:
+    """Учитывает ответ в отчете; ошибки копятся в счетчике, а не пишутся по одной"""
+    if _is_sent(outcome):
+        if mailing_report is not None:
+            mailing_report.add_sent()
+        return
+    errors[_telegram_error(outcome)] += 1
+    if mailing_report is not None:
+        mailing_report.add_error()
+
+
+async def _run_canary(
+    url: str,
+    data: dict,
+    chat_ids: Iterable[int],
+    errors: Counter,
+    mailing_report: Optional[MailingReport] = None,
+) -> Optional[str]:
+    """
+    Отправляет рассылку пробной партии и ждет все ответы
+    :param mailing_report: отчет, если партия - часть аудитории (а не модераторы)
+    :return: самая частая ошибка, если доля ошибок больше CANARY_MAX_ERROR_RATE
+    """
+    # Сетевой сбой - такая же неудача пробной партии, как ошибка Telegram
+    outcomes = await asyncio.gather(
+        *(send_tg_message(url, data, chat_id) for chat_id in chat_ids),
+        return_exceptions=True,
+    )
+    failed = Counter()
+    for outcome in outcomes:
+        _account(outcome, errors, mailing_report)
+        if not _is_sent(outcome):
+            failed[_telegram_error(outcome)] += 1
+    if sum(failed.values()) > len(outcomes) * CANARY_MAX_ERROR_RATE:
+        return failed.most_common(1)[0][0]
+    return None
+
+
+async def _collect_sent(
+    pending: Set[asyncio.Task],
+    errors: Counter,
+    mailing_report: MailingReport,
+    return_when: str = asyncio.FIRST_COMPLETED,
+) -> Set[asyncio.Task]:
+    """Дожидается отправок из pending, учитывает их и возвращает оставшиеся"""
+    done, pending = await asyncio.wait(pending, return_when=return_when)
+    for task in done:
+        # Сбой сети у одного получателя - его ошибка, а не всей рассылки
+        error = task.exception()
+        _account(error if error is not None else task.result(), errors, mailing_report)
+    return pending
+
+
+def _publish_progress(
+    mailing_id: int, mailing_report: MailingReport, last_published: float
+) -> float:
+    """
+    Публикует прогресс не чаще PROGRESS_PUBLISH_INTERVAL, чтобы подписчики
+    не будились на каждое сообщение
+    :return: время последней публикации
+    """
+    if time.monotonic() - last_published < PROGRESS_PUBLISH_INTERVAL:
+        return last_published
+    progress_broker.publish(mailing_id, mailing_report.progress_snapshot())
+    # Долгая отправка - это работа, а не зависание планировщика
+    scheduler_heartbeat.beat()
+    return time.monotonic()
+
+
+def _log_errors(mailing_id: int, errors: Counter) -> None:
+    """Одна строка на каждую разную ошибку, а не на каждого получателя"""
+    for error, count in errors.most_common():
+        logger.error(f"Рассылка {mailing_id}: {count} x {error}")
+
+
 async def check_and_send_mailings():
     """Проверяет необходимость начинать рассылки"""
+    try:
+        await send_due_mailings()
+    except Exception as e:
+        scheduler_heartbeat.tick_failed(e)
+        raise
+    finally:
+        # Проверки не пересекаются (max_instances=1), так что все активные - наши
+        scheduler_heartbeat.active_mailings.clear()
+    scheduler_heartbeat.tick_succeeded()
+
+
+async def send_due_mailings():
+    """Отправляет рассылки, время которых наступило"""
     logger.debug("Начинаю проверку рассылок")
-    async with db_manager.session() as session:
-        # Получаем данные из бд
-        moderators_result = await session.execute(
-            select(User.tg_id).where(User.role.in_(CAN_SEE_MAILING_REPORTS))
-        )
+    # Получатели читаются с реплики (если она есть), статусы рассылок пишутся в primary
+    async with scheduler_db_manager.read_session() as read_session:
+        moderators_result = await read_session.execute(queries.report_recipients())
         moderators = list(moderators_result.scalars().all())
-        user_result = await session.execute(select(User.tg_id))
-        users_tg_id = list(user_result.scalars().all())
-        if not users_tg_id:
-            logger.debug("В базе нет пользователей для рассылок")
-            return
-        mailing_result = await session.execute(
-            select(Mailing).where(
-                (Mailing.send_at <= datetime.now(timezone.utc))
-                & (Mailing.status == "pending")
-            )
-        )
-        mailings = mailing_result.scalars().all()
-
+    async with scheduler_db_manager.session() as session:
+        await _fail_stale_mailings(session)
         # Инициализация конвертора для преобразования данных под API TG
         converter = MailingSendConverter()
-        for mailing in mailings:
+        # Рассылки, которые уже пробовали в этой проверке: вернувшуюся в pending
+        # после ошибки не берем повторно до следующей проверки
+        attempted: Set[int] = set()
+        while True:
+            # Рассылки забираются по одной: pending -> sending с коммитом сразу,
+            # с этого момента правки из админки получают 409, а не теряются молча.
+            # Остальные наступившие рассылки пока остаются pending
+            mailing_result = await session.execute(
+                queries.claim_next_mailing(datetime.now(timezone.utc), attempted)
+            )
+            mailing = mailing_result.scalar_one_or_none()
+            await session.commit()
+            if mailing is None:
+                return
+            attempted.add(mailing.id)
+            # Взятые в работу рассылки не считаются просроченными в readiness
+            scheduler_heartbeat.active_mailings.add(mailing.id)
             # Инициализируем объект отчета для сбора статистики
             mailing_report = MailingReport(mailing.name)
-
-            # Запуск таймера рассылки
-            mailing_report.start_timer()
-            url, prepared_data = converter.prepare_to_send(mailing)
-
-            # Создаем фоновые задачи для отправки. Слабое место для памяти в будущем,
-            # если будет много пользователей - нужен контроль за количеством одновременных фоновых задач.
-            # Подойдет семафор или конструкции с asyncio.wait()
-            tasks = []
-            for tg_id in users_tg_id:
-                tasks.append(
-                    asyncio.create_task(send_tg_message(url, prepared_data, tg_id))
+            lease = asyncio.create_task(_keep_claimed(mailing.id))
+            try:
+                await send_mailing(
+                    session, mailing, mailing_report, moderators, converter
                 )
-            logger.info(f"Началась рассылка {mailing.id}")
-
-            # Ждем выполнения всех фоновых задач, чтобы собрать статистику и остановить таймер
-            results = await asyncio.gather(*tasks)
-            mailing_report.stop_timer()
-            for response in results:
-                if response.status_code in (200, 201):
-                    mailing_report.add_sent()
-                else:
-                    logger.error(response.json())
-                    mailing_report.add_error()
-
-            # Рассылка статистики модерам
-            for moderator_tg_id in moderators:
-                url, prepared_data = mailing_report.prepare_data_to_send()
-                asyncio.create_task(
-                    send_tg_message(url, prepared_data, moderator_tg_id)
-                )
-            logger.info(f"Началась рассылка для модераторов с отчетом по {mailing.id}")
-            mailing.status = "done"
+            except Exception as e:
+                await session.rollback()
+                await _recover_mailing(mailing.id, mailing_report, e)
+            finally:
+                lease.cancel()
+
+
+async def send_mailing(
+    session: AsyncSession,
+    mailing: Mailing,
+    mailing_report: MailingReport,
+    moderators: List[int],
+    converter: MailingSendConverter,
+) -> None:
+    """Отправляет взятую в работу рассылку и переводит ее в done или failed"""
+    # Запуск таймера рассылки
+    mailing_report.start_timer()
+    progress_broker.publish(mailing.id, mailing_report.progress_snapshot())
+    url, prepared_data = converter.prepare_to_send(mailing)
+    # Ошибки считаются по тексту: у битой рассылки она одна у всех получателей
+    errors = Counter()
+
+    # Пробная партия модераторам уходит до аудитории и в отчет не входит
+    canary_pending = CANARY_SIZE > 0
+    if canary_pending and CANARY_TARGET == "moderators":
+        if moderators:
+            canary_pending = False
+            mailing_report.failure = await _run_canary(
+                url, prepared_data, moderators[:CANARY_SIZE], errors
+            )
+        else:
+            # Без проверки рассылка ушла бы всем сразу
+            logger.warning("Модераторов нет, пробная партия уходит первым получателям")
+
+    # Получатели сегмента читаются курсором пачками по AUDIENCE_STREAM_BATCH,
+    # а отправляется одновременно не больше MAILING_SEND_CONCURRENCY
+    # сообщений: следующая пачка читается, когда освобождаются места,
+    # поэтому память не растет вместе с аудиторией. Курсор держит
+    # соединение пула чтения, пока идет отправка
+    pending: Set[asyncio.Task] = set()
+    last_published = time.monotonic()
+    logger.info(f"Началась рассылка {mailing.id}")
+    try:
+        async with scheduler_db_manager.read_session() as read_session:
+            recipients = await read_session.stream_scalars(
+                queries.audience(mailing.audience),
+                execution_options={"yield_per": AUDIENCE_STREAM_BATCH},
+            )
+            async for tg_ids in recipients.partitions():
+                if mailing_report.failure:
+                    break
+                mailing_report.total += len(tg_ids)
+                if canary_pending:
+                    # Первые получатели первой пачки: остальным рассылка
+                    # уйдет, только если у них она дошла
+                    canary_pending = False
+                    canary, tg_ids = tg_ids[:CANARY_SIZE], tg_ids[CANARY_SIZE:]
+                    mailing_report.failure = await _run_canary(
+                        url, prepared_data, canary, errors, mailing_report
+                    )
+                    if mailing_report.failure:
+                        break
+                for tg_id in tg_ids:
+                    if len(pending) >= MAILING_SEND_CONCURRENCY:
+                        pending = await _collect_sent(pending, errors, mailing_report)
+                        last_published = _publish_progress(
+                            mailing.id, mailing_report, last_published
+                        )
+                    pending.add(
+                        asyncio.create_task(send_tg_message(url, prepared_data, tg_id))
+                    )
+        if pending:
+            pending = await _collect_sent(
+                pending, errors, mailing_report, asyncio.ALL_COMPLETED
+            )
+    finally:
+        # Если отправка прервалась, оставшиеся сообщения не уходят в фоне
+        for task in pending:
+            task.cancel()
+    if not mailing_report.total and not mailing_report.failure:
+        logger.warning(f"В сегменте рассылки {mailing.id} нет получателей")
+    mailing_report.stop_timer()
+    try:
+        progress_broker.publish(mailing.id, mailing_report.progress_snapshot())
+        _log_errors(mailing.id, errors)
+        if mailing_report.failure:
+            logger.error(
+                f"Рассылка {mailing.id} остановлена после пробной партии: "
+                f"{mailing_report.failure}"
+            )
+        _send_report(mailing_report, moderators)
+        logger.info(f"Началась рассылка для модераторов с отчетом по {mailing.id}")
+    finally:
+        # Статус пишется, даже если отчет разослать не удалось: иначе рассылка
+        # осталась бы в sending
+        if mailing_report.failure:
+            statement = queries.fail_mailing(mailing.id, mailing_report.failure)
+        else:
+            statement = queries.finish_mailing(mailing.id)
+        await session.execute(statement)
         await session.commit()
+
+
+async def _fail_stale_mailings(session: AsyncSession) -> None:
+    """
+    Помечает failed рассылки, которые висят в sending дольше
+    MAILING_CLAIM_TIMEOUT: их отправку прервало падение процесса. Часть
+    аудитории могла их уже получить, поэтому повторно они не отправляются
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=MAILING_CLAIM_TIMEOUT)
+    result = await session.execute(
+        queries.fail_stale_mailings(cutoff, STALE_MAILING_ERROR)
+    )
+    failed = result.scalars().all()
+    await session.commit()
+    if failed:
+        logger.error(f"Остановлены зависшие рассылки: {failed}")
+
+
+async def _keep_claimed(mailing_id: int) -> None:
+    """
+    Продлевает захват рассылки, пока она отправляется: долгая рассылка
+    не должна выглядеть брошенной и остановиться
+    """
+    while True:
+        await asyncio.sleep(MAILING_CLAIM_TIMEOUT / 3)
+        try:
+            async with scheduler_db_manager.session() as session:
+                await session.execute(
+                    queries.renew_claim(mailing_id, datetime.now(timezone.utc))
+                )
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Не удалось продлить захват рассылки {mailing_id}: {e}")
+
+
+async def _recover_mailing(
+    mailing_id: int, mailing_report: MailingReport, error: Exception
+) -> None:
+    """
+    Выводит рассылку из sending после ошибки в отправке. Если никому еще
+    ничего не ушло, рассылка возвращается в pending и повторится на следующей
+    проверке; иначе помечается failed, чтобы не отправить ее повторно тем,
+    кто уже получил
+    """
+    logger.exception(f"Отправка рассылки {mailing_id} прервана", exc_info=error)
+    retry = not mailing_report.processed
+    if retry:
+        statement = queries.release_mailing(mailing_id)
+    else:
+        mailing_report.failure = f"Отправка прервана: {type(error).__name__}: {error}"
+        statement = queries.fail_mailing(mailing_id, mailing_report.failure)
+    mailing_report.stop_timer()
+    progress_broker.publish(mailing_id, mailing_report.progress_snapshot())
+    try:
+        # Сессия отправки могла сломаться вместе с ней, статус пишется в новой
+        async with scheduler_db_manager.session() as session:
+            await session.execute(statement)
+            await session.commit()
+    except Exception:
+        # Рассылка останется в sending, ее остановит _fail_stale_mailings
+        logger.exception(f"Не удалось вывести рассылку {mailing_id} из sending")
+        return
+    if retry:
+        logger.warning(f"Рассылка {mailing_id} вернулась в ожидание")
+
+
+def _send_report(mailing_report: MailingReport, moderators) -> None:
+    """Рассылка статистики модерам"""
+    url, prepared_data = mailing_report.prepare_data_to_send()
+    for moderator_tg_id in moderators:
+        asyncio.create_task(send_tg_message(url, prepared_data, moderator_tg_id))
+
+
+async def _run_in_batches(build_statement) -> int:
+    """Выполняет пакетный запрос, пока он что-то затрагивает; транзакция на пачку"""
+    total = 0
+    while True:
+        async with scheduler_db_manager.session() as session:
+            result = await session.execute(build_statement())
+            await session.commit()
+        total += result.rowcount
+        if result.rowcount < ARCHIVE_BATCH_SIZE:
+            return total
+
+
+async def archive_finished_mailings():
+    """
+    Переносит старые отправленные и остановленные рассылки в архив и чистит
+    устаревший архив
+    """
+    now = datetime.now(timezone.utc)
+    archived = await _run_in_batches(
+        lambda: queries.archive_finished_mailings(
+            now - timedelta(days=ARCHIVE_AFTER_DAYS), ARCHIVE_BATCH_SIZE
+        )
+    )
+    if archived:
+        logger.info(f"Перенесено в архив рассылок: {archived}")
+    if ARCHIVE_RETENTION_DAYS <= 0:
+        return
+    purged = await _run_in_batches(
+        lambda: queries.purge_archive(
+            now - timedelta(days=ARCHIVE_RETENTION_DAYS), ARCHIVE_BATCH_SIZE
+        )
+    )
+    if purged:
+        logger.info(f"Удалено из архива рассылок: {purged}")
@@ -1,17 +1,184 @@
-from httpx import AsyncClient
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+from httpx import AsyncClient, Limits, Response, Timeout, TransportError
+
+from circuitbreaker import CircuitBreaker
+from config import (
+    ETAG_CACHE_SIZE,
+    SEARCH_PAGE_SIZE,
+    MAILING_PAGE_SIZE,
+    API_MAX_CONNECTIONS,
+    API_MAX_KEEPALIVE_CONNECTIONS,
+    API_CONNECT_TIMEOUT,
+    API_READ_TIMEOUT,
+    API_POOL_TIMEOUT,
+    API_RETRIES,
+    API_RETRY_BACKOFF,
+    API_RETRY_MAX_WAIT,
+    API_BREAKER_FAILURES,
+    API_BREAKER_RESET_TIMEOUT,
+)
+from metrics import current_profile, record
+
+
+logger = logging.getLogger("ApiAccessorLogger")
+
+# Апи отклонило запрос, не выполняя его (лимиты, сброс нагрузки): повтор безопасен
+REJECTED_STATUSES = (429, 503)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+def _retry_after(response: Response) -> Optional[float]:
+    """Пауза из заголовка Retry-After: секунды или HTTP-дата"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
 
 
 class ApiAccessor:
     def __init__(self, api_url: str, token: str):
         self.api_url = api_url
         self.token = token
-        self.client = AsyncClient()
+        self.client = AsyncClient(
+            limits=Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=Timeout(
+                connect=API_CONNECT_TIMEOUT,
+                read=API_READ_TIMEOUT,
+                write=API_READ_TIMEOUT,
+                pool=API_POOL_TIMEOUT,
+            ),
+        )
+        self.breaker = CircuitBreaker(API_BREAKER_FAILURES, API_BREAKER_RESET_TIMEOUT)
         self.headers = {"Authorization": f"{self.token}"}
+        # url -> (ETag, последний ответ 200) для условных GET
+        self._etag_cache: OrderedDict[str, Tuple[str, Response]] = OrderedDict()
+        self._prefetch_tasks: Set[asyncio.Task] = set()
+
+    async def close(self):
+        for task in self._prefetch_tasks:
+            task.cancel()
+        await self.client.aclose()
+
+    def prefetch(self, method: Callable, *args, **kwargs) -> None:
+        """
+        Запускает условный GET в фоне, пока пользователь смотрит текущую страницу.
+        Ответ оседает в кэше ETag, и переход на нее стоит 304 без тела
+        """
+        task = asyncio.create_task(self._prefetch(method, *args, **kwargs))
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+
+    @staticmethod
+    async def _prefetch(method: Callable, *args, **kwargs) -> None:
+        # Задача унаследовала контекст хендлера, но в его замеры не входит
+        current_profile.set(None)
+        try:
+            await method(*args, **kwargs)
+        except Exception as e:
+            logger.debug(f"Предзагрузка не удалась: {e!r}")
+
+    async def _request(
+        self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs
+    ) -> Response:
+        """
+        Запрос к апи через предохранитель с ограниченными повторами.
+        Отклоненные апи запросы (429, 503) повторяются всегда, сетевые сбои и 5xx -
+        только для идемпотентных запросов, чтобы не создать рассылку дважды
+        :param idempotent: можно ли повторять; по умолчанию определяется по методу
+        :raise CircuitOpenError: апи недоступно, запрос не отправлялся
+        """
+        start = time.perf_counter()
+        try:
+            return await self._request_with_retries(method, url, idempotent, **kwargs)
+        finally:
+            record("api", time.perf_counter() - start)
+
+    async def _request_with_retries(
+        self, method: str, url: str, idempotent: Optional[bool], **kwargs
+    ) -> Response:
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault("headers", self.headers)
+        attempt = 0
+        while True:
+            trial = self.breaker.check()
+            delay = API_RETRY_BACKOFF * 2**attempt
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except TransportError as e:
+                self.breaker.record_failure()
+                if not idempotent or attempt >= API_RETRIES:
+                    raise
+                logger.warning(f"{method} {url} не выполнен ({e!r}), повторяю")
+            except BaseException:
+                # Отмена, битый URL, ошибка декодирования ничего не говорят
+                # о доступности апи, но пробный запрос half_open освобождаем:
+                # иначе предохранитель отклонял бы запросы до перезапуска
+                if trial:
+                    self.breaker.abandon_trial()
+                raise
+            else:
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                retryable = response.status_code in REJECTED_STATUSES or (
+                    idempotent and response.status_code >= 500
+                )
+                if not retryable or attempt >= API_RETRIES:
+                    return response
+                delay = _retry_after(response) or delay
+                logger.warning(f"{method} {url}: {response.status_code}, повторяю")
+            attempt += 1
+            await asyncio.sleep(min(delay, API_RETRY_MAX_WAIT))
+
+    async def _conditional_get(self, url: str) -> Response:
+        """
+        GET с If-None-Match. На 304 отдается сохраненный ранее ответ,
+        так что вызывающий код всегда получает полный ответ.
+        """
+        headers = dict(self.headers)
+        cached = self._etag_cache.get(url)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        response = await self._request("GET", url, headers=headers)
+        if response.status_code == 304 and cached:
+            self._etag_cache.move_to_end(url)
+            return cached[1]
+        etag = response.headers.get("ETag")
+        if response.status_code == 200 and etag:
+            self._etag_cache[url] = (etag, response)
+            self._etag_cache.move_to_end(url)
+            while len(self._etag_cache) > ETAG_CACHE_SIZE:
+                self._etag_cache.popitem(last=False)
+        else:
+            self._etag_cache.pop(url, None)
+        return response
 
     async def register_new_user(self, name: str, user_id: int, role: str = "user"):
         url = self.api_url + "users/"
-        response = await self.client.post(
-            url=url,
+        response = await self._request(
+            "POST",
+            url,
             json={"name": name, "tg_id": user_id, "role": role},
             headers=self.headers,
         )
@@ -19,21 +186,55 @@ class ApiAccessor:
 
     async def get_user_by_tg_id(self, tg_id: int):
         url = self.api_url + f"users/{tg_id}"
-        response = await self.client.get(url=url, headers=self.headers)
-        return response
+        return await self._conditional_get(url)
 
     async def get_mailings(self):
         url = self.api_url + "mailings/"
-        response = await self.client.get(
-            url=url,
+        return await self._conditional_get(url)
+
+    async def get_mailings_page(
+        self, after: Optional[str] = None, before: Optional[str] = None
+    ):
+        """
+        Страница ожидающих рассылок
+        :param after: next_cursor текущей страницы
+        :param before: prev_cursor текущей страницы
+        """
+        params = {"limit": MAILING_PAGE_SIZE}
+        if after is not None:
+            params["after"] = after
+        if before is not None:
+            params["before"] = before
+        url = self.api_url + "mailings/page?" + urlencode(params)
+        return await self._conditional_get(url)
+
+    async def get_mailing(self, mailing_id: int):
+        url = self.api_url + f"mailings/{mailing_id}"
+        return await self._conditional_get(url)
+
+    async def search_users(self, query: str, page: int = 0):
+        url = self.api_url + "users/search"
+        response = await self._request(
+            "GET",
+            url,
+            params={"q": query, "page": page, "page_size": SEARCH_PAGE_SIZE},
             headers=self.headers,
         )
         return response
 
+    async def search_mailings(self, query: str, status: str = None, page: int = 0):
+        url = self.api_url + "mailings/search"
+        params = {"q": query, "page": page, "page_size": SEARCH_PAGE_SIZE}
+        if status:
+            params["status"] = status
+        response = await self._request("GET", url, params=params, headers=self.headers)
+        return response
+
     async def get_user_roles(self):
         url = self.api_url + "users/constraints/roles"
-        response = await self.client.get(
-            url=url,
+        response = await self._request(
+            "GET",
+            url,
             follow_redirects=True,
             headers=self.headers,
         )
@@ -41,8 +242,11 @@ class ApiAccessor:
 
     async def update_user_role_by_tg_id(self, tg_id: int, role: str):
         url = self.api_url + f"users/{tg_id}"
-        response = await self.client.patch(
-            url=url,
+        response = await self._request(
+            "PATCH",
+            url,
+            # Повтор выставит ту же роль
+            idempotent=True,
             json={"role": role},
             headers=self.headers,
         )
@@ -57,8 +261,9 @@ class ApiAccessor:
             data.update({"send_at": send_at})
         if extra:
             data.update({"extra": extra})
-        response = await self.client.post(
-            url=url,
+        response = await self._request(
+            "POST",
+            url,
             json=data,
             headers=self.headers,
         )
@@ -70,23 +275,51 @@ class ApiAccessor:
         creator_id: int,
         message: str,
         mailing_id: int,
+        version: int,
         send_at=None,
         extra=None,
     ):
         url = self.api_url + f"mailings/{mailing_id}"
-        data = {"name": name, "creator_id": creator_id, "message": message}
+        # version - с какой версии рассылки начиналась правка, иначе апи вернет 409
+        data = {
+            "name": name,
+            "creator_id": creator_id,
+            "message": message,
+            "version": version,
+        }
         if send_at:
             data.update({"send_at": send_at})
         if extra:
             data.update({"extra": extra})
-        response = await self.client.patch(
-            url=url,
+        response = await self._request(
+            "PATCH",
+            url,
             json=data,
             headers=self.headers,
         )
         return response
 
-    async def delete_mailing(self, mailing_id: int):
+    async def delete_mailing(self, mailing_id: int, version: Optional[int] = None):
         url = self.api_url + f"mailings/{mailing_id}"
-        response = await self.client.delete(url=url, headers=self.headers)
+        params = {"version": version} if version is not None else None
+        response = await self._request(
+            "DELETE", url, params=params, headers=self.headers
+        )
+        return response
+
+    async def batch(self, operations: List[Dict], read_only: bool = False):
+        """
+        Несколько операций апи за один запрос
+        :param operations: список {"op": ..., "params": {...}}
+        :param read_only: в пакете только чтение, его можно повторять
+        :return: ответ с results в том же порядке
+        """
+        url = self.api_url + "batch/"
+        response = await self._request(
+            "POST",
+            url,
+            idempotent=read_only,
+            json={"operations": operations},
+            headers=self.headers,
+        )
         return response
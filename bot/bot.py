@@ -2,20 +2,90 @@ import logging
 import asyncio
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.redis import RedisStorage
 
 from api_accessor import ApiAccessor
-from config import BOT_TOKEN, API_URL, REDIS_URL
+from config import (
+    BOT_TOKEN,
+    API_URL,
+    BOT_MODE,
+    WEBHOOK_WORKERS,
+    METRICS_ENABLED,
+    UPDATES_PER_CHAT_ORDER,
+    UPDATES_MAX_IN_FLIGHT,
+    UPDATES_MAX_PENDING,
+)
+from chatorder import ChatOrderMiddleware
 from handlers import router_v1
+from fsmunit import FSMUnitOfWorkMiddleware, build_storage
+from metrics import setup_metrics
+from rolecache import RoleCache
 from utils import get_api_token
+from webhook import run_webhook_workers, serve_webhook
 
 
-async def main_polling():
+def build_bot() -> Bot:
     bot = Bot(token=BOT_TOKEN)
     bot.api_accessor = ApiAccessor(api_url=API_URL, token=get_api_token())
-    dp = Dispatcher(storage=RedisStorage.from_url(REDIS_URL))
+    return bot
+
+
+def build_dispatcher(bot: Bot) -> Dispatcher:
+    storage = build_storage()
+    # Кэш ролей живет в том же Redis, что и состояния FSM
+    bot.role_cache = RoleCache(bot.api_accessor, storage.redis)
+    events_isolation = None
+    if BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1:
+        # Апдейты одного чата могут прийти в разные процессы: замок в Redis
+        # не дает им одновременно менять одно состояние FSM
+        events_isolation = storage.create_isolation()
+    dp = Dispatcher(
+        storage=storage, events_isolation=events_isolation, disable_fsm=True
+    )
+    # Порядок outer-мидлварей важен: очередь чата, замеры, затем FSM
+    chat_order = None
+    if UPDATES_PER_CHAT_ORDER:
+        chat_order = ChatOrderMiddleware(UPDATES_MAX_IN_FLIGHT)
+        dp.update.outer_middleware(chat_order)
+    bot.metrics_reporter = None
+    if METRICS_ENABLED:
+        bot.metrics_reporter = setup_metrics(dp, router_v1, bot)
+        if chat_order is not None:
+            bot.metrics_reporter.add_source("Очередь апдейтов", chat_order.stats)
+    # Вместо стандартной FSM-мидлвари: одно чтение и одна запись Redis на апдейт
+    dp.update.outer_middleware(FSMUnitOfWorkMiddleware(dp.fsm))
     dp.include_router(router_v1)
-    await dp.start_polling(bot)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def on_startup(bot: Bot):
+    bot.role_cache.start()
+    if bot.metrics_reporter is not None:
+        bot.metrics_reporter.start()
+
+
+async def on_shutdown(bot: Bot):
+    await bot.role_cache.stop()
+    if bot.metrics_reporter is not None:
+        await bot.metrics_reporter.stop()
+    await bot.api_accessor.close()
+    await bot.session.close()
+
+
+async def main_polling():
+    bot = build_bot()
+    dp = build_dispatcher(bot)
+    # Пока у бота зарегистрирован вебхук, getUpdates не работает
+    await bot.delete_webhook()
+    # Пока UPDATES_MAX_PENDING апдейтов ждут обработки, getUpdates не вызывается
+    await dp.start_polling(bot, tasks_concurrency_limit=UPDATES_MAX_PENDING)
+
+
+async def main_webhook(worker_index: int):
+    bot = build_bot()
+    dp = build_dispatcher(bot)
+    await serve_webhook(dp, bot, register=worker_index == 0)
 
 
 if __name__ == "__main__":
@@ -24,4 +94,7 @@ if __name__ == "__main__":
         format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
-    asyncio.run(main_polling())
+    if BOT_MODE == "webhook":
+        run_webhook_workers(main_webhook, WEBHOOK_WORKERS)
+    else:
+        asyncio.run(main_polling())
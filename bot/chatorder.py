@@ -0,0 +1,96 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.user_context import EVENT_CONTEXT_KEY
+from aiogram.types import TelegramObject
+
+
+class ChatOrderMiddleware(BaseMiddleware):
+    """
+    Outer-мидлварь апдейтов: апдейты разных чатов обрабатываются параллельно,
+    одного чата - строго по очереди, в порядке поступления. Одновременно
+    обрабатывается не больше max_in_flight апдейтов, остальные ждут.
+    Должна стоять перед FSM-мидлварью: иначе два апдейта одного чата прочитают
+    одно и то же состояние
+    """
+
+    def __init__(self, max_in_flight: int):
+        self._slots = asyncio.Semaphore(max_in_flight)
+        # chat_id -> замок очереди чата и сколько апдейтов в ней
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._depth: Dict[int, int] = {}
+        self.in_flight = 0
+        self.waiting = 0
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        self.peak_waiting = self.waiting
+        self.peak_chat_depth = max(self._depth.values(), default=0)
+        self.processed = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        queued_at = time.perf_counter()
+        context = data.get(EVENT_CONTEXT_KEY)
+        chat_id: Optional[int] = None
+        if context is not None:
+            chat_id = context.chat_id or context.user_id
+        if chat_id is None:
+            return await self._run(handler, event, data, queued_at)
+
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._depth[chat_id] = self._depth.get(chat_id, 0) + 1
+        self.peak_chat_depth = max(self.peak_chat_depth, self._depth[chat_id])
+        try:
+            # Lock отдает замок ожидающим по очереди, порядок апдейтов сохраняется
+            async with lock:
+                return await self._run(handler, event, data, queued_at)
+        finally:
+            self._depth[chat_id] -= 1
+            if not self._depth[chat_id]:
+                del self._depth[chat_id]
+                del self._locks[chat_id]
+
+    async def _run(self, handler, event, data, queued_at: float) -> Any:
+        """Ждет свободный слот; время ожидания считается вместе с очередью чата"""
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        wait = time.perf_counter() - queued_at
+        self.wait_time += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.processed += 1
+        self.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очередей за интервал с прошлого вызова, пики обнуляются"""
+        avg_wait = self.wait_time / self.processed if self.processed else 0.0
+        result = {
+            "processed": self.processed,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "queued": sum(self._depth.values()),
+            "chats_queued": len(self._depth),
+            "peak_waiting": self.peak_waiting,
+            "peak_chat_depth": self.peak_chat_depth,
+            "avg_wait_ms": round(avg_wait * 1000, 2),
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+        self._reset_window()
+        return result
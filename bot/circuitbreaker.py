@@ -0,0 +1,82 @@
+import logging
+import time
+from typing import Optional
+
+
+logger = logging.getLogger("CircuitBreakerLogger")
+
+
+class CircuitOpenError(Exception):
+    """Апи считается недоступным, запрос не отправлялся"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель запросов к апи.
+    closed - запросы идут как обычно, подряд идущие сбои считаются.
+    open - после failure_threshold сбоев подряд запросы сразу отклоняются
+    reset_timeout секунд, хендлеры не висят на таймаутах лежащего апи.
+    half_open - после паузы пропускается один пробный запрос: успех закрывает
+    предохранитель, сбой снова открывает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        # half_open: одновременно идет только один пробный запрос
+        if self._trial_in_flight:
+            return False
+        self._trial_in_flight = True
+        return True
+
+    def check(self) -> bool:
+        """
+        :return: True, если запрос - пробный запрос half_open
+        :raise CircuitOpenError: запрос сейчас отправлять нельзя
+        """
+        if not self.allow():
+            raise CircuitOpenError("Апи недоступно, запрос не отправлен")
+        return self._trial_in_flight
+
+    def abandon_trial(self) -> None:
+        """
+        Пробный запрос не дал ответа ни в ту, ни в другую сторону (отменен,
+        упал до отправки): следующий запрос станет новым пробным
+        """
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Апи снова отвечает, предохранитель закрыт")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"Апи не отвечает ({self.failures} сбоев подряд), "
+                    f"запросы отклоняются {self.reset_timeout} с"
+                )
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
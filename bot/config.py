@@ -14,3 +14,47 @@ SECRET_KEY = os.getenv("SECRET_KEY", "d3cb099dfcbe5c1f2d0514417928df9a")
 REDIS_URL = os.getenv("REDIS_URL_FOR_BOT", "redis://localhost:6379/0")
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
 ADMIN_KEY = os.getenv("ADMIN_KEY", "123")
+ETAG_CACHE_SIZE = int(os.getenv("ETAG_CACHE_SIZE", 256))
+SEARCH_MIN_QUERY_LENGTH = 3
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 10))
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", 20))
+API_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("API_MAX_KEEPALIVE_CONNECTIONS", 10))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", 3))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", 10))
+API_POOL_TIMEOUT = float(os.getenv("API_POOL_TIMEOUT", 5))
+API_RETRIES = int(os.getenv("API_RETRIES", 2))
+API_RETRY_BACKOFF = float(os.getenv("API_RETRY_BACKOFF", 0.3))
+API_RETRY_MAX_WAIT = float(os.getenv("API_RETRY_MAX_WAIT", 5))
+API_BREAKER_FAILURES = int(os.getenv("API_BREAKER_FAILURES", 5))
+API_BREAKER_RESET_TIMEOUT = float(os.getenv("API_BREAKER_RESET_TIMEOUT", 30))
+ROLE_CACHE_TTL = int(os.getenv("ROLE_CACHE_TTL", 300))
+ROLE_CACHE_MEMORY_TTL = float(os.getenv("ROLE_CACHE_MEMORY_TTL", 60))
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", 1024))
+ROLE_EVENTS_CHANNEL = os.getenv("ROLE_EVENTS_CHANNEL", "user_roles")
+MAILING_PAGE_SIZE = int(os.getenv("MAILING_PAGE_SIZE", 10))
+# polling - один процесс забирает getUpdates; webhook - Telegram сам присылает
+# апдейты на WEBHOOK_BASE_URL + WEBHOOK_PATH, воркеров может быть несколько
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 1))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", 60))
+# Через сколько секунд простоя сессия FSM (состояние и данные) удаляется из
+# Redis; 0 - хранить бессрочно
+FSM_SESSION_TTL = int(os.getenv("FSM_SESSION_TTL", 86400))
+# Апдейты одного чата обрабатываются по очереди, разных чатов - параллельно
+UPDATES_PER_CHAT_ORDER = os.getenv("UPDATES_PER_CHAT_ORDER", "true").lower() == "true"
+UPDATES_MAX_IN_FLIGHT = int(os.getenv("UPDATES_MAX_IN_FLIGHT", 50))
+UPDATES_MAX_PENDING = int(os.getenv("UPDATES_MAX_PENDING", 1000))
+# Куда бот загружает вложения по ссылке, чтобы получить file_id; 0 - в чат
+# админа, который собирает рассылку
+MEDIA_STORAGE_CHAT_ID = int(os.getenv("MEDIA_STORAGE_CHAT_ID", 0))
+MEDIA_CHECK_TIMEOUT = float(os.getenv("MEDIA_CHECK_TIMEOUT", 10))
+# Пределы Telegram для загрузки по ссылке: фото до 5 МБ, остальное до 20 МБ
+MEDIA_MAX_PHOTO_SIZE = int(os.getenv("MEDIA_MAX_PHOTO_SIZE", 5 * 1024 * 1024))
+MEDIA_MAX_FILE_SIZE = int(os.getenv("MEDIA_MAX_FILE_SIZE", 20 * 1024 * 1024))
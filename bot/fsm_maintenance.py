@@ -0,0 +1,144 @@
+"""
+Обслуживание сессий FSM бота в Redis.
+
+report - сколько ключей и памяти занимают сессии: всего, без TTL (записаны
+до появления FSM_SESSION_TTL), брошенные (простаивают дольше --max-idle) и
+осиротевшие (данные без состояния - из них уже нельзя продолжить диалог).
+purge - удаляет брошенные и осиротевшие ключи, остальным ключам без TTL
+выставляет FSM_SESSION_TTL, чтобы память Redis оставалась ограниченной.
+
+Запуск из каталога bot:
+    python -m fsm_maintenance report
+    python -m fsm_maintenance purge --max-idle 172800
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from config import REDIS_URL, FSM_SESSION_TTL
+from fsmunit import build_storage
+
+
+logger = logging.getLogger("FSMMaintenanceLogger")
+
+SCAN_BATCH = 500
+
+
+class SessionKey:
+    __slots__ = ("key", "session", "part", "ttl", "idle", "size")
+
+    def __init__(self, key: str, session: str, part: str):
+        self.key = key
+        self.session = session
+        self.part = part
+        self.ttl: int = -1
+        self.idle: Optional[int] = None
+        self.size: int = 0
+
+
+async def scan_sessions(redis: Redis, prefix: str) -> List[SessionKey]:
+    """Ключи состояний и данных FSM с TTL, простоем и размером"""
+    keys = []
+    async for raw in redis.scan_iter(match=f"{prefix}:*", count=SCAN_BATCH):
+        key = raw.decode() if isinstance(raw, bytes) else raw
+        session, _, part = key.rpartition(":")
+        if part in ("state", "data"):
+            keys.append(SessionKey(key, session, part))
+    for offset in range(0, len(keys), SCAN_BATCH):
+        batch = keys[offset : offset + SCAN_BATCH]
+        async with redis.pipeline(transaction=False) as pipe:
+            for item in batch:
+                pipe.ttl(item.key)
+                pipe.object("idletime", item.key)
+                pipe.memory_usage(item.key)
+            # idletime недоступен при LFU-политике вытеснения, тогда простой
+            # не учитывается
+            results = await pipe.execute(raise_on_error=False)
+        for index, item in enumerate(batch):
+            ttl, idle, size = results[index * 3 : index * 3 + 3]
+            item.ttl = ttl if isinstance(ttl, int) else -1
+            item.idle = idle if isinstance(idle, int) else None
+            item.size = size if isinstance(size, int) else 0
+    return keys
+
+
+def classify(keys: List[SessionKey], max_idle: int) -> Dict[str, List[SessionKey]]:
+    sessions_with_state = {item.session for item in keys if item.part == "state"}
+    groups = {"all": keys, "no_ttl": [], "idle": [], "orphaned": []}
+    for item in keys:
+        if item.part == "data" and item.session not in sessions_with_state:
+            groups["orphaned"].append(item)
+        elif max_idle and item.idle is not None and item.idle > max_idle:
+            groups["idle"].append(item)
+        elif item.ttl == -1:
+            groups["no_ttl"].append(item)
+    return groups
+
+
+def print_report(groups: Dict[str, List[SessionKey]]) -> None:
+    titles = {
+        "all": "Всего",
+        "no_ttl": "Без TTL",
+        "idle": "Брошенные",
+        "orphaned": "Осиротевшие",
+    }
+    for name, items in groups.items():
+        size = sum(item.size for item in items)
+        print(f"{titles[name]:>12}: {len(items)} ключей, {size / 1024:.1f} КБ")
+
+
+async def purge(redis: Redis, groups: Dict[str, List[SessionKey]], ttl: int) -> None:
+    doomed = [item.key for item in groups["idle"] + groups["orphaned"]]
+    for offset in range(0, len(doomed), SCAN_BATCH):
+        await redis.delete(*doomed[offset : offset + SCAN_BATCH])
+    if ttl:
+        async with redis.pipeline(transaction=False) as pipe:
+            for item in groups["no_ttl"]:
+                pipe.expire(item.key, ttl)
+            await pipe.execute()
+    logger.info(
+        f"Удалено {len(doomed)} ключей, TTL выставлен {len(groups['no_ttl'])} ключам"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    storage = build_storage(args.redis)
+    prefix = storage.key_builder.prefix
+    try:
+        groups = classify(await scan_sessions(storage.redis, prefix), args.max_idle)
+        print_report(groups)
+        if args.command == "purge":
+            await purge(storage.redis, groups, args.ttl)
+    except ResponseError as e:
+        logger.error(f"Redis отклонил команду: {e}")
+    finally:
+        await storage.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("command", choices=["report", "purge"])
+    parser.add_argument("--redis", default=REDIS_URL)
+    parser.add_argument(
+        "--max-idle",
+        type=int,
+        default=FSM_SESSION_TTL,
+        help="Сколько секунд простоя считать сессию брошенной, 0 - не считать",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=int,
+        default=FSM_SESSION_TTL,
+        help="TTL для оставшихся ключей без него, 0 - не выставлять",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,180 @@
+import copy
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, cast
+
+from aiogram import Bot
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.types import TelegramObject
+
+from config import REDIS_URL, FSM_SESSION_TTL
+from metrics import record
+
+
+def compact_json(data: Dict[str, Any]) -> str:
+    # Кириллица как есть, а не \uXXXX: данные сессий в Redis в ~3 раза меньше
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def build_storage(url: str = REDIS_URL, ttl: int = FSM_SESSION_TTL) -> RedisStorage:
+    """
+    Хранилище FSM бота
+    :param ttl: сколько секунд простоя живет сессия, 0 - бессрочно
+    """
+    return RedisStorage.from_url(
+        url, state_ttl=ttl or None, data_ttl=ttl or None, json_dumps=compact_json
+    )
+
+
+class FSMUnitOfWork(BaseStorage):
+    """
+    Состояние FSM одного апдейта.
+    load() читает состояние и данные одним MGET и продлевает их TTL, дальше
+    хендлер работает с копией в памяти, flush() пишет изменившееся одной
+    транзакцией в pipeline.
+    Ключи других чатов идут напрямую в storage
+    """
+
+    def __init__(self, storage: RedisStorage, key: StorageKey):
+        self.storage = storage
+        self.key = key
+        self._state: Optional[str] = None
+        self._data: Dict[str, Any] = {}
+        self._state_changed = False
+        self._data_changed = False
+
+    def _redis_key(self, part: str) -> str:
+        return self.storage.key_builder.build(self.key, part)
+
+    async def load(self) -> None:
+        state_key, data_key = self._redis_key("state"), self._redis_key("data")
+        start = time.perf_counter()
+        try:
+            # Без транзакции: чтение и продление TTL уходят одним пакетом
+            async with self.storage.redis.pipeline(transaction=False) as pipe:
+                pipe.mget(state_key, data_key)
+                # Сессия живет, пока ей пользуются: TTL отсчитывается от
+                # последнего апдейта, а не от последней записи
+                if self.storage.state_ttl:
+                    pipe.expire(state_key, self.storage.state_ttl)
+                if self.storage.data_ttl:
+                    pipe.expire(data_key, self.storage.data_ttl)
+                state, data = (await pipe.execute())[0]
+        finally:
+            record("fsm_reads", time.perf_counter() - start)
+        self._state = state.decode() if isinstance(state, bytes) else state
+        if data is not None:
+            if isinstance(data, bytes):
+                data = data.decode()
+            self._data = self.storage.json_loads(data)
+
+    async def flush(self) -> None:
+        """Записывает изменения за апдейт; если их не было, в Redis не ходит"""
+        if not (self._state_changed or self._data_changed):
+            return
+        start = time.perf_counter()
+        try:
+            async with self.storage.redis.pipeline(transaction=True) as pipe:
+                if self._state_changed:
+                    if self._state is None:
+                        pipe.delete(self._redis_key("state"))
+                    else:
+                        pipe.set(
+                            self._redis_key("state"),
+                            self._state,
+                            ex=self.storage.state_ttl,
+                        )
+                if self._data_changed:
+                    if not self._data:
+                        pipe.delete(self._redis_key("data"))
+                    else:
+                        pipe.set(
+                            self._redis_key("data"),
+                            self.storage.json_dumps(self._data),
+                            ex=self.storage.data_ttl,
+                        )
+                await pipe.execute()
+        finally:
+            record("fsm_writes", time.perf_counter() - start)
+        self._state_changed = self._data_changed = False
+
+    @property
+    def state(self) -> Optional[str]:
+        return self._state
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if key != self.key:
+            return await self.storage.set_state(key, state)
+        self._state = cast(str, state.state if isinstance(state, State) else state)
+        self._state_changed = True
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        if key != self.key:
+            return await self.storage.get_state(key)
+        return self._state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if key != self.key:
+            return await self.storage.set_data(key, data)
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        # Копии, как при чтении из Redis: хендлер может менять словарь дальше
+        self._data = copy.deepcopy(data)
+        self._data_changed = True
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        if key != self.key:
+            return await self.storage.get_data(key)
+        return copy.deepcopy(self._data)
+
+    async def close(self) -> None:
+        # Хранилище общее, его закрывает диспетчер
+        pass
+
+
+class FSMUnitOfWorkMiddleware(FSMContextMiddleware):
+    """
+    Замена стандартной FSM-мидлвари диспетчера: на время апдейта выдает
+    хендлерам FSMContext поверх FSMUnitOfWork и сбрасывает его после хендлера.
+    Подключается к Dispatcher(disable_fsm=True)
+    """
+
+    def __init__(self, dp_fsm: FSMContextMiddleware):
+        super().__init__(
+            storage=dp_fsm.storage,
+            events_isolation=dp_fsm.events_isolation,
+            strategy=dp_fsm.strategy,
+        )
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        bot: Bot = cast(Bot, data["bot"])
+        context = self.resolve_event_context(bot, data)
+        data["fsm_storage"] = self.storage
+        if context is None:
+            return await handler(event, data)
+        async with self.events_isolation.lock(key=context.key):
+            unit = FSMUnitOfWork(self.storage, context.key)
+            await unit.load()
+            data.update(
+                {
+                    "state": FSMContext(storage=unit, key=context.key),
+                    "raw_state": unit.state,
+                }
+            )
+            try:
+                return await handler(event, data)
+            finally:
+                # Записанное до ошибки в хендлере сохраняется, как и без буфера
+                await unit.flush()
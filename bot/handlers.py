@@ -1,4 +1,5 @@
 import logging
+from typing import Dict, List, Optional
 
 from aiogram import F, Router, types
 from aiogram.filters import Command, CommandStart
@@ -10,6 +11,8 @@ from config import (
     ALLOWED_TO_MAILING_CONSTRUCTOR_ROLES,
     DATETIME_FORMAT,
     ALLOWED_MEDIA_TYPES,
+    SEARCH_MIN_QUERY_LENGTH,
+    MEDIA_STORAGE_CHAT_ID,
 )
 from states import MailingCreate, AdminMenu
 from templates import start_command_text, error_text, admin_keyboard
@@ -23,6 +26,8 @@ from utils import (
     get_constructor,
 )
 from mailingreader import MailingReader
+from mediaupload import MediaRejectedError, upload_media
+from rolecache import RoleLookupError
 from mailingconstructor import (
     MailingConstructor,
     NameValidationError,
@@ -33,6 +38,50 @@ from mailingconstructor import (
 router_v1 = Router()
 logger = logging.getLogger("HandlerLogger")
 
+# Кнопки, которым нужны данные сессии FSM, по ключу этих данных. Сессия
+# истекает через FSM_SESSION_TTL простоя, а кнопки в чате остаются. Кнопки,
+# чьи хендлеры фильтруются по состоянию, после истечения не доходят до этой
+# проверки: на них отвечает stale_button
+SESSION_CALLBACKS = {
+    "constructor": (
+        "to_constructor_menu",
+        "add_button",
+        "add_media",
+        "change_name",
+        "change_message",
+        "change_send_at",
+        "change_button",
+        "delete_button",
+        "delete_media",
+        "save_mailing",
+        "save_change_mailing",
+        "exit_constructor",
+    ),
+    "mailing_ids": (
+        "change_mailing",
+        "delete_mailing",
+        "look_mailings_",
+        "mailings_page_",
+    ),
+}
+
+
+@router_v1.callback_query.middleware()
+async def expired_session_guard(handler, clbk: types.CallbackQuery, data: Dict):
+    """Отвечает на кнопки истекшей сессии вместо падения хендлера"""
+    for key, prefixes in SESSION_CALLBACKS.items():
+        if clbk.data.startswith(prefixes):
+            state: FSMContext = data["state"]
+            if key not in await state.get_data():
+                await state.clear()
+                await clbk.answer()
+                await clbk.message.answer(
+                    text="Сессия истекла, данные не сохранены. Начните заново"
+                )
+                return None
+            break
+    return await handler(clbk, data)
+
 
 @router_v1.message(CommandStart())
 async def start(msg: types.Message):
@@ -76,52 +125,167 @@ async def get_clear(msg: types.Message, state: FSMContext):
     await msg.answer(text="Вы чисты как младенец =)")
 
 
+async def get_role_or_answer(msg: types.Message) -> Optional[str]:
+    """
+    Роль автора сообщения из кэша ролей. Если ее нет, сам отвечает пользователю
+    :return: роль или None, если продолжать не нужно
+    """
+    try:
+        role = await msg.bot.role_cache.get_role(msg.from_user.id)
+    except RoleLookupError:
+        await msg.answer(text=error_text)
+        return None
+    if role is None:
+        await msg.answer(text="Такого пользователя нет в базе")
+    return role
+
+
 @router_v1.message(Command("adminmenu"))
 async def adminmenu(msg: types.Message, state: FSMContext):
     await state.clear()
-    user_id = msg.from_user.id
-    response = await make_safe_request(msg.bot.api_accessor.get_user_by_tg_id, user_id)
-    if not response:
-        await msg.answer(text=error_text)
+    role = await get_role_or_answer(msg)
+    if role is None:
         return
-    if response.status_code == 404:
-        await msg.answer(text=response.json()["detail"])
-        return
-    data = response.json()
-
-    if data["role"] not in ALLOWED_TO_ADMIN_MENU_ROLES:
+    if role not in ALLOWED_TO_ADMIN_MENU_ROLES:
         await msg.answer("Вы не имеете доступа к админ-меню")
         return
     await msg.answer(text="Админ меню", reply_markup=admin_keyboard)
 
 
-@router_v1.callback_query(F.data == "look_mailings")
-async def get_mailings(clbk: types.CallbackQuery, state: FSMContext):
-    response = await make_safe_request(clbk.bot.api_accessor.get_mailings)
-    if not response:
-        await clbk.message.answer(text=error_text)
-        await clbk.message.delete()
+def prefetch_neighbours(
+    api_accessor,
+    mailing_ids: List[int],
+    index: int,
+    prev_cursor: Optional[str],
+    next_cursor: Optional[str],
+) -> None:
+    """Заранее загружает то, что админ скорее всего откроет следующим"""
+    if index + 1 < len(mailing_ids):
+        api_accessor.prefetch(api_accessor.get_mailing, mailing_ids[index + 1])
+    elif next_cursor is not None:
+        api_accessor.prefetch(api_accessor.get_mailings_page, after=next_cursor)
+    if index == 0 and prev_cursor is not None:
+        api_accessor.prefetch(api_accessor.get_mailings_page, before=prev_cursor)
+
+
+async def show_mailing(
+    msg: types.Message,
+    state: FSMContext,
+    index: int,
+    mailing: Optional[Dict] = None,
+    note: str = "",
+) -> None:
+    """
+    Показывает рассылку index текущей страницы. В состоянии хранятся только id
+    рассылок страницы и курсоры соседних страниц, сама рассылка читается из апи
+    (обычно это 304 из кэша ETag)
+    :param mailing: рассылка, если она уже загружена вместе со страницей
+    :param note: дополнительная строка под рассылкой
+    """
+    redis_data = await state.get_data()
+    mailing_ids = redis_data.get("mailing_ids")
+    if mailing_ids is None:
+        # Сессия до перехода на страницы хранила рассылки целиком
+        await state.clear()
+        await msg.answer(text="Сессия истекла, данные не сохранены. Начните заново")
         return
-    data = response.json()
-    if not data:
-        await clbk.message.answer(text="Рассылок нет", reply_markup=admin_keyboard)
-        await clbk.message.delete()
-    mailings_count = len(data)
-    index = 0
-
-    text = MailingReader(data[index]).render()
-    text += f"\n\n Порядковый номер рассылки: {index + 1}/{mailings_count}"
+    prev_cursor = redis_data.get("prev_cursor")
+    next_cursor = redis_data.get("next_cursor")
+    if mailing is None:
+        response = await make_safe_request(
+            msg.bot.api_accessor.get_mailing, mailing_ids[index]
+        )
+        # Удаленной считаем только рассылку, которой апи не нашло. При прочих
+        # ошибках версия для удаления остается прежней
+        if not response or response.status_code not in (200, 404):
+            await msg.answer(text=error_text)
+            return
+        mailing = response.json() if response.status_code == 200 else None
 
-    # Сохраняем полученные рассылки в кэш, чтобы не бегать до API каждый раз
-    # current_index сохраняется для кнопок удаления и изменения
-    await state.set_data(data={"mailing_data": data, "current_index": index})
+    if mailing is None:
+        text = "Рассылка уже удалена или отправлена"
+    else:
+        text = MailingReader(mailing).render()
+    if redis_data.get("search"):
+        text += f"\n\n Совпадение: {index + 1}/{len(mailing_ids)}"
+    else:
+        text += f"\n\n Рассылка на странице: {index + 1}/{len(mailing_ids)}"
+    text += note
+    # Версия показанной рассылки нужна для удаления: апи сверит ее с текущей
+    await state.update_data(
+        data={
+            "current_index": index,
+            "current_version": mailing["version"] if mailing else None,
+        }
+    )
     await state.set_state(AdminMenu.look_mailings)
-    await clbk.answer()
-    await clbk.message.answer(
+    await msg.answer(
         text=text,
-        reply_markup=build_keyboard_for_mailing_look(index, mailings_count),
+        reply_markup=build_keyboard_for_mailing_look(
+            index,
+            len(mailing_ids),
+            has_prev_page=prev_cursor is not None,
+            has_next_page=next_cursor is not None,
+        ),
         parse_mode="HTML",
     )
+    prefetch_neighbours(
+        msg.bot.api_accessor, mailing_ids, index, prev_cursor, next_cursor
+    )
+
+
+async def open_mailings_page(
+    msg: types.Message,
+    state: FSMContext,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+) -> None:
+    """Загружает страницу рассылок по курсору и показывает ее крайнюю рассылку"""
+    response = await make_safe_request(
+        msg.bot.api_accessor.get_mailings_page, after=after, before=before
+    )
+    if not response or response.status_code != 200:
+        await msg.answer(text=error_text)
+        return
+    page = response.json()
+    items = page["items"]
+    if not items:
+        await state.clear()
+        await msg.answer(text="Рассылок нет", reply_markup=admin_keyboard)
+        return
+
+    await state.set_data(
+        data={
+            "mailing_ids": [mailing["id"] for mailing in items],
+            "prev_cursor": page["prev_cursor"],
+            "next_cursor": page["next_cursor"],
+        }
+    )
+    # Назад листаем с конца предыдущей страницы
+    index = len(items) - 1 if before is not None else 0
+    await show_mailing(msg, state, index, mailing=items[index])
+
+
+@router_v1.callback_query(F.data == "look_mailings")
+async def get_mailings(clbk: types.CallbackQuery, state: FSMContext):
+    await clbk.answer()
+    await open_mailings_page(clbk.message, state)
+    await clbk.message.delete()
+
+
+@router_v1.callback_query(AdminMenu.look_mailings, F.data == "mailings_page_next")
+async def get_next_mailings_page(clbk: types.CallbackQuery, state: FSMContext):
+    redis_data = await state.get_data()
+    await clbk.answer()
+    await open_mailings_page(clbk.message, state, after=redis_data.get("next_cursor"))
+    await clbk.message.delete()
+
+
+@router_v1.callback_query(AdminMenu.look_mailings, F.data == "mailings_page_prev")
+async def get_prev_mailings_page(clbk: types.CallbackQuery, state: FSMContext):
+    redis_data = await state.get_data()
+    await clbk.answer()
+    await open_mailings_page(clbk.message, state, before=redis_data.get("prev_cursor"))
     await clbk.message.delete()
 
 
@@ -130,7 +294,7 @@ async def set_index_query(clbk: types.CallbackQuery, state: FSMContext):
     await state.set_state(AdminMenu.index_query)
     await clbk.answer()
     await clbk.message.answer(
-        text="Напишите порядковый номер рассылки, на которую хотите перейти. Для выхода напишите 'отмена'"
+        text="Напишите порядковый номер рассылки на странице. Для выхода напишите 'отмена'"
     )
 
 
@@ -148,49 +312,78 @@ async def index_search_mailing(msg: types.Message, state: FSMContext):
         return
 
     redis_data = await state.get_data()
-    mailing_data = redis_data.get("mailing_data")
-    mailings_count = len(mailing_data)
+    mailings_count = len(redis_data.get("mailing_ids"))
 
     if not 0 <= index < mailings_count:
         await msg.answer(text=f"Нужно отправить число от 1 до {mailings_count}")
         return
+    await show_mailing(msg, state, index)
 
-    text = MailingReader(mailing_data[index]).render()
-    text += f"\n\n Порядковый номер рассылки: {index + 1}/{mailings_count}"
-    await state.update_data(data={"current_index": index})
-    await state.set_state(AdminMenu.look_mailings)
-    await msg.answer(
-        text=text,
-        reply_markup=build_keyboard_for_mailing_look(index, mailings_count),
-        parse_mode="HTML",
+
+@router_v1.callback_query(AdminMenu.look_mailings, F.data == "mailing_text_search")
+async def set_text_query(clbk: types.CallbackQuery, state: FSMContext):
+    await state.set_state(AdminMenu.text_query)
+    await clbk.answer()
+    await clbk.message.answer(
+        text="Напишите часть названия или текста рассылки. Для выхода напишите 'отмена'"
     )
 
 
+@router_v1.message(AdminMenu.text_query)
+async def text_search_mailing(msg: types.Message, state: FSMContext):
+    if msg.text == "отмена":
+        await state.clear()
+        await msg.answer(text="Админ меню", reply_markup=admin_keyboard)
+        return
+    if not msg.text or len(msg.text) < SEARCH_MIN_QUERY_LENGTH:
+        await msg.answer(text=f"Нужно хотя бы {SEARCH_MIN_QUERY_LENGTH} символа")
+        return
+
+    response = await make_safe_request(
+        msg.bot.api_accessor.search_mailings, msg.text, status="pending"
+    )
+    if not response or response.status_code != 200:
+        await msg.answer(text=error_text)
+        return
+    found = response.json()
+    items = found["items"]
+    if not items:
+        await msg.answer(
+            text="Ничего не нашлось. Попробуйте другой запрос или напишите 'отмена'"
+        )
+        return
+
+    # Дальше листаем уже найденные рассылки, самые похожие - первыми
+    await state.set_data(
+        data={"mailing_ids": [mailing["id"] for mailing in items], "search": True}
+    )
+    note = ""
+    if found["has_more"]:
+        note = "\n Показаны самые похожие, уточните запрос, чтобы увидеть другие"
+    await show_mailing(msg, state, 0, mailing=items[0], note=note)
+
+
 @router_v1.callback_query(AdminMenu.look_mailings, F.data.startswith("look_mailings_"))
 async def search_mailing_by_order_index(clbk: types.CallbackQuery, state: FSMContext):
-    redis_data = await state.get_data()
-    mailing_data = redis_data.get("mailing_data")
     index = int(clbk.data.split("look_mailings_")[1])
-    mailings_count = len(mailing_data)
-
-    text = MailingReader(mailing_data[index]).render()
-    text += f"\n\n Порядковый номер рассылки: {index + 1}/{mailings_count}"
-    await state.update_data(data={"current_index": index})
     await clbk.answer()
-    await clbk.message.answer(
-        text=text,
-        reply_markup=build_keyboard_for_mailing_look(index, mailings_count),
-        parse_mode="HTML",
-    )
+    await show_mailing(clbk.message, state, index)
     await clbk.message.delete()
 
 
 @router_v1.callback_query(F.data == "change_mailing")
 async def change_mailing_init(clbk: types.CallbackQuery, state: FSMContext):
     redis_data = await state.get_data()
-    data = redis_data.get("mailing_data")
-    index = redis_data.get("current_index")
-    mailing = data[index]
+    mailing_id = redis_data["mailing_ids"][redis_data["current_index"]]
+    # Правка начинается с актуальной версии рассылки, а не с показанной ранее
+    response = await make_safe_request(clbk.bot.api_accessor.get_mailing, mailing_id)
+    if not response or response.status_code != 200:
+        await clbk.answer()
+        await clbk.message.answer(
+            text="Рассылка уже удалена или отправлена" if response else error_text
+        )
+        return
+    mailing = response.json()
 
     constructor = MailingConstructor(
         name=mailing["name"],
@@ -205,6 +398,8 @@ async def change_mailing_init(clbk: types.CallbackQuery, state: FSMContext):
             "constructor": constructor.to_dict(),
             "constructor_mode": "update",
             "mailing_id": mailing["id"],
+            # Версия, которую видел админ: апи отклонит правку, если ее уже сменили
+            "mailing_version": mailing["version"],
         }
     )
     await to_menu(constructor, state, clbk)
@@ -219,6 +414,7 @@ async def save_change_mailing(clbk: types.CallbackQuery, state: FSMContext):
     response = await make_safe_request(
         clbk.bot.api_accessor.update_mailing,
         mailing_id=mailing_id,
+        version=redis_data.get("mailing_version"),
         **constructor.to_db(),
     )
     if not response:
@@ -239,6 +435,16 @@ async def save_change_mailing(clbk: types.CallbackQuery, state: FSMContext):
         )
         await clbk.message.delete()
         return
+    if response.status_code in (404, 409):
+        # Рассылку успели изменить, удалить или она уже отправляется
+        await clbk.answer()
+        await state.clear()
+        await clbk.message.answer(
+            text=f"Рассылка не сохранена: {response.json()['detail']}. "
+            "Откройте список рассылок заново",
+        )
+        await clbk.message.delete()
+        return
     logger.info(f"Изменена рассылка {response.json()}")
     await clbk.answer()
     await state.clear()
@@ -248,9 +454,12 @@ async def save_change_mailing(clbk: types.CallbackQuery, state: FSMContext):
 @router_v1.callback_query(F.data == "delete_mailing")
 async def delete_mailing(clbk: types.CallbackQuery, state: FSMContext):
     redis_data = await state.get_data()
-    data = redis_data.get("mailing_data")
-    mailing_id = data[redis_data.get("current_index")]["id"]
-    response = await make_safe_request(clbk.bot.api_accessor.delete_mailing, mailing_id)
+    mailing_id = redis_data["mailing_ids"][redis_data["current_index"]]
+    response = await make_safe_request(
+        clbk.bot.api_accessor.delete_mailing,
+        mailing_id,
+        redis_data.get("current_version"),
+    )
 
     if not response:
         constructor = MailingConstructor.from_dict(redis_data.get("constructor"))
@@ -265,6 +474,11 @@ async def delete_mailing(clbk: types.CallbackQuery, state: FSMContext):
 
     await state.clear()
     await clbk.answer()
+    if response.status_code in (404, 409):
+        await clbk.message.answer(
+            text=f"Рассылка не удалена: {response.json()['detail']}",
+        )
+        return
     await clbk.message.answer(
         text="Рассылка удалена",
     )
@@ -283,7 +497,10 @@ async def set_change_role(clbk: types.CallbackQuery, state: FSMContext):
     await state.set_state(AdminMenu.choose_tg_id)
     await clbk.answer()
     await clbk.message.answer(
-        text="Пришлите айди пользователя, чью роль хотите изменить. Или напишите 'отмена' для выхода"
+        text=(
+            "Пришлите айди пользователя, чью роль хотите изменить, или часть его имени. "
+            "Или напишите 'отмена' для выхода"
+        )
     )
     await clbk.message.delete()
 
@@ -298,25 +515,80 @@ async def get_user_id_to_change(msg: types.Message, state: FSMContext):
     try:
         tg_id = int(msg.text)
     except (ValueError, TypeError):
-        await msg.answer(text="Не подходит. Нужно отправить целое число")
+        await search_user_to_change(msg)
         return
+    await show_user_to_change(msg, state, tg_id)
+
 
-    user_response = await make_safe_request(
-        msg.bot.api_accessor.get_user_by_tg_id, tg_id
+async def search_user_to_change(msg: types.Message) -> None:
+    """Ищет пользователей по имени и предлагает выбрать одного из найденных"""
+    if not msg.text or len(msg.text) < SEARCH_MIN_QUERY_LENGTH:
+        await msg.answer(
+            text=(
+                "Не подходит. Нужно отправить айди или хотя бы "
+                f"{SEARCH_MIN_QUERY_LENGTH} символа имени"
+            )
+        )
+        return
+    response = await make_safe_request(msg.bot.api_accessor.search_users, msg.text)
+    if not response or response.status_code != 200:
+        await msg.answer(text=error_text)
+        return
+    found = response.json()
+    if not found["items"]:
+        await msg.answer(
+            text="Никого не нашлось. Попробуйте ещё раз или напишите 'отмена'"
+        )
+        return
+    buttons = [
+        [(f"{user['name']} ({user['tg_id']})", f"pick_user_{user['tg_id']}")]
+        for user in found["items"]
+    ]
+    text = "Выберите пользователя или пришлите другой запрос"
+    if found["has_more"]:
+        text += "\nПоказаны самые похожие, уточните запрос, чтобы увидеть других"
+    await msg.answer(text=text, reply_markup=keyboard_builder(buttons))
+
+
+@router_v1.callback_query(AdminMenu.choose_tg_id, F.data.startswith("pick_user_"))
+async def pick_user_to_change(clbk: types.CallbackQuery, state: FSMContext):
+    tg_id = int(clbk.data.split("pick_user_")[1])
+    await clbk.answer()
+    await show_user_to_change(clbk.message, state, tg_id)
+    await clbk.message.delete()
+
+
+async def show_user_to_change(
+    msg: types.Message, state: FSMContext, tg_id: int
+) -> None:
+    """Показывает пользователя и кнопки выбора новой роли"""
+    # Пользователь и список ролей одним запросом к апи
+    response = await make_safe_request(
+        msg.bot.api_accessor.batch,
+        [
+            {"op": "get_user", "params": {"tg_id": tg_id}},
+            {"op": "get_roles"},
+        ],
+        read_only=True,
     )
-    if not user_response:
+    if not response or response.status_code != 200:
         await state.clear()
         await msg.answer(text=error_text)
         return
-    if user_response.status_code == 404:
+    user_result, roles_result = response.json()["results"]
+    if user_result["status_code"] == 404:
         await msg.answer(
-            text=user_response.json().get("detail")
+            text=user_result["body"].get("detail")
             + "\nПопробуйте ещё раз или напишите 'отмена'"
         )
         return
+    if user_result["status_code"] != 200 or roles_result["status_code"] != 200:
+        await state.clear()
+        await msg.answer(text=error_text)
+        return
 
     await state.set_data(data={"tg_id": tg_id})
-    user_data = user_response.json()
+    user_data = user_result["body"]
     await msg.answer(
         text=(
             f"Информация о пользователе:\n"
@@ -326,14 +598,7 @@ async def get_user_id_to_change(msg: types.Message, state: FSMContext):
         )
     )
 
-    # Получение ролей
-    roles_response = await make_safe_request(msg.bot.api_accessor.get_user_roles)
-    if not roles_response:
-        await state.clear()
-        await msg.answer(text=error_text)
-        return
-
-    roles = roles_response.json()["roles"]
+    roles = roles_result["body"]["roles"]
     buttons = []
     row = []
     exit_button = [("Выход", "mailings_exit")]
@@ -361,6 +626,8 @@ async def change_role(clbk: types.CallbackQuery, state: FSMContext):
         await clbk.message.answer(text=error_text)
         await clbk.message.delete()
         return
+    # Апи тоже оповестит через pub/sub, но свой кэш сбрасываем сразу
+    await clbk.bot.role_cache.invalidate(tg_id)
     await state.clear()
     await clbk.answer()
     await clbk.message.answer(text="Роль пользователя успешно изменена")
@@ -371,16 +638,10 @@ async def change_role(clbk: types.CallbackQuery, state: FSMContext):
 @router_v1.message(Command("newmailing"))
 async def new_maling_init(msg: types.Message, state: FSMContext):
     await state.clear()
-    user_id = msg.from_user.id
-    response = await make_safe_request(msg.bot.api_accessor.get_user_by_tg_id, user_id)
-    if not response:
-        await msg.answer(text=error_text)
+    role = await get_role_or_answer(msg)
+    if role is None:
         return
-    if response.status_code == 404:
-        await msg.answer(text=response.json()["detail"])
-        return
-    data = response.json()
-    if data["role"] not in ALLOWED_TO_MAILING_CONSTRUCTOR_ROLES:
+    if role not in ALLOWED_TO_MAILING_CONSTRUCTOR_ROLES:
         await msg.answer("Вы не имеете доступа к созданию рассылок")
         return
     await state.set_state(MailingCreate.choose_name)
@@ -532,7 +793,19 @@ async def get_media_url(msg: types.Message, state: FSMContext):
     if not url:
         await msg.answer(text="Была отправлена пустая строка или неправильный тип вложения(изображения нужно сжимать, иначе они считаются документом)")
         return
-    constructor.add_media(media_type, url)
+    file_id = None
+    if url == msg.text:
+        # Ссылку загружаем сейчас, а не при рассылке каждому получателю
+        try:
+            file_id = await upload_media(
+                msg.bot, media_type, url, MEDIA_STORAGE_CHAT_ID or msg.chat.id
+            )
+        except MediaRejectedError as e:
+            await msg.answer(
+                text=f"Вложение не подходит: {e}. Отправьте другое или 'отмена'"
+            )
+            return
+    constructor.add_media(media_type, url, file_id)
     await state.update_data(data={"constructor": constructor.to_dict()})
     await to_menu(constructor, state, msg)
 
@@ -768,3 +1041,14 @@ async def exit_constructor(clbk: types.CallbackQuery, state: FSMContext):
     await clbk.answer()
     await clbk.message.answer(text="Вы вышли из конструктора")
     await clbk.message.delete()
+
+
+# Последним: сюда попадают кнопки, которые не подошли ни одному хендлеру.
+# Обычно это кнопки просмотра рассылок или смены роли, чьи хендлеры ждут
+# состояние FSM, а сессия уже истекла. Без ответа у админа вечно крутится
+# загрузка на кнопке. Текущее состояние не сбрасываем: админ мог уже начать
+# в этом чате что-то другое
+@router_v1.callback_query()
+async def stale_button(clbk: types.CallbackQuery):
+    await clbk.answer()
+    await clbk.message.answer(text="Кнопка устарела: сессия истекла. Начните заново")
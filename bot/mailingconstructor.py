@@ -47,18 +47,40 @@ class MailingConstructor:
         self._media = media
         self._send_at = send_at
 
-    def to_dict(self):
-        return {
-            "name": self._name,
-            "message": self._message,
-            "creator_id": self._creator_id,
-            "send_at": self._send_at,
-            "extra": {"keyboard": self._keyboard, "media": self._media}
-        }
+    def to_dict(self) -> Dict:
+        """
+        Компактная форма для хранения в FSM: короткие ключи, пустые поля не
+        пишутся, кнопки и медиа - списками без имен полей
+        """
+        data = {"n": self._name, "m": self._message, "c": self._creator_id}
+        if self._send_at:
+            data["s"] = self._send_at
+        if self.has_keyboard:
+            data["k"] = [[button["text"], button["url"]] for button in self._keyboard]
+        if self.has_media:
+            data["md"] = [self._media["media_type"], self._media["url"]]
+            if "file_id" in self._media:
+                data["md"].append(self._media["file_id"])
+        return data
 
     @classmethod
     def from_dict(cls, d: dict):
-        return cls(name=d["name"], message=d["message"], creator_id=d["creator_id"], send_at=d["send_at"], keyboard=d["extra"].get("keyboard", []), media=d["extra"].get("media", {}))
+        if "extra" in d:
+            # Прежний формат: еще может лежать в сессиях, начатых до обновления
+            return cls(name=d["name"], message=d["message"], creator_id=d["creator_id"], send_at=d["send_at"], keyboard=d["extra"].get("keyboard", []), media=d["extra"].get("media", {}))
+        media = {}
+        if "md" in d:
+            media = {"media_type": d["md"][0], "url": d["md"][1]}
+            if len(d["md"]) > 2:
+                media["file_id"] = d["md"][2]
+        return cls(
+            name=d["n"],
+            message=d["m"],
+            creator_id=d["c"],
+            send_at=d.get("s"),
+            keyboard=[{"text": text, "url": url} for text, url in d.get("k", [])],
+            media=media,
+        )
 
     def add_button(self, text, url) -> None:
         self._keyboard.append({"text": text, "url": url})
@@ -69,8 +91,14 @@ class MailingConstructor:
     def replace_button(self, index: int, text: str, url: str) -> None:
         self._keyboard[index] = {"text": text, "url": url}
 
-    def add_media(self, media_type, url) -> None:
+    def add_media(self, media_type, url, file_id: Optional[str] = None) -> None:
+        """
+        :param url: исходная ссылка или file_id присланного файла
+        :param file_id: file_id загруженного по ссылке файла, его шлет рассылка
+        """
         self._media = {"media_type": media_type, "url": url}
+        if file_id:
+            self._media["file_id"] = file_id
 
     def delete_media(self) -> None:
         self._media = []
@@ -1,3 +1,4 @@
+import html
 from datetime import datetime
 from typing import List
 
@@ -22,6 +23,9 @@ class MailingReader:
             f"Статус: {status}",
             f"Сообщение: {message}",
         ]
+        if error := self.mailing.get("error"):
+            # Текст уходит с parse_mode=HTML, а ошибка Telegram может цитировать теги
+            text.insert(3, f"Ошибка отправки: {html.escape(error, quote=False)}")
         self._render_extra(text, extra)
         return "\n".join(text)
 
@@ -0,0 +1,87 @@
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from httpx import AsyncClient, HTTPError, InvalidURL
+
+from config import MEDIA_CHECK_TIMEOUT, MEDIA_MAX_PHOTO_SIZE, MEDIA_MAX_FILE_SIZE
+
+
+logger = logging.getLogger("MediaUploadLogger")
+
+# Какие Content-Type подходят под тип вложения
+CONTENT_TYPES = {
+    "photo": ("image/",),
+    "video": ("video/",),
+    "animation": ("image/gif", "video/"),
+}
+
+
+class MediaRejectedError(Exception):
+    """Вложение по ссылке нельзя использовать в рассылке"""
+
+
+def max_size(media_type: str) -> int:
+    return MEDIA_MAX_PHOTO_SIZE if media_type == "photo" else MEDIA_MAX_FILE_SIZE
+
+
+async def check_media_url(url: str, media_type: str) -> None:
+    """
+    Проверяет, что ссылка отвечает, ведет на файл нужного типа и не больше
+    предела Telegram для загрузки по ссылке. Тело файла не скачивается
+    :raise MediaRejectedError: с причиной для админа
+    """
+    try:
+        async with AsyncClient(
+            timeout=MEDIA_CHECK_TIMEOUT, follow_redirects=True
+        ) as client:
+            response = await client.head(url)
+            if response.status_code == 405:
+                # HEAD не поддерживается: берем только заголовки GET
+                async with client.stream("GET", url) as response:
+                    pass
+    except InvalidURL:
+        # Не наследник HTTPError: битую ссылку httpx отвергает до запроса
+        raise MediaRejectedError("ссылка некорректна")
+    except HTTPError as e:
+        raise MediaRejectedError(f"ссылка недоступна ({e.__class__.__name__})")
+    if response.status_code >= 400:
+        raise MediaRejectedError(f"ссылка ответила {response.status_code}")
+
+    content_type = response.headers.get("Content-Type", "")
+    if content_type and not content_type.startswith(CONTENT_TYPES[media_type]):
+        raise MediaRejectedError(f"по ссылке {content_type}, а не {media_type}")
+    size = response.headers.get("Content-Length")
+    if size and size.isdigit() and int(size) > max_size(media_type):
+        raise MediaRejectedError(
+            f"файл {int(size) // 1024 // 1024} МБ, "
+            f"можно до {max_size(media_type) // 1024 // 1024} МБ"
+        )
+
+
+async def upload_media(bot: Bot, media_type: str, url: str, chat_id: int) -> str:
+    """
+    Загружает вложение по ссылке в Telegram один раз, при сборке рассылки.
+    Рассылка потом отправляет file_id, и Telegram не скачивает файл заново
+    для каждого получателя
+    :param chat_id: куда отправить загруженное: чат админа или канал-хранилище
+    :return: file_id
+    :raise MediaRejectedError: ссылка недоступна, файл не того типа или велик
+    """
+    await check_media_url(url, media_type)
+    send = getattr(bot, f"send_{media_type}")
+    try:
+        message = await send(chat_id, url, disable_notification=True)
+    except TelegramAPIError as e:
+        raise MediaRejectedError(f"Telegram не смог загрузить файл: {e.message}")
+    content = getattr(message, media_type, None)
+    file_id: Optional[str] = None
+    if isinstance(content, list) and content:
+        file_id = content[-1].file_id
+    elif content is not None:
+        file_id = content.file_id
+    if file_id is None:
+        raise MediaRejectedError(f"Telegram принял файл не как {media_type}")
+    logger.info(f"Вложение {url} загружено, file_id {file_id}")
+    return file_id
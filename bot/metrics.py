@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, cast
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import METRICS_LOG_INTERVAL
+
+
+logger = logging.getLogger("MetricsLogger")
+
+
+class CallStats:
+    """Число и суммарная длительность вызовов одного вида"""
+
+    __slots__ = ("count", "time")
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def add(self, duration: float) -> None:
+        self.count += 1
+        self.time += duration
+
+
+class HandlerProfile:
+    """Замеры обработки одного апдейта"""
+
+    def __init__(self, event_type: str):
+        self.event_type = event_type
+        self.handler: Optional[str] = None
+        self.start = time.perf_counter()
+        self.total = 0.0
+        self.api = CallStats()
+        self.fsm_reads = CallStats()
+        self.fsm_writes = CallStats()
+        self.telegram = CallStats()
+
+
+current_profile: ContextVar[Optional[HandlerProfile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def record(kind: str, duration: float) -> None:
+    """
+    Учитывает вызов в замерах текущего хендлера, если он есть
+    :param kind: api, fsm_reads, fsm_writes или telegram
+    """
+    profile = current_profile.get()
+    if profile is not None:
+        getattr(profile, kind).add(duration)
+
+
+class HandlerMetrics:
+    """Агрегаты по хендлерам за текущий интервал отчета"""
+
+    KINDS = ("api", "fsm_reads", "fsm_writes", "telegram")
+
+    def __init__(self):
+        self._handlers: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+
+    def add(self, profile: HandlerProfile) -> None:
+        name = profile.handler or f"{profile.event_type}:unhandled"
+        stats = self._handlers[name]
+        stats["count"] += 1
+        stats["total_ms"] += profile.total * 1000
+        stats["max_ms"] = max(stats["max_ms"], profile.total * 1000)
+        for kind in self.KINDS:
+            calls: CallStats = getattr(profile, kind)
+            stats[f"{kind}_calls"] += calls.count
+            stats[f"{kind}_ms"] += calls.time * 1000
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Средние на один апдейт по каждому хендлеру"""
+        result = {}
+        for name, stats in self._handlers.items():
+            count = stats["count"]
+            item = {
+                "count": int(count),
+                "avg_ms": round(stats["total_ms"] / count, 2),
+                "max_ms": round(stats["max_ms"], 2),
+            }
+            for kind in self.KINDS:
+                item[f"avg_{kind}_calls"] = round(stats[f"{kind}_calls"] / count, 2)
+                item[f"avg_{kind}_ms"] = round(stats[f"{kind}_ms"] / count, 2)
+            result[name] = item
+        return result
+
+    def reset(self) -> None:
+        self._handlers.clear()
+
+
+handler_metrics = HandlerMetrics()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Outer-мидлварь апдейтов диспетчера: замеряет обработку апдейта целиком,
+    вместе с чтением и записью FSM и фильтрами. Должна стоять перед
+    FSM-мидлварью. Имя хендлера выставляет HandlerNameMiddleware
+    """
+
+    def __init__(self, metrics: HandlerMetrics = handler_metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        profile = HandlerProfile(cast(Update, event).event_type)
+        token = current_profile.set(profile)
+        try:
+            return await handler(event, data)
+        finally:
+            current_profile.reset(token)
+            profile.total = time.perf_counter() - profile.start
+            self.metrics.add(profile)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner-мидлварь: к этому моменту фильтры уже выбрали хендлер"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        profile = current_profile.get()
+        if profile is not None:
+            profile.handler = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class TelegramCallsMiddleware(BaseRequestMiddleware):
+    """Мидлварь сессии бота: учитывает запросы к Telegram Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            record("telegram", time.perf_counter() - start)
+
+
+class MetricsReporter:
+    """Раз в interval секунд пишет в лог сводку по хендлерам и обнуляет ее"""
+
+    def __init__(
+        self,
+        metrics: HandlerMetrics = handler_metrics,
+        interval: float = METRICS_LOG_INTERVAL,
+    ):
+        self.metrics = metrics
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        # name -> функция, отдающая словарь показателей для сводки
+        self._sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def add_source(self, name: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        self._sources[name] = stats
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.report()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.report()
+
+    def report(self) -> None:
+        for name, stats in self._sources.items():
+            logger.info(f"{name}: " + ", ".join(f"{k} {v}" for k, v in stats().items()))
+        summary = self.metrics.summary()
+        self.metrics.reset()
+        # Сначала хендлеры, которые суммарно заняли больше всего времени
+        ordered = sorted(
+            summary.items(),
+            key=lambda item: item[1]["avg_ms"] * item[1]["count"],
+            reverse=True,
+        )
+        for name, item in ordered:
+            logger.info(
+                f"{name}: {item['count']} раз, avg {item['avg_ms']} мс, "
+                f"max {item['max_ms']} мс | "
+                f"api {item['avg_api_calls']} x {item['avg_api_ms']} мс, "
+                f"fsm чтений {item['avg_fsm_reads_calls']} "
+                f"x {item['avg_fsm_reads_ms']} мс, "
+                f"fsm записей {item['avg_fsm_writes_calls']} "
+                f"x {item['avg_fsm_writes_ms']} мс, "
+                f"telegram {item['avg_telegram_calls']} "
+                f"x {item['avg_telegram_ms']} мс"
+            )
+
+
+def setup_metrics(dp, router, bot) -> MetricsReporter:
+    """
+    Подключает замеры к диспетчеру, роутеру и сессии бота.
+    Вызывать до регистрации FSM-мидлвари
+    """
+    dp.update.outer_middleware(MetricsMiddleware())
+    router.message.middleware(HandlerNameMiddleware())
+    router.callback_query.middleware(HandlerNameMiddleware())
+    bot.session.middleware(TelegramCallsMiddleware())
+    return MetricsReporter()
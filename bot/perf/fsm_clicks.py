@@ -0,0 +1,146 @@
+"""
+Сколько кликов по конструктору в секунду выдерживает FSM на Redis.
+
+Хендлер повторяет типичный клик конструктора: get_constructor (get_data),
+update_data, set_state и чтение режима в to_menu (get_data). Апдейты подаются
+прямо в диспетчер, без Bot API, так что меряется именно работа с FSM.
+Сравниваются стандартная FSM-мидлварь aiogram и FSMUnitOfWorkMiddleware.
+Нужен локальный Redis, база в нем очищается.
+
+Запуск из каталога bot:
+    python -m perf.fsm_clicks --redis redis://localhost:6379/15 --clicks 5000
+    python -m perf.fsm_clicks --concurrency 1 --output fsm_clicks.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict
+
+from aiogram import Bot, Dispatcher, Router, types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.redis import RedisStorage
+
+from fsmunit import FSMUnitOfWorkMiddleware, build_storage
+from states import MailingCreate
+
+
+BENCH_TOKEN = "42:BENCH"
+BENCH_CHATS = 100
+# Примерно как у конструктора рассылки с парой кнопок и вложением
+CONSTRUCTOR = {
+    "name": "Рассылка",
+    "message": "Текст рассылки " * 20,
+    "send_at": "2030-01-01T12:00:00",
+    "buttons": [["Кнопка", "https://example.com"]] * 3,
+    "media": [["photo", "https://example.com/image.png"]],
+}
+
+
+def build_click_router() -> Router:
+    router = Router()
+
+    @router.message()
+    async def click(msg: types.Message, state: FSMContext):
+        redis_data = await state.get_data()
+        constructor = redis_data.get("constructor") or dict(CONSTRUCTOR)
+        constructor["name"] = msg.text
+        await state.update_data({"constructor": constructor})
+        await state.set_state(MailingCreate.constructor_menu)
+        (await state.get_data()).get("constructor_mode", "create")
+
+    return router
+
+
+def build_dispatcher(storage: RedisStorage, mode: str) -> Dispatcher:
+    if mode == "unit":
+        dp = Dispatcher(storage=storage, disable_fsm=True)
+        dp.update.outer_middleware(FSMUnitOfWorkMiddleware(dp.fsm))
+    else:
+        dp = Dispatcher(storage=storage)
+    dp.include_router(build_click_router())
+    return dp
+
+
+def make_update(update_id: int) -> types.Update:
+    chat_id = update_id % BENCH_CHATS + 1
+    return types.Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+                "text": str(update_id),
+            },
+        }
+    )
+
+
+async def bench_mode(mode: str, args: argparse.Namespace) -> Dict:
+    storage = build_storage(args.redis)
+    await storage.redis.flushdb()
+    dp = build_dispatcher(storage, mode)
+    bot = Bot(token=BENCH_TOKEN)
+    updates = [make_update(update_id) for update_id in range(1, args.clicks + 1)]
+    commands_before = await _redis_commands(storage)
+    queue = iter(updates)
+
+    async def worker() -> None:
+        for update in queue:
+            await dp.feed_update(bot, update)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    commands = await _redis_commands(storage) - commands_before
+    await storage.close()
+    await bot.session.close()
+    return {
+        "mode": mode,
+        "clicks": args.clicks,
+        "elapsed_s": round(elapsed, 3),
+        "clicks_per_s": round(args.clicks / elapsed, 1),
+        "redis_commands_per_click": round(commands / args.clicks, 2),
+    }
+
+
+async def _redis_commands(storage: RedisStorage) -> int:
+    # Сам INFO тоже считается командой, на фоне тысяч кликов это шум
+    stats = await storage.redis.info("stats")
+    return int(stats["total_commands_processed"])
+
+
+async def main(args: argparse.Namespace) -> None:
+    modes = ["default", "unit"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        result = await bench_mode(mode, args)
+        results.append(result)
+        print(
+            f"{mode:>8}: {result['clicks_per_s']} кликов/с, "
+            f"{result['redis_commands_per_click']} команд Redis на клик"
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"args": vars(args), "results": results}, file, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--redis", default="redis://localhost:6379/15")
+    parser.add_argument("--mode", choices=["default", "unit", "both"], default="both")
+    parser.add_argument("--clicks", type=int, default=2000)
+    parser.add_argument(
+        "--concurrency", type=int, default=20, help="Апдейтов одновременно"
+    )
+    parser.add_argument("--output", help="Куда сохранить результат в JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,242 @@
+"""
+Сравнение задержки обработки апдейтов в режимах polling и webhook.
+
+Поднимает локальный фейковый Bot API: он отдает синтетические апдейты через
+getUpdates (polling) или сам отправляет их POST-запросом на вебхук бота, а затем
+ждет ответный sendMessage. Задержка апдейта - от его появления до sendMessage.
+Хендлер - простое эхо, так что меряется именно доставка, без апи и базы.
+
+Запуск из каталога bot:
+    python -m perf.update_latency --updates 2000 --rate 500
+    python -m perf.update_latency --mode webhook --output latency.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from typing import Dict, List
+
+from aiogram import Bot, Dispatcher, Router, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession, web
+
+from webhook import build_webhook_app
+
+
+BENCH_TOKEN = "42:BENCH"
+BENCH_CHATS = 100
+WEBHOOK_PATH = "/webhook"
+
+
+class FakeBotApi:
+    """Минимальный Bot API: getMe, getUpdates с long polling и sendMessage"""
+
+    def __init__(self):
+        self.pending: List[Dict] = []
+        self.new_updates = asyncio.Event()
+        self.created_at: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await request.post()
+        handler = getattr(self, f"_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _getMe(self, params) -> Dict:
+        return {"id": 42, "is_bot": True, "first_name": "bench", "username": "bench"}
+
+    async def _getUpdates(self, params) -> List[Dict]:
+        offset = int(params.get("offset", 0))
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self.new_updates.wait(), float(params.get("timeout", 10))
+                )
+            except asyncio.TimeoutError:
+                return []
+        return self.pending[:100]
+
+    async def _sendMessage(self, params) -> Dict:
+        update_id = int(params["text"])
+        self.latencies.append(time.perf_counter() - self.created_at[update_id])
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+        return {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "text": params["text"],
+        }
+
+    def make_update(self, update_id: int) -> Dict:
+        chat_id = update_id % BENCH_CHATS + 1
+        self.created_at[update_id] = time.perf_counter()
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+                "text": str(update_id),
+            },
+        }
+
+
+def build_echo_dispatcher() -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def echo(msg: types.Message):
+        await msg.answer(msg.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def produce(api: FakeBotApi, args: argparse.Namespace, deliver) -> None:
+    """Выдает апдейты с частотой args.rate в секунду"""
+    interval = 1 / args.rate
+    started = time.perf_counter()
+    for update_id in range(1, args.updates + 1):
+        delay = started + update_id * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await deliver(api.make_update(update_id))
+
+
+async def run_polling(api: FakeBotApi, bot: Bot, args: argparse.Namespace) -> None:
+    dp = build_echo_dispatcher()
+    polling = asyncio.create_task(
+        dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+    )
+
+    async def deliver(update: Dict) -> None:
+        api.pending.append(update)
+        api.new_updates.set()
+
+    await produce(api, args, deliver)
+    await asyncio.wait_for(api.done.wait(), args.timeout)
+    await dp.stop_polling()
+    await polling
+
+
+async def run_webhook(api: FakeBotApi, bot: Bot, args: argparse.Namespace) -> None:
+    dp = build_echo_dispatcher()
+    runner = await start_site(
+        build_webhook_app(dp, bot, path=WEBHOOK_PATH), args.webhook_port
+    )
+    url = f"http://127.0.0.1:{args.webhook_port}{WEBHOOK_PATH}"
+    # Как Telegram: ограниченное число параллельных соединений к вебхуку
+    semaphore = asyncio.Semaphore(args.connections)
+    tasks = set()
+    async with ClientSession() as client:
+
+        async def post(update: Dict) -> None:
+            async with semaphore:
+                async with client.post(url, json=update) as response:
+                    response.raise_for_status()
+
+        async def deliver(update: Dict) -> None:
+            task = asyncio.create_task(post(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        await produce(api, args, deliver)
+        await asyncio.wait_for(api.done.wait(), args.timeout)
+    await runner.cleanup()
+
+
+def summarize(mode: str, latencies: List[float], elapsed: float) -> Dict:
+    ordered = sorted(latencies)
+    quantiles = statistics.quantiles(ordered, n=100)
+    return {
+        "mode": mode,
+        "updates": len(ordered),
+        "elapsed_s": round(elapsed, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+async def bench_mode(mode: str, args: argparse.Namespace) -> Dict:
+    api = FakeBotApi()
+    api.expected = args.updates
+    api_runner = await start_site(api.app(), args.api_port)
+    session = AiohttpSession(
+        api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.api_port}")
+    )
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    started = time.perf_counter()
+    try:
+        if mode == "polling":
+            await run_polling(api, bot, args)
+        else:
+            await run_webhook(api, bot, args)
+    finally:
+        await session.close()
+        await api_runner.cleanup()
+    return summarize(mode, api.latencies, time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> None:
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        result = await bench_mode(mode, args)
+        results.append(result)
+        print(
+            f"{mode:>8}: {result['updates']} апдейтов, "
+            f"p50 {result['p50_ms']} мс, p99 {result['p99_ms']} мс, "
+            f"max {result['max_ms']} мс"
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"args": vars(args), "results": results}, file, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--mode", choices=["polling", "webhook", "both"], default="both"
+    )
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="Апдейтов в секунду")
+    parser.add_argument(
+        "--connections", type=int, default=40, help="Соединений к вебхуку"
+    )
+    parser.add_argument("--api-port", type=int, default=8091)
+    parser.add_argument("--webhook-port", type=int, default=8092)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Куда сохранить результат в JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
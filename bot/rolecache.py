@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from api_accessor import ApiAccessor
+from config import (
+    ROLE_CACHE_TTL,
+    ROLE_CACHE_MEMORY_TTL,
+    ROLE_CACHE_SIZE,
+    ROLE_EVENTS_CHANNEL,
+)
+from utils import make_safe_request
+
+
+logger = logging.getLogger("RoleCacheLogger")
+
+
+class RoleLookupError(Exception):
+    """Роль не удалось узнать: апи не ответило"""
+
+
+class RoleCache:
+    """
+    Кэш ролей для проверки прав в хендлерах.
+    Два уровня: память процесса (memory_ttl) и Redis (ttl, общий для всех
+    инстансов бота). Промах идет в апи. Апи публикует смену роли в pub/sub,
+    listen() сразу сбрасывает запись на обоих уровнях, TTL - страховка на случай
+    пропущенного события.
+    """
+
+    def __init__(
+        self,
+        api_accessor: ApiAccessor,
+        redis: Redis,
+        ttl: int = ROLE_CACHE_TTL,
+        memory_ttl: float = ROLE_CACHE_MEMORY_TTL,
+        max_size: int = ROLE_CACHE_SIZE,
+        channel: str = ROLE_EVENTS_CHANNEL,
+        prefix: str = "role:",
+    ):
+        self.api_accessor = api_accessor
+        self.redis = redis
+        self.ttl = ttl
+        self.memory_ttl = memory_ttl
+        self.max_size = max_size
+        self.channel = channel
+        self.prefix = prefix
+        # tg_id -> (роль, когда истекает)
+        self._memory: OrderedDict[int, Tuple[str, float]] = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get_role(self, tg_id: int) -> Optional[str]:
+        """
+        :return: роль пользователя или None, если он не зарегистрирован
+        :raise RoleLookupError: апи недоступно
+        """
+        cached = self._memory.get(tg_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self._memory.move_to_end(tg_id)
+            return cached[0]
+
+        role = await self._get_from_redis(tg_id)
+        if role is None:
+            response = await make_safe_request(
+                self.api_accessor.get_user_by_tg_id, tg_id
+            )
+            if response is None:
+                raise RoleLookupError(f"Не удалось получить роль {tg_id}")
+            # Незарегистрированных не кэшируем: после /start роль появится сразу
+            if response.status_code == 404:
+                return None
+            role = response.json()["role"]
+            await self._set_in_redis(tg_id, role)
+        self._remember(tg_id, role)
+        return role
+
+    async def invalidate(self, tg_id: int) -> None:
+        self._memory.pop(tg_id, None)
+        try:
+            await self.redis.delete(self._key(tg_id))
+        except RedisError as e:
+            logger.warning(f"Не удалось сбросить роль {tg_id} в Redis: {e}")
+
+    def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def listen(self) -> None:
+        """Слушает смены ролей из апи; после обрыва переподключается"""
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Пока подписки не было, события могли потеряться
+                    self._memory.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            await self._handle_event(message["data"])
+            except RedisError as e:
+                logger.warning(f"Подписка на смену ролей оборвалась: {e}")
+                await asyncio.sleep(1)
+            except Exception:
+                # Без подписки кэш ролей сбрасывался бы только по TTL до
+                # перезапуска бота. CancelledError сюда не попадает
+                logger.exception("Ошибка в подписке на смену ролей, переподключаюсь")
+                await asyncio.sleep(1)
+
+    async def _handle_event(self, data: bytes) -> None:
+        try:
+            tg_id = int(json.loads(data)["tg_id"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Непонятное событие смены роли: {data!r}")
+            return
+        await self.invalidate(tg_id)
+
+    def _remember(self, tg_id: int, role: str) -> None:
+        self._memory[tg_id] = (role, time.monotonic() + self.memory_ttl)
+        self._memory.move_to_end(tg_id)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _key(self, tg_id: int) -> str:
+        return f"{self.prefix}{tg_id}"
+
+    async def _get_from_redis(self, tg_id: int) -> Optional[str]:
+        try:
+            role = await self.redis.get(self._key(tg_id))
+        except RedisError as e:
+            logger.warning(f"Redis недоступен для кэша ролей: {e}")
+            return None
+        return role.decode() if role is not None else None
+
+    async def _set_in_redis(self, tg_id: int, role: str) -> None:
+        try:
+            await self.redis.set(self._key(tg_id), role, ex=self.ttl)
+        except RedisError as e:
+            logger.warning(f"Redis недоступен для кэша ролей: {e}")
@@ -4,6 +4,7 @@ from aiogram.fsm.state import StatesGroup, State
 class AdminMenu(StatesGroup):
     look_mailings = State()
     index_query = State()
+    text_query = State()
     change_role = State()
     choose_tg_id = State()
     choose_role = State()
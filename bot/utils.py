@@ -7,6 +7,7 @@ from httpx import Response
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 
+from circuitbreaker import CircuitOpenError
 from config import SECRET_KEY
 from states import MailingCreate
 from mailingconstructor import MailingConstructor
@@ -35,6 +36,9 @@ async def make_safe_request(method: Callable, *args, **kwargs) -> Optional[Respo
             )
             return None
         return response
+    except CircuitOpenError as e:
+        # Апи лежит: отвечаем пользователю сразу, без ожидания таймаута
+        logger.warning(e)
     except Exception as e:
         logger.error(e)
 
@@ -51,12 +55,17 @@ def keyboard_builder(rows: List[List[Tuple]]) -> types.InlineKeyboardMarkup:
 
 
 def build_keyboard_for_mailing_look(
-    current_index: int, mailings_count: int
+    current_index: int,
+    mailings_count: int,
+    has_prev_page: bool = False,
+    has_next_page: bool = False,
 ) -> types.InlineKeyboardMarkup:
     """
     Билдер для клавиатуры просмотра рассылок в админ-меню
-    :param current_index:
-    :param mailings_count:
+    :param current_index: номер рассылки на текущей странице
+    :param mailings_count: сколько рассылок на текущей странице
+    :param has_prev_page: есть ли страница до текущей
+    :param has_next_page: есть ли страница после текущей
     :return:
     """
     buttons = []
@@ -66,12 +75,18 @@ def build_keyboard_for_mailing_look(
         ("Изменить", "change_mailing"),
         ("Удалить", "delete_mailing"),
     ]
+    buttons.append([("Найти по тексту", "mailing_text_search")])
     if mailings_count > 1:
         buttons.append([("Ввести порядковый номер", "mailing_search")])
-        if current_index - 1 >= 0:
-            kb.append(("<---", f"look_mailings_{current_index - 1}"))
-        if current_index + 1 < mailings_count:
-            kb.append(("--->", f"look_mailings_{current_index + 1}"))
+    # Стрелки листают страницу, а на ее краю загружают соседнюю
+    if current_index - 1 >= 0:
+        kb.append(("<---", f"look_mailings_{current_index - 1}"))
+    elif has_prev_page:
+        kb.append(("<---", "mailings_page_prev"))
+    if current_index + 1 < mailings_count:
+        kb.append(("--->", f"look_mailings_{current_index + 1}"))
+    elif has_next_page:
+        kb.append(("--->", "mailings_page_next"))
     buttons.append(kb)
     buttons.append(change_delete_buttons)
     buttons.append(exit_button)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_MAX_CONNECTIONS,
+    UPDATES_MAX_PENDING,
+)
+
+
+logger = logging.getLogger("WebhookLogger")
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Как SimpleRequestHandler, но в фоне обрабатывается не больше max_pending
+    апдейтов. Сверх этого ответ Telegram задерживается, пока не освободится
+    место, и Telegram сам сбавляет темп, а не копит у бота тысячи задач
+    """
+
+    def __init__(self, *args, max_pending: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = asyncio.Semaphore(max_pending)
+
+    async def _handle_request_background(
+        self, bot: Bot, request: web.Request
+    ) -> web.Response:
+        await self._pending.acquire()
+        try:
+            return await super()._handle_request_background(bot, request)
+        except BaseException:
+            self._pending.release()
+            raise
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            self._pending.release()
+
+
+def build_webhook_app(
+    dp: Dispatcher,
+    bot: Bot,
+    path: str = WEBHOOK_PATH,
+    max_pending: Optional[int] = UPDATES_MAX_PENDING,
+) -> web.Application:
+    """
+    aiohttp-приложение, принимающее апдейты от Telegram. Апдейт обрабатывается
+    в фоне, Telegram сразу получает 200 и не ждет хендлер
+    :param max_pending: сколько апдейтов может ждать обработки, None - без предела
+    """
+    app = web.Application()
+    if max_pending:
+        handler = BoundedRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=WEBHOOK_SECRET or None,
+            max_pending=max_pending,
+        )
+    else:
+        handler = SimpleRequestHandler(
+            dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None
+        )
+    handler.register(app, path=path)
+    # Связывает startup/shutdown диспетчера с жизненным циклом приложения
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def ensure_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Регистрирует вебхук в Telegram, если там записан другой адрес"""
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужен WEBHOOK_BASE_URL")
+    url = WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH
+    info = await bot.get_webhook_info()
+    if info.url == url:
+        return
+    await bot.set_webhook(
+        url=url,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Вебхук зарегистрирован на {url}")
+
+
+async def serve_webhook(dp: Dispatcher, bot: Bot, register: bool = True) -> None:
+    """
+    Поднимает сервер вебхука и работает до отмены
+    :param register: регистрировать ли вебхук в Telegram (нужно одному воркеру)
+    """
+    app = build_webhook_app(dp, bot)
+    if register:
+
+        async def on_startup(_: web.Application) -> None:
+            await ensure_webhook(bot, dp)
+
+        app.on_startup.append(on_startup)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # reuse_port: несколько процессов слушают один порт, ядро делит между ними
+    # входящие соединения
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=True)
+    await site.start()
+    logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _run_worker(main: Callable[[int], Awaitable[None]], index: int) -> None:
+    try:
+        asyncio.run(main(index))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_webhook_workers(main: Callable[[int], Awaitable[None]], workers: int) -> None:
+    """
+    Запускает workers процессов с сервером вебхука на одном порту.
+    Состояния FSM общие через RedisStorage, поэтому апдейт может принять любой
+    воркер; так же их можно разнести по машинам за балансировщиком. Апдейты
+    одного чата в разных воркерах сериализует замок в Redis (см. bot.py)
+    :param main: корутина воркера, получает его номер
+    """
+    if workers <= 1:
+        _run_worker(main, 0)
+        return
+    processes = [
+        multiprocessing.Process(target=_run_worker, args=(main, index), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()